@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+异步子进程运行器
+长时间运行的ffmpeg/yt-dlp不再用 capture_output 把全部输出留在内存中：
+stdout 和 stderr 按行（\\r 和 \\n 都算换行，ffmpeg的进度信息以 \\r 结尾）流式读取，
+只在环形缓冲区中保留最后若干行，完整输出可以同时写入日志文件。
+stdout 是数据而不是日志时（例如 ffmpeg 输出到 pipe:1 的PCM），可以用 on_stdout 按块交给回调处理。
+
+子进程在独立的进程组中运行，超时或被取消时结束整个进程组（先 SIGTERM，宽限期后 SIGKILL），
+并删除未完成的输出文件。不使用 asyncio 的代码用 run_process 同步调用：所有线程中的子进程
+都由同一个后台事件循环管理，不会每次调用都创建新的事件循环。
+
+独立进程组中的子进程收不到终端的 Ctrl+C：在主线程中调用 run_process 时会自动处理，
+在工作线程中运行时，主线程收到 KeyboardInterrupt 后应调用 terminate_all()（JobGraph.run 会自动调用）。
+
+用法:
+    result = run_process(cmd, outputs=[output_file], timeout=3600, log_path="logs/extract.log")
+    if result.returncode != 0:
+        print("\\n".join(result.tail[-5:]))
+"""
+
+import asyncio
+import collections
+import contextlib
+import os
+import platform
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+
+# 环形缓冲区默认保留的行数
+DEFAULT_TAIL_LINES = 200
+# 结束进程组时 SIGTERM 后等待的时间（秒）
+TERMINATE_GRACE_SECONDS = 5
+READ_CHUNK_BYTES = 64 * 1024
+
+# 正在运行的子进程（terminate_all 使用）
+_live_processes = set()
+_live_lock = threading.Lock()
+# run_process 共用的后台事件循环
+_loop = None
+_loop_lock = threading.Lock()
+
+
+class ProcessTimeout(Exception):
+    """子进程超时（进程组已结束，未完成的输出已删除）"""
+
+    def __init__(self, cmd, timeout, result):
+        super().__init__(f"{Path(str(cmd[0])).name} 超过 {timeout} 秒未完成")
+        self.cmd = cmd
+        self.timeout = timeout
+        self.result = result
+
+
+class ProcessResult:
+    """子进程的运行结果
+
+    Attributes:
+        returncode: 返回码（超时或取消时为结束进程组后的返回码）
+        tail: 最后若干行输出（stdout 和 stderr 按到达顺序合并）
+        duration: 运行时间（秒）
+        log_path: 完整输出的日志文件（未写日志时为None）
+    """
+
+    def __init__(self, returncode, tail, duration, log_path=None):
+        self.returncode = returncode
+        self.tail = tail
+        self.duration = duration
+        self.log_path = log_path
+
+    def check(self, cmd):
+        """返回码不为0时抛出 subprocess.CalledProcessError（stderr 为最后20行输出）"""
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(self.returncode, cmd, stderr="\n".join(self.tail[-20:]))
+        return self
+
+
+class _LineSink:
+    """把输出行写入环形缓冲区和日志文件，原始输出可以同时写到终端"""
+
+    def __init__(self, tail_lines, log_file, echo):
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.log_file = log_file
+        self.echo = echo
+
+    def add(self, line, stream_name):
+        self.tail.append(line)
+        if self.log_file:
+            self.log_file.write(f"[{stream_name}] {line}\n")
+
+    def echo_chunk(self, chunk, stream_name):
+        # 原样输出（不按行重新输出），进度信息仍在终端的同一行中刷新
+        if self.echo:
+            target = sys.stderr if stream_name == "stderr" else sys.stdout
+            target.buffer.write(chunk)
+            target.buffer.flush()
+
+
+async def _pump(stream, sink, stream_name):
+    """按 \\r 和 \\n 分行读取一个输出流"""
+    pending = b""
+    while True:
+        chunk = await stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        sink.echo_chunk(chunk, stream_name)
+        pending += chunk
+        parts = pending.replace(b"\r", b"\n").split(b"\n")
+        pending = parts.pop()
+        for part in parts:
+            if part:
+                sink.add(part.decode("utf-8", "replace"), stream_name)
+    if pending:
+        sink.add(pending.decode("utf-8", "replace"), stream_name)
+
+
+async def _pump_chunks(stream, callback):
+    """把一个输出流按块交给回调（不分行，不进入缓冲区和日志）"""
+    while True:
+        chunk = await stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        callback(chunk)
+
+
+def _process_group_kwargs():
+    if platform.system() == "Windows":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+async def _kill_group(proc):
+    """结束子进程所在的整个进程组（ffmpeg/yt-dlp 可能启动了自己的子进程）"""
+    if proc.returncode is not None:
+        return
+    if platform.system() == "Windows":
+        # taskkill /T 结束整个进程树
+        killer = await asyncio.create_subprocess_exec("taskkill", "/T", "/F", "/PID", str(proc.pid),
+                                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        await killer.wait()
+        await proc.wait()
+        return
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), TERMINATE_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(proc.pid, signal.SIGKILL)
+        await proc.wait()
+
+
+def _remove_outputs(outputs):
+    for output in outputs:
+        with contextlib.suppress(OSError):
+            Path(output).unlink()
+
+
+async def run_async(cmd, outputs=(), timeout=None, log_path=None, tail_lines=DEFAULT_TAIL_LINES, echo=False,
+                    cwd=None, env=None, on_stdout=None):
+    """异步运行一个子进程
+
+    Args:
+        cmd: 命令列表
+        outputs: 命令生成的输出文件（超时或被取消时删除）
+        timeout: 超时时间（秒，None表示不限制）
+        log_path: 完整输出的日志文件（可选，追加写入）
+        tail_lines: 内存中保留的输出行数
+        echo: 是否同时输出到终端
+        cwd: 工作目录（可选）
+        env: 环境变量（可选）
+        on_stdout: stdout 数据块的回调（可选，在后台事件循环中调用，应尽快返回）；
+            设置后 stdout 不进入缓冲区和日志，回调抛出异常时结束进程组并删除输出
+
+    Returns:
+        ProcessResult: 运行结果（返回码不为0时不抛出异常，可用 result.check(cmd) 检查）
+
+    Raises:
+        ProcessTimeout: 超时
+        asyncio.CancelledError: 被取消（进程组已结束，输出已删除）
+    """
+    cmd = [str(arg) for arg in cmd]
+    log_file = None
+    if log_path:
+        Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+        log_file = open(log_path, "a", encoding="utf-8", errors="replace")
+        log_file.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} {' '.join(cmd)}\n")
+    sink = _LineSink(tail_lines, log_file, echo)
+    start = time.monotonic()
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            cwd=cwd, env=env, **_process_group_kwargs())
+        with _live_lock:
+            _live_processes.add(proc.pid)
+        stdout_reader = _pump_chunks(proc.stdout, on_stdout) if on_stdout else _pump(proc.stdout, sink, "stdout")
+        readers = asyncio.gather(stdout_reader, _pump(proc.stderr, sink, "stderr"))
+        try:
+            await asyncio.wait_for(asyncio.shield(readers), timeout)
+            returncode = await proc.wait()
+        except asyncio.TimeoutError:
+            await _kill_group(proc)
+            await readers
+            _remove_outputs(outputs)
+            sink.add(f"超时（{timeout} 秒），已结束进程组", "runner")
+            result = ProcessResult(proc.returncode, list(sink.tail), time.monotonic() - start, log_path)
+            raise ProcessTimeout(cmd, timeout, result) from None
+        except asyncio.CancelledError:
+            await _kill_group(proc)
+            with contextlib.suppress(Exception):
+                await readers
+            _remove_outputs(outputs)
+            sink.add("已取消，已结束进程组", "runner")
+            raise
+        except Exception:
+            # on_stdout 回调出错
+            await _kill_group(proc)
+            with contextlib.suppress(Exception):
+                await readers
+            _remove_outputs(outputs)
+            raise
+        return ProcessResult(returncode, list(sink.tail), time.monotonic() - start, log_path)
+    finally:
+        if proc:
+            with _live_lock:
+                _live_processes.discard(proc.pid)
+        if log_file:
+            log_file.close()
+
+
+def _background_loop():
+    """所有 run_process 调用共用的事件循环（在后台线程中运行）"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-runner", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+async def _start(coro):
+    return asyncio.ensure_future(coro)
+
+
+async def _join(task):
+    return await task
+
+
+async def _settle(task):
+    """等待任务结束（取消后等待进程组结束、未完成的输出删除）"""
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await task
+
+
+def run_process(cmd, **kwargs):
+    """同步运行一个子进程（参数同 run_async），可在任意线程中调用
+
+    子进程由共用的后台事件循环管理。按 Ctrl+C 时同样结束进程组并删除未完成的输出，
+    然后抛出 KeyboardInterrupt。
+    """
+    loop = _background_loop()
+    task = asyncio.run_coroutine_threadsafe(_start(run_async(cmd, **kwargs)), loop).result()
+    try:
+        return asyncio.run_coroutine_threadsafe(_join(task), loop).result()
+    except KeyboardInterrupt:
+        loop.call_soon_threadsafe(task.cancel)
+        asyncio.run_coroutine_threadsafe(_settle(task), loop).result()
+        raise
+
+
+def terminate_all():
+    """结束所有正在运行的子进程组（主线程收到 KeyboardInterrupt 时调用）
+
+    run_process 随后得到非0返回码，由调用者按失败处理（未完成的输出由 staged_output 清理）。
+    """
+    with _live_lock:
+        pids = list(_live_processes)
+    for pid in pids:
+        with contextlib.suppress(OSError):
+            if platform.system() == "Windows":
+                subprocess.run(["taskkill", "/T", "/F", "/PID", str(pid)], capture_output=True)
+            else:
+                os.killpg(pid, signal.SIGTERM)
+
+
+def log_path_for(config, name):
+    """配置了 processLogDir 时返回该目录下的日志文件路径，否则返回None"""
+    log_dir = (config or {}).get("processLogDir")
+    if not log_dir:
+        return None
+    return Path(log_dir) / f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.log"
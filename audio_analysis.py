@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+响度与峰值分析
+在提取/压缩音频的同一次ffmpeg调用中，用 asplit 分出一路音频送入 ebur128 和 astats 滤镜，
+同时得到 EBU R128 响度、真峰值和削波统计，不需要再单独解码一遍文件。
+分析结果保存为输出文件旁的 <文件名>.analysis.json
+"""
+
+import json
+import math
+import re
+import time
+from pathlib import Path
+
+
+# 分析结果只出现在ffmpeg结束时输出的末尾，保留最后这些行即可
+STDERR_TAIL_LINES = 400
+
+_NUMBER = r"(-?inf|-?nan|-?[\d.]+)"
+
+
+def build_analysis_filter(input_label="0:a:0", output_label="aout"):
+    """构建带分析分支的 filter_complex
+
+    ebur128 的逐帧日志设为 verbose 级别，默认日志级别下只输出最后的汇总，
+    避免长时间文件产生大量日志。
+
+    Args:
+        input_label: 输入音频流
+        output_label: 送去编码的输出标签
+
+    Returns:
+        list: 加到ffmpeg命令中的参数（-filter_complex ... -map ...）
+    """
+    graph = (
+        f"[{input_label}]asplit=2[{output_label}][analysis];"
+        "[analysis]ebur128=peak=true:framelog=verbose,astats=metadata=0,anullsink"
+    )
+    return ["-filter_complex", graph, "-map", f"[{output_label}]"]
+
+
+def _to_float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    # -inf（静音）等非有限值无法写入标准JSON
+    return number if math.isfinite(number) else None
+
+
+def parse_analysis_output(lines):
+    """从ffmpeg的stderr末尾解析 ebur128 和 astats 的汇总结果
+
+    Args:
+        lines: stderr 的最后若干行
+
+    Returns:
+        dict: 分析结果，无法解析时对应字段为None
+    """
+    text = "\n".join(lines)
+    result = {
+        "integrated_lufs": None,
+        "loudness_range_lu": None,
+        "true_peak_dbfs": None,
+        "sample_peak_dbfs": None,
+        "rms_dbfs": None,
+        "peak_count": None,
+        "clipped_samples": 0,
+        "true_peak_over": False,
+    }
+
+    summary_index = text.rfind("Summary:")
+    if summary_index >= 0:
+        summary = text[summary_index:]
+        match = re.search(rf"I:\s+{_NUMBER} LUFS", summary)
+        if match:
+            result["integrated_lufs"] = _to_float(match.group(1))
+        match = re.search(rf"LRA:\s+{_NUMBER} LU", summary)
+        if match:
+            result["loudness_range_lu"] = _to_float(match.group(1))
+        match = re.search(rf"Peak:\s+{_NUMBER} dBFS", summary)
+        if match:
+            result["true_peak_dbfs"] = _to_float(match.group(1))
+
+    # astats 先输出每个声道，最后输出 "Overall"
+    overall_index = text.rfind("Overall")
+    if overall_index >= 0:
+        overall = text[overall_index:]
+        match = re.search(rf"Peak level dB:\s+{_NUMBER}", overall)
+        if match:
+            result["sample_peak_dbfs"] = _to_float(match.group(1))
+        match = re.search(rf"RMS level dB:\s+{_NUMBER}", overall)
+        if match:
+            result["rms_dbfs"] = _to_float(match.group(1))
+        match = re.search(r"Peak count:\s+([\d.]+)", overall)
+        if match:
+            result["peak_count"] = int(float(match.group(1)))
+
+    # 采样峰值达到满刻度时，峰值计数即为削波的采样数
+    if result["sample_peak_dbfs"] is not None and result["sample_peak_dbfs"] >= -0.001:
+        result["clipped_samples"] = result["peak_count"] or 0
+    if result["true_peak_dbfs"] is not None and result["true_peak_dbfs"] > 0:
+        result["true_peak_over"] = True
+    return result
+
+
+def analysis_sidecar_path(audio_file):
+    audio_file = Path(audio_file)
+    return audio_file.parent / f"{audio_file.stem}.analysis.json"
+
+
+def write_analysis_sidecar(audio_file, analysis, source_file=None):
+    """将分析结果写入音频文件旁的JSON文件
+
+    Returns:
+        str: JSON文件路径
+    """
+    sidecar = analysis_sidecar_path(audio_file)
+    data = {
+        "file": Path(audio_file).name,
+        "source": str(source_file) if source_file else None,
+        "analyzed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **analysis,
+    }
+    tmp = sidecar.with_name(f".{sidecar.name}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    tmp.replace(sidecar)
+    return str(sidecar)
+
+
+def print_analysis(analysis):
+    """输出分析结果摘要"""
+    def fmt(value, unit):
+        return f"{value:.1f} {unit}" if isinstance(value, float) else "未知"
+
+    print(f"响度: {fmt(analysis['integrated_lufs'], 'LUFS')}，"
+          f"响度范围: {fmt(analysis['loudness_range_lu'], 'LU')}，"
+          f"真峰值: {fmt(analysis['true_peak_dbfs'], 'dBTP')}")
+    if analysis["clipped_samples"]:
+        print(f"警告: 检测到 {analysis['clipped_samples']} 个削波采样")
+    elif analysis["true_peak_over"]:
+        print("警告: 真峰值超过 0 dBTP（存在采样间削波）")
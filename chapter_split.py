@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按章节分轨
+长时间的ASMR和演唱会视频通常带有YouTube章节。本脚本从视频信息JSON或ffprobe读取章节，
+在一次ffmpeg调用中用 asplit + atrim 滤镜图输出每个章节的FLAC音轨，源文件只读取一遍。
+
+分轨边界按采样数计算（start_sample/end_sample），相邻音轨的结束和开始是同一个采样，
+拼接回去与原音频完全一致，不会有间隙或重叠。每个音轨写入标题、音轨号、专辑和艺术家标签。
+不使用 segment 混流器：它只能在数据包边界切分，而且不能为每段设置不同的标签。
+"""
+
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+from async_runner import run_process
+from convert_video import staged_conversion
+from output_stamps import is_up_to_date, stamp_outputs
+from resource_governor import get_governor
+from tool_utils import get_tool_exe
+
+
+# 音轨编码参数（保持24bit）
+TRACK_CODEC_ARGS = ["-c:a", "flac", "-compression_level", "12", "-sample_fmt", "s32"]
+# 分轨输出目录名（位于源文件所在目录）
+TRACKS_DIR_NAME = "tracks"
+
+_UNSAFE_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+def safe_filename(name, max_length=100):
+    """把章节标题转换为可用的文件名"""
+    name = _UNSAFE_CHARS.sub("_", name).strip(" .")
+    return name[:max_length] or "untitled"
+
+
+def _normalize_chapters(raw_chapters, duration=None):
+    """整理章节列表：按开始时间排序，去掉长度为0的章节，缺少结束时间时用下一章节的开始时间"""
+    chapters = sorted(
+        ({"start": float(c["start"]), "end": float(c["end"]) if c.get("end") is not None else None,
+          "title": (c.get("title") or "").strip()} for c in raw_chapters),
+        key=lambda c: c["start"],
+    )
+    for i, chapter in enumerate(chapters):
+        if chapter["end"] is None:
+            chapter["end"] = chapters[i + 1]["start"] if i + 1 < len(chapters) else duration
+    chapters = [c for c in chapters if c["end"] is None or c["end"] > c["start"]]
+    for i, chapter in enumerate(chapters, 1):
+        chapter["title"] = chapter["title"] or f"Track {i:02d}"
+    return chapters
+
+
+def chapters_from_info(info):
+    """从yt-dlp的视频信息中读取章节
+
+    Returns:
+        list: [{"start": 秒, "end": 秒, "title": 标题}]，没有章节时返回空列表
+    """
+    raw = [{"start": c.get("start_time", 0), "end": c.get("end_time"), "title": c.get("title")}
+           for c in info.get("chapters") or []]
+    return _normalize_chapters(raw, info.get("duration"))
+
+
+def probe_chapters(ffprobe_exe, media_file):
+    """用ffprobe读取文件中嵌入的章节
+
+    Returns:
+        list: 同 chapters_from_info，读取失败时返回空列表
+    """
+    cmd = [ffprobe_exe, "-v", "error", "-show_chapters", "-of", "json", str(media_file)]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        chapters = json.loads(result.stdout).get("chapters") or []
+    except (subprocess.CalledProcessError, OSError, json.JSONDecodeError):
+        return []
+    raw = [{"start": c.get("start_time", 0), "end": c.get("end_time"), "title": (c.get("tags") or {}).get("title")}
+           for c in chapters]
+    return _normalize_chapters(raw)
+
+
+def probe_sample_rate(ffprobe_exe, media_file):
+    """读取第一个音频流的采样率，失败时返回None"""
+    cmd = [ffprobe_exe, "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=sample_rate",
+           "-of", "json", str(media_file)]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        streams = json.loads(result.stdout).get("streams") or []
+        return int(streams[0]["sample_rate"]) if streams else None
+    except (subprocess.CalledProcessError, OSError, json.JSONDecodeError, KeyError, ValueError):
+        return None
+
+
+def track_paths(chapters, output_dir):
+    """每个章节对应的输出文件路径"""
+    output_dir = Path(output_dir)
+    width = max(2, len(str(len(chapters))))
+    return [output_dir / f"{i:0{width}d} - {safe_filename(c['title'])}.flac"
+            for i, c in enumerate(chapters, 1)]
+
+
+def build_split_command(ffmpeg_exe, source, chapters, outputs, sample_rate, album=None, artist=None):
+    """构建一次输出所有章节音轨的ffmpeg命令
+
+    Args:
+        ffmpeg_exe: ffmpeg可执行文件路径
+        source: 源文件（视频或已提取的音频）
+        chapters: 章节列表
+        outputs: 输出文件列表（与章节一一对应）
+        sample_rate: 源音频的采样率（用于把章节时间换算为采样数）
+        album: 专辑标签（通常为视频标题）
+        artist: 艺术家标签（通常为上传者）
+
+    Returns:
+        list: ffmpeg命令
+    """
+    branches = "".join(f"[c{i}]" for i in range(len(chapters)))
+    trims = []
+    for i, chapter in enumerate(chapters):
+        # 相邻章节共用同一个边界采样，保证无缝衔接
+        start = round(chapter["start"] * sample_rate)
+        trim = f"start_sample={start}"
+        # 最后一个章节一直到文件结尾（章节信息中的时长可能比实际音频短）
+        if chapter["end"] is not None and i + 1 < len(chapters):
+            trim += f":end_sample={round(chapter['end'] * sample_rate)}"
+        trims.append(f"[c{i}]atrim={trim},asetpts=PTS-STARTPTS[t{i}]")
+    graph = f"[0:a:0]asplit={len(chapters)}{branches};" + ";".join(trims)
+
+    cmd = [ffmpeg_exe, "-hide_banner", "-i", str(source), "-filter_complex", graph, "-y"]
+    total = len(chapters)
+    for i, (chapter, output) in enumerate(zip(chapters, outputs)):
+        cmd += ["-map", f"[t{i}]", "-map_metadata", "-1", "-map_chapters", "-1"] + TRACK_CODEC_ARGS
+        cmd += ["-metadata", f"title={chapter['title']}", "-metadata", f"track={i + 1}/{total}"]
+        if album:
+            cmd += ["-metadata", f"album={album}"]
+        if artist:
+            cmd += ["-metadata", f"artist={artist}", "-metadata", f"album_artist={artist}"]
+        cmd.append(str(output))
+    return cmd
+
+
+def split_chapters(source, chapters, ffmpeg_path=None, output_dir=None, album=None, artist=None,
+                   config=None, force=False):
+    """把源文件按章节分轨（一次ffmpeg调用）
+
+    Args:
+        source: 源文件（视频或已提取的音频，已提取的FLAC读取更快）
+        chapters: 章节列表
+        ffmpeg_path: ffmpeg路径
+        output_dir: 输出目录（默认为源文件目录下的 tracks/）
+        album: 专辑标签（默认为源文件名）
+        artist: 艺术家标签
+        config: 配置字典
+        force: 音轨已是最新时也重新分轨
+
+    Returns:
+        list: 输出的音轨路径
+
+    Raises:
+        RuntimeError: 找不到ffmpeg或分轨失败
+    """
+    source = Path(source)
+    ffmpeg_exe = get_tool_exe(ffmpeg_path, "ffmpeg")
+    ffprobe_exe = get_tool_exe(ffmpeg_path, "ffprobe")
+    if not ffmpeg_exe or not ffprobe_exe:
+        raise RuntimeError("未找到ffmpeg/ffprobe，无法分轨")
+    sample_rate = probe_sample_rate(ffprobe_exe, source)
+    if not sample_rate:
+        raise RuntimeError(f"无法读取音频采样率: {source.name}")
+
+    output_dir = Path(output_dir) if output_dir else source.parent / TRACKS_DIR_NAME
+    outputs = track_paths(chapters, output_dir)
+    cmd = build_split_command(ffmpeg_exe, source, chapters, outputs, sample_rate,
+                              album=album or source.stem, artist=artist)
+    if not force and is_up_to_date(outputs, cmd):
+        print(f"分轨已是最新，跳过: {output_dir}")
+        return [str(p) for p in outputs]
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    print(f"正在按章节分轨: {source.name} -> {len(outputs)} 个音轨")
+    with get_governor(config).acquire("cpu") as slot, \
+            staged_conversion(slot, cmd, [str(p) for p in outputs], config) as run_cmd:
+        result = run_process(run_cmd)
+        if result.returncode != 0:
+            detail = "；".join(line.strip() for line in result.tail[-3:])
+            raise RuntimeError(f"分轨失败（返回码 {result.returncode}）: {detail}")
+    stamp_outputs(outputs, cmd)
+    for output in outputs:
+        print(f"  {output.name}")
+    return [str(p) for p in outputs]
+
+
+def find_chapters(media_file, ffprobe_exe):
+    """读取文件的章节；音频文件本身没有章节时，读取同目录下同名视频文件中的章节"""
+    media_file = Path(media_file)
+    chapters = probe_chapters(ffprobe_exe, media_file)
+    if chapters:
+        return chapters
+    for ext in (".mp4", ".mkv", ".webm", ".mov"):
+        video_file = media_file.with_suffix(ext)
+        if video_file != media_file and video_file.exists():
+            chapters = probe_chapters(ffprobe_exe, video_file)
+            if chapters:
+                return chapters
+    return []
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help"):
+        print("使用方法: python chapter_split.py <音频或视频文件> [--info 视频信息JSON] [--output-dir 目录] [--force]")
+        print("示例: python chapter_split.py download/video/video.flac")
+        print("示例: python chapter_split.py video.mp4 --output-dir tracks")
+        print("\n参数说明:")
+        print("  --info        从yt-dlp的视频信息JSON读取章节（默认读取文件中嵌入的章节）")
+        print("  --output-dir  音轨输出目录（默认为源文件目录下的 tracks/）")
+        print("  --force       音轨已是最新时也重新分轨")
+        sys.exit(0 if args else 1)
+
+    force = "--force" in args
+    args = [a for a in args if a != "--force"]
+    options = {}
+    for name in ("--info", "--output-dir"):
+        if name in args:
+            index = args.index(name)
+            if index + 1 >= len(args):
+                print(f"错误: {name} 需要一个参数")
+                sys.exit(1)
+            options[name] = args[index + 1]
+            del args[index:index + 2]
+    if not args:
+        print("错误: 请指定要分轨的文件")
+        sys.exit(1)
+    source = Path(args[0])
+    if not source.exists():
+        print(f"错误: 文件不存在: {source}")
+        sys.exit(1)
+
+    album = artist = None
+    if "--info" in options:
+        with open(options["--info"], "r", encoding="utf-8") as f:
+            info = json.load(f)
+        chapters = chapters_from_info(info)
+        album, artist = info.get("title"), info.get("uploader")
+    else:
+        ffprobe_exe = get_tool_exe(None, "ffprobe")
+        if not ffprobe_exe:
+            print("错误: 未找到ffprobe")
+            sys.exit(1)
+        chapters = find_chapters(source, ffprobe_exe)
+    if not chapters:
+        print("没有找到章节信息，无需分轨")
+        return
+
+    try:
+        split_chapters(source, chapters, output_dir=options.get("--output-dir"), album=album, artist=artist,
+                       force=force)
+    except RuntimeError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,14 @@ import platform
 import shutil
 from pathlib import Path
 
+from async_runner import run_process
+from audio_analysis import (STDERR_TAIL_LINES, build_analysis_filter, parse_analysis_output, print_analysis,
+                            write_analysis_sidecar)
+from file_resolver import FileResolver
+from output_stamps import is_up_to_date, stamp_outputs
+from resource_governor import get_governor
+from scratch_staging import input_size, staged_output
+
 
 def find_ffmpeg_path():
     """查找ffmpeg路径"""
@@ -50,97 +58,29 @@ def find_ffmpeg_path():
     return None
 
 
-def find_wav_file(wav_path):
+def find_wav_file(wav_path, resolver=None):
     """查找WAV文件，处理路径中的特殊字符和编码问题
     
     Args:
         wav_path: WAV文件路径（可能是用户输入的路径）
+        resolver: 批量处理时共享的 FileResolver（可选，避免重复扫描同一目录）
     
     Returns:
         Path对象，如果找到文件；否则返回None
     """
-    # 移除路径中的引号（如果用户用引号包裹路径）
-    clean_path = wav_path.strip('"\'')
-    
-    # 尝试多种方法查找文件
-    methods = [
-        # 方法1: 直接使用路径
-        lambda: Path(clean_path) if Path(clean_path).exists() and Path(clean_path).is_file() else None,
-        # 方法2: 使用绝对路径
-        lambda: Path(clean_path).resolve() if Path(clean_path).resolve().exists() and Path(clean_path).resolve().is_file() else None,
-        # 方法3: 使用os.path规范化（对Windows路径更友好）
-        lambda: Path(os.path.normpath(clean_path)) if Path(os.path.normpath(clean_path)).exists() and Path(os.path.normpath(clean_path)).is_file() else None,
-    ]
-    
-    for method in methods:
-        try:
-            result = method()
-            if result:
-                return result
-        except Exception:
-            continue
-    
-    # 如果路径指向的是目录，尝试在该目录中查找wav文件
-    try:
-        test_path = Path(clean_path)
-        if test_path.exists() and test_path.is_dir():
-            # 查找目录中的所有wav文件
-            wav_files = list(test_path.glob("*.wav"))
-            if len(wav_files) == 1:
-                print(f"提示: 在目录中找到WAV文件: {wav_files[0]}")
-                return wav_files[0]
-            elif len(wav_files) > 1:
-                print(f"提示: 在目录中找到多个WAV文件，使用第一个: {wav_files[0].name}")
-                for i, f in enumerate(wav_files[:5], 1):  # 只显示前5个
-                    print(f"  {i}. {f.name}")
-                return wav_files[0]
-    except Exception:
-        pass
-    
-    # 如果路径是文件路径但不存在，尝试在父目录中查找
-    try:
-        parent_dir = Path(clean_path).parent
-        if parent_dir.exists() and parent_dir.is_dir():
-            # 查找目录中的所有wav文件
-            wav_files = list(parent_dir.glob("*.wav"))
-            if len(wav_files) == 1:
-                print(f"提示: 在父目录中找到WAV文件: {wav_files[0]}")
-                return wav_files[0]
-            elif len(wav_files) > 1:
-                # 尝试匹配文件名（不区分大小写）
-                input_name = Path(clean_path).stem.lower().replace(" ", "").replace("_", "").replace("-", "")
-                best_match = None
-                best_score = 0
-                
-                for wav_file in wav_files:
-                    file_name = wav_file.stem.lower().replace(" ", "").replace("_", "").replace("-", "")
-                    # 计算匹配度
-                    if input_name in file_name or file_name in input_name:
-                        score = min(len(input_name), len(file_name)) / max(len(input_name), len(file_name), 1)
-                        if score > best_score:
-                            best_score = score
-                            best_match = wav_file
-                
-                if best_match:
-                    print(f"提示: 找到匹配的WAV文件: {best_match}")
-                    return best_match
-                else:
-                    # 如果没找到匹配的，返回第一个
-                    print(f"提示: 在父目录中找到多个WAV文件，使用第一个: {wav_files[0]}")
-                    return wav_files[0]
-    except Exception:
-        pass
-    
-    return None
+    if resolver is None:
+        resolver = FileResolver({".wav"}, "WAV文件")
+    return resolver.resolve(wav_path)
 
 
-def compress_wav_to_flac(wav_path, ffmpeg_path=None, compression_level=12):
+def compress_wav_to_flac(wav_path, ffmpeg_path=None, compression_level=12, analyze=False):
     """将WAV文件压缩为FLAC格式
     
     Args:
         wav_path: WAV文件路径
         ffmpeg_path: ffmpeg路径（可选）
         compression_level: FLAC压缩级别（0-12，默认12，12是最高压缩/最小文件）
+        analyze: 是否在同一次解码中进行响度/峰值分析
     """
     # 查找WAV文件
     wav_file = find_wav_file(wav_path)
@@ -202,6 +142,11 @@ def compress_wav_to_flac(wav_path, ffmpeg_path=None, compression_level=12):
     cmd = [
         str(ffmpeg_exe.absolute()),
         "-i", str(wav_abs_path),
+    ]
+    if analyze:
+        # 同一次解码中分出一路音频做响度/峰值分析
+        cmd.extend(build_analysis_filter())
+    cmd += [
         "-c:a", "flac",  # 音频编码器为flac
         "-compression_level", str(compression_level),  # FLAC压缩级别（0-12）
         "-y",  # 覆盖已存在的输出文件
@@ -213,8 +158,14 @@ def compress_wav_to_flac(wav_path, ffmpeg_path=None, compression_level=12):
 
 def main():
     """主函数"""
-    if len(sys.argv) < 2:
-        print("使用方法: python compress_wav_to_flac.py <WAV文件路径> [压缩级别]")
+    # --analyze: 在同一次解码中进行响度/峰值分析，结果保存为 .analysis.json
+    analyze = "--analyze" in sys.argv
+    # --force: 忽略处理记录，输出文件已是最新时也重新处理
+    force = "--force" in sys.argv
+    argv = [a for a in sys.argv if a not in ("--analyze", "--force")]
+    
+    if len(argv) < 2:
+        print("使用方法: python compress_wav_to_flac.py <WAV文件路径> [压缩级别] [--analyze] [--force]")
         print("示例: python compress_wav_to_flac.py audio.wav")
         print("示例: python compress_wav_to_flac.py audio.wav 12")
         print("示例: python compress_wav_to_flac.py download/audio/audio.wav")
@@ -222,20 +173,22 @@ def main():
         print("  0-12: FLAC压缩级别（默认12）")
         print("  0: 最快，文件最大")
         print("  12: 最慢，文件最小（推荐）")
+        print("\n  --analyze: 同时分析EBU R128响度、真峰值和削波，结果保存为 <文件名>.analysis.json")
+        print("  --force: 输出文件已是最新（输入、参数和ffmpeg版本都没有变化）时也重新处理")
         sys.exit(1)
     
-    wav_path = sys.argv[1]
+    wav_path = argv[1]
     
     # 解析压缩级别参数（可选）
     compression_level = 12  # 默认最高压缩级别
-    if len(sys.argv) >= 3:
+    if len(argv) >= 3:
         try:
-            compression_level = int(sys.argv[2])
+            compression_level = int(argv[2])
             if compression_level < 0 or compression_level > 12:
                 print(f"警告: 压缩级别必须在0-12之间，使用默认值12")
                 compression_level = 12
         except ValueError:
-            print(f"警告: 无效的压缩级别 '{sys.argv[2]}'，使用默认值12")
+            print(f"警告: 无效的压缩级别 '{argv[2]}'，使用默认值12")
             compression_level = 12
     
     # 查找ffmpeg路径
@@ -250,13 +203,24 @@ def main():
     # 压缩WAV文件
     print(f"正在压缩WAV文件: {wav_path}")
     print(f"压缩级别: {compression_level} (0=最快/最大文件, 12=最慢/最小文件)")
-    cmd, output_file = compress_wav_to_flac(wav_path, ffmpeg_path, compression_level)
+    cmd, output_file = compress_wav_to_flac(wav_path, ffmpeg_path, compression_level, analyze=analyze)
     
     print(f"输出文件: {output_file}")
-    print(f"执行命令: {' '.join(cmd)}")
+    
+    if not force and is_up_to_date([output_file], cmd):
+        print("输出文件已由相同的输入、参数和ffmpeg版本生成，跳过（--force 强制重新压缩）")
+        return
     
     try:
-        result = subprocess.run(cmd, check=True, capture_output=False)
+        with get_governor().acquire("cpu") as slot, staged_output(output_file, expected_bytes=input_size(cmd)) as staged:
+            # 先写入临时文件，完成后原子发布到输出路径
+            run_cmd = slot.apply_to_ffmpeg(cmd[:-1] + [staged])
+            print(f"执行命令: {' '.join(run_cmd)}")
+            if analyze:
+                stderr_tail = run_process(run_cmd, echo=True, tail_lines=STDERR_TAIL_LINES).check(run_cmd).tail
+            else:
+                result = subprocess.run(run_cmd, check=True, capture_output=False)
+        stamp_outputs([output_file], cmd)
         
         # 显示文件大小信息
         if Path(output_file).exists():
@@ -269,6 +233,11 @@ def main():
             print(f"原始大小: {wav_size:.2f} MB")
             print(f"压缩后大小: {flac_size:.2f} MB")
             print(f"压缩率: {compression_ratio:.1f}%")
+        
+        if analyze:
+            analysis = parse_analysis_output(stderr_tail)
+            print_analysis(analysis)
+            print(f"分析结果: {write_analysis_sidecar(output_file, analysis, wav_path)}")
     except subprocess.CalledProcessError as e:
         print(f"\n压缩WAV文件时出错: {e}")
         sys.exit(1)
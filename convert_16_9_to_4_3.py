@@ -4,13 +4,50 @@
 图像比例转换工具
 将16:9的图片转换为4:3比例，使用背景模糊效果
 处理方法：将原图放大填满4:3画幅并模糊化作为背景，然后将原图适应放在中间位置
+
+视频使用同样的效果，由一个ffmpeg滤镜图完成：背景分支先缩小到 1/BLUR_DOWNSCALE 再模糊，
+模糊后的画面只剩低频内容，放大回原尺寸与全分辨率模糊几乎没有区别，需要模糊的像素数却只有 1/BLUR_DOWNSCALE²。
+--benchmark 对比两种方法的处理速度和画面差异（SSIM）。
+视频按 convert_video 的格式类型编码，音频直接复制。
 """
 
 import os
+import re
 import sys
+import time
 from pathlib import Path
+
+import PIL
 from PIL import Image, ImageFilter
 
+from async_runner import run_process
+from convert_video import (
+    FORMAT_TYPES, GPU_DETECT_FORMATS, VIDEO_EXTENSIONS, VideoConversionError, detect_gpu_encoders,
+    encoder_resource_class, find_ffmpeg_path, preset_encoder_args, probe_video_size, staged_conversion,
+)
+from encoder_benchmark import EncoderBenchmark
+from output_stamps import is_up_to_date, stamp_outputs
+from resource_governor import get_governor
+from tool_utils import get_tool_exe
+
+
+# 背景模糊半径
+BLUR_RADIUS = 20
+# 原图在4:3画幅中占用的比例（留5%边距）
+FIT_RATIO = 0.95
+# 输出JPEG质量
+JPEG_QUALITY = 95
+# 视频背景分支的缩小倍数（模糊半径按同样的倍数缩小）
+BLUR_DOWNSCALE = 4
+# 性能对比默认处理的视频时长（秒）
+BENCHMARK_SECONDS = 10
+
+
+def conversion_recipe(image_path):
+    """转换参数（用于输出文件的处理记录，参数变化时重新生成）"""
+    return ["convert_16_9_to_4_3", str(Path(image_path).absolute()), "ratio=4:3",
+            f"blur={BLUR_RADIUS}", f"fit={FIT_RATIO}", f"quality={JPEG_QUALITY}"]
+
 
 def convert_16_9_to_4_3(image_path):
     """
@@ -36,6 +73,14 @@ def convert_16_9_to_4_3(image_path):
         print(f"错误：不支持的图片格式 - {image_path.suffix}")
         return None
     
+    # 生成输出文件名（在原文件名基础上添加后缀）
+    output_path = image_path.parent / f"{image_path.stem}_4_3{image_path.suffix}"
+    recipe = conversion_recipe(image_path)
+    tools = {"Pillow": PIL.__version__}
+    if is_up_to_date([output_path], recipe, inputs=[image_path], tools=tools):
+        print(f"4:3封面已是最新，跳过: {output_path.name}")
+        return str(output_path)
+    
     try:
         # 打开原始图片
         original_image = Image.open(image_path)
@@ -83,7 +128,7 @@ def convert_16_9_to_4_3(image_path):
         background = background.crop((left, top, right, bottom))
         
         # 步骤2：模糊化背景
-        background = background.filter(ImageFilter.GaussianBlur(radius=20))
+        background = background.filter(ImageFilter.GaussianBlur(radius=BLUR_RADIUS))
         
         # 将模糊的背景粘贴到画布上
         canvas.paste(background, (0, 0))
@@ -92,11 +137,11 @@ def convert_16_9_to_4_3(image_path):
         # 计算原图在4:3画幅中的适应尺寸（保持宽高比，尽可能大但不超出画幅）
         if original_ratio > target_ratio:
             # 原图更宽，以宽度为准适应（确保不超出画幅宽度）
-            fit_width = int(target_width * 0.95)  # 留5%边距
+            fit_width = int(target_width * FIT_RATIO)
             fit_height = int(fit_width / original_ratio)
         else:
             # 原图更高，以高度为准适应（确保不超出画幅高度）
-            fit_height = int(target_height * 0.95)  # 留5%边距
+            fit_height = int(target_height * FIT_RATIO)
             fit_width = int(fit_height * original_ratio)
         
         # 调整原图大小以适应
@@ -115,11 +160,9 @@ def convert_16_9_to_4_3(image_path):
         else:
             canvas.paste(fitted_image, (paste_x, paste_y))
         
-        # 生成输出文件名（在原文件名基础上添加后缀）
-        output_path = image_path.parent / f"{image_path.stem}_4_3{image_path.suffix}"
-        
         # 保存图片
-        canvas.save(output_path, quality=95)
+        canvas.save(output_path, quality=JPEG_QUALITY)
+        stamp_outputs([output_path], recipe, inputs=[image_path], tools=tools)
         
         print(f"成功：已生成4:3比例的图片 - {output_path}")
         return str(output_path)
@@ -131,15 +174,255 @@ def convert_16_9_to_4_3(image_path):
         return None
 
 
+def _even(value):
+    """取不小于2的偶数（yuv420等色度抽样格式要求宽高为偶数）"""
+    return max(2, int(value) // 2 * 2)
+
+
+def video_layout(width, height):
+    """计算4:3画幅的尺寸，与图片的处理方法相同
+    
+    返回:
+        dict: {"size": 4:3画幅尺寸, "crop": 背景在原画面中居中裁剪的区域尺寸, "fit": 前景缩放后的尺寸}
+    """
+    original_ratio = width / height
+    target_ratio = 4 / 3
+    if original_ratio > target_ratio:
+        target_width, target_height = _even(height * target_ratio), _even(height)
+        fit_width = _even(target_width * FIT_RATIO)
+        fit_height = _even(fit_width / original_ratio)
+    else:
+        target_width, target_height = _even(width), _even(width / target_ratio)
+        fit_height = _even(target_height * FIT_RATIO)
+        fit_width = _even(fit_height * original_ratio)
+    # 背景放大到完全覆盖画幅后居中裁剪，相当于先在原画面中裁剪同样比例的区域再缩放
+    scale = max(target_width / width, target_height / height)
+    crop = (_even(min(width, target_width / scale)), _even(min(height, target_height / scale)))
+    return {"size": (target_width, target_height), "crop": crop, "fit": (fit_width, fit_height)}
+
+
+def background_filters(width, height, downscale=BLUR_DOWNSCALE):
+    """模糊背景的滤镜链：居中裁剪、缩小、模糊、放大回4:3画幅尺寸
+    
+    参数:
+        width, height: 原视频尺寸
+        downscale: 缩小倍数，1 表示在全分辨率上模糊（仅用于性能对比）
+    """
+    layout = video_layout(width, height)
+    target_width, target_height = layout["size"]
+    crop_width, crop_height = layout["crop"]
+    filters = (f"crop={crop_width}:{crop_height},"
+               f"scale={_even(target_width / downscale)}:{_even(target_height / downscale)}:flags=area,"
+               f"gblur=sigma={BLUR_RADIUS / downscale:g}")
+    if downscale > 1:
+        filters += f",scale={target_width}:{target_height}:flags=bilinear"
+    return filters
+
+
+def build_blur_filtergraph(width, height, downscale=BLUR_DOWNSCALE, source="0:v:0", prefix=""):
+    """生成模糊背景的滤镜图（输出标签为 [<prefix>v]）
+    
+    参数:
+        width, height: 原视频尺寸
+        downscale: 背景分支的缩小倍数（同 background_filters）
+        source: 输入的视频流标签
+        prefix: 内部标签的前缀（在同一个滤镜图中组合多个时避免重名）
+    """
+    fit_width, fit_height = video_layout(width, height)["fit"]
+    return ";".join([
+        f"[{source}]split=2[{prefix}bg][{prefix}fg]",
+        f"[{prefix}bg]{background_filters(width, height, downscale)}[{prefix}blurred]",
+        f"[{prefix}fg]scale={fit_width}:{fit_height}:flags=lanczos[{prefix}fitted]",
+        f"[{prefix}blurred][{prefix}fitted]overlay=(W-w)/2:(H-h)/2,setsar=1[{prefix}v]",
+    ])
+
+
+def video_output_path(video_path, format_type):
+    """视频的4:3输出路径
+    
+    音频直接复制，容器需要能容纳源文件的音频编码：H.264/H.265 沿用MP4/MOV源文件的容器，
+    ProRes/DNx 使用MOV，其余（WebM、MKV等）使用MKV。
+    """
+    suffix = video_path.suffix.lower()
+    if format_type.startswith(("h264", "h265")):
+        container = suffix if suffix in (".mp4", ".mov") else ".mkv"
+    else:
+        container = ".mov" if suffix in (".mp4", ".mov") else ".mkv"
+    return video_path.parent / f"{video_path.stem}_4_3{container}"
+
+
+def _find_tools(ffmpeg_path):
+    ffmpeg_path = ffmpeg_path or find_ffmpeg_path()
+    ffmpeg_exe = get_tool_exe(ffmpeg_path)
+    ffprobe_exe = get_tool_exe(ffmpeg_path, "ffprobe")
+    if not ffmpeg_exe or not ffprobe_exe:
+        print("错误：未找到ffmpeg/ffprobe，无法处理视频")
+        return None
+    return ffmpeg_path, ffmpeg_exe, ffprobe_exe
+
+
+def convert_video_16_9_to_4_3(video_path, ffmpeg_path=None, format_type="h264_gpu", force=False, config=None):
+    """
+    将16:9的视频转换为4:3比例（模糊背景，与图片的效果相同）
+    
+    参数:
+        video_path: 视频路径（字符串或Path对象）
+        ffmpeg_path: ffmpeg路径（可选）
+        format_type: 视频编码使用的格式类型（同 convert_video），音频直接复制
+        force: 输出文件已是最新时也重新转换
+        config: 配置字典（资源调度和临时工作区使用，None时读取config.cfg）
+    
+    返回:
+        输出文件的路径，如果失败返回None
+    """
+    video_path = Path(video_path)
+    if not video_path.exists():
+        print(f"错误：文件不存在 - {video_path}")
+        return None
+    tools = _find_tools(ffmpeg_path)
+    if not tools:
+        return None
+    ffmpeg_path, ffmpeg_exe, ffprobe_exe = tools
+    size = probe_video_size(ffprobe_exe, video_path)
+    if not size:
+        print(f"错误：无法读取视频尺寸 - {video_path}")
+        return None
+
+    format_type = format_type.lower()
+    gpu_encoders = detect_gpu_encoders(ffmpeg_path) if format_type in GPU_DETECT_FORMATS else {}
+    try:
+        if format_type == "auto":
+            # 按源视频的分辨率选择编码参数（与 convert_video 的 auto 格式共用缓存）
+            entry, _ = EncoderBenchmark.from_config(config).select(video_path, ffmpeg_path, gpu_encoders)
+            encoder_args = list(entry["args"])
+        else:
+            encoder_args = preset_encoder_args(format_type, gpu_encoders)
+    except (VideoConversionError, RuntimeError) as e:
+        print(f"错误：{e}")
+        return None
+    # 画面已经重新编码，音频不需要转换
+    encoder_args[encoder_args.index("-c:a") + 1] = "copy"
+
+    output_path = str(video_output_path(video_path, format_type).absolute())
+    cmd = [ffmpeg_exe, "-hide_banner", "-i", str(video_path.absolute()),
+           "-filter_complex", build_blur_filtergraph(*size),
+           "-map", "[v]", "-map", "0:a?", *encoder_args, "-y", output_path]
+    if not force and is_up_to_date([output_path], cmd):
+        print(f"4:3视频已是最新，跳过: {Path(output_path).name}")
+        return output_path
+
+    print(f"正在转换为4:3视频（{size[0]}x{size[1]} -> {'x'.join(map(str, video_layout(*size)['size']))}）: "
+          f"{video_path.name}")
+    try:
+        with get_governor(config).acquire(encoder_resource_class(cmd)) as slot, \
+                staged_conversion(slot, cmd, [output_path], config) as run_cmd:
+            result = run_process(run_cmd, echo=True)
+            if result.returncode != 0:
+                detail = "；".join(line.strip() for line in result.tail[-3:])
+                raise VideoConversionError(f"ffmpeg 返回码 {result.returncode}: {detail}")
+    except (VideoConversionError, OSError) as e:
+        print(f"错误：转换视频时出错 - {e}")
+        return None
+    stamp_outputs([output_path], cmd)
+
+    print(f"成功：已生成4:3比例的视频 - {output_path}")
+    return output_path
+
+
+def _last_frame_count(lines):
+    """从ffmpeg输出中解析最后的已处理帧数"""
+    for line in reversed(lines):
+        match = re.search(r"frame=\s*(\d+)", line)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def benchmark_blur(video_path, ffmpeg_path=None, seconds=BENCHMARK_SECONDS, config=None):
+    """对比缩小后模糊和全分辨率模糊的处理速度（只运行滤镜图，不编码），并用SSIM比较两者的画面
+    
+    分别测量只有背景分支和完整滤镜图的速度：完整滤镜图中还包括解码、前景缩放和叠加，
+    这些部分两种方法相同，整体的提升小于背景分支本身。
+    
+    返回:
+        dict: {(范围, 方法): 每秒帧数, "ssim": 两者画面的SSIM}，失败时返回None
+    """
+    tools = _find_tools(ffmpeg_path)
+    if not tools:
+        return None
+    _, ffmpeg_exe, ffprobe_exe = tools
+    size = probe_video_size(ffprobe_exe, video_path)
+    if not size:
+        print(f"错误：无法读取视频尺寸 - {video_path}")
+        return None
+
+    head = [ffmpeg_exe, "-hide_banner", "-t", str(seconds), "-i", str(Path(video_path).absolute())]
+    variants = {
+        ("背景分支", "fast"): f"[0:v:0]{background_filters(*size)}[v]",
+        ("背景分支", "naive"): f"[0:v:0]{background_filters(*size, downscale=1)}[v]",
+        ("完整滤镜图", "fast"): build_blur_filtergraph(*size),
+        ("完整滤镜图", "naive"): build_blur_filtergraph(*size, downscale=1),
+        "ssim": ";".join([
+            "[0:v:0]split=2[a][b]",
+            build_blur_filtergraph(*size, source="a", prefix="fast_"),
+            build_blur_filtergraph(*size, downscale=1, source="b", prefix="naive_"),
+            "[fast_v][naive_v]ssim[v]",
+        ]),
+    }
+    results = {}
+    # 在同一个资源槽位中依次运行，线程数相同
+    with get_governor(config).acquire("cpu") as slot:
+        for key, graph in variants.items():
+            cmd = slot.apply_to_ffmpeg(head + ["-filter_complex", graph, "-map", "[v]", "-f", "null", "-"])
+            start = time.monotonic()
+            result = run_process(cmd)
+            elapsed = time.monotonic() - start
+            tail = result.tail
+            if result.returncode != 0:
+                print(f"错误：ffmpeg 返回码 {result.returncode}: {tail[-1] if tail else ''}")
+                return None
+            if key == "ssim":
+                match = next((re.search(r"All:([\d.]+)", line) for line in reversed(tail) if "SSIM" in line), None)
+                results[key] = float(match.group(1)) if match else None
+                continue
+            frames = _last_frame_count(tail) or 0
+            results[key] = frames / elapsed if elapsed > 0 else 0.0
+            scope, method = key
+            print(f"{scope}（{'缩小后模糊' if method == 'fast' else '全分辨率模糊'}）: {frames} 帧，"
+                  f"{elapsed:.2f} 秒，{results[key]:.1f} 帧/秒")
+            if method == "naive" and results[key]:
+                print(f"  {scope}速度提升: {results[(scope, 'fast')] / results[key]:.1f} 倍")
+
+    if results["ssim"] is not None:
+        print(f"两种方法的画面SSIM: {results['ssim']:.4f}（1 表示完全相同）")
+    return results
+
 def main():
     """主函数"""
-    if len(sys.argv) < 2:
+    args = sys.argv[1:]
+    force = "--force" in args
+    benchmark = "--benchmark" in args
+    args = [a for a in args if a not in ("--force", "--benchmark")]
+    if not args:
         print("用法: python convert_16_9_to_4_3.py <图片路径>")
+        print("      python convert_16_9_to_4_3.py <视频路径> [格式类型] [--force]")
+        print("      python convert_16_9_to_4_3.py <视频路径> --benchmark [秒数]")
+        print(f"视频格式类型: {', '.join(FORMAT_TYPES)}（默认h264_gpu，音频直接复制）")
+        print("--benchmark 对比缩小后模糊与全分辨率模糊的处理速度（默认处理前10秒）")
         print("示例: python convert_16_9_to_4_3.py /path/to/image.jpg")
+        print("      python convert_16_9_to_4_3.py download/video/video.mp4 h264_high")
         sys.exit(1)
     
-    image_path = sys.argv[1]
-    result = convert_16_9_to_4_3(image_path)
+    path = args[0]
+    if Path(path).suffix.lower() in VIDEO_EXTENSIONS:
+        if benchmark:
+            seconds = float(args[1]) if len(args) >= 2 else BENCHMARK_SECONDS
+            result = benchmark_blur(path, seconds=seconds)
+        else:
+            format_type = args[1] if len(args) >= 2 else "h264_gpu"
+            result = convert_video_16_9_to_4_3(path, format_type=format_type, force=force)
+    else:
+        result = convert_16_9_to_4_3(path)
     
     if result:
         sys.exit(0)
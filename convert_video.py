@@ -8,12 +8,63 @@
 """
 
 import os
+import re
+import contextlib
 import sys
+import glob
+import time
 import subprocess
 import platform
 import shutil
+import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from async_runner import run_process
+from file_resolver import FileResolver
+from output_stamps import is_up_to_date, stamp_outputs
+from resource_governor import get_governor
+from scratch_staging import input_size, staged_output
+from tool_utils import get_tool_exe
+
+
+# 查找输入视频时考虑的扩展名（批量转换时会跳过 *_editing 输出文件）
+VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.webm', '.mov'}
+
+# 编辑软件可以直接流畅剪辑的帧内编码格式，源文件已经是这些格式时只重封装不转码
+EDITING_FRIENDLY_CODECS = {"prores", "dnxhd", "cfhd"}
+
+# 编辑用的音频格式，其他音频格式只转换音频
+EDITING_AUDIO_CODEC = "pcm_s24le"
+
+# 支持的输出格式类型
+FORMAT_TYPES = ["prores", "prores_lt", "dnxhd", "dnxhr", "h264_high", "h264_gpu", "h265_gpu", "auto"]
+
+# 使用GPU加速的格式类型
+GPU_FORMATS = ["h264_gpu", "h265_gpu"]
+
+# 需要检测GPU编码器的格式类型（auto 把可用的GPU编码器也作为候选）
+GPU_DETECT_FORMATS = GPU_FORMATS + ["auto"]
+
+# 硬件编码器名称后缀
+HARDWARE_ENCODER_SUFFIXES = ("_nvenc", "_amf", "_qsv")
+
+# 代理文件预设：与主文件在同一次解码中生成（height 为默认最大高度，不会放大）
+PROXY_PRESETS = {
+    "prores_proxy": {
+        "height": 540,
+        "args": ["-c:v", "prores_ks", "-profile:v", "0", "-pix_fmt", "yuv422p10le", "-c:a", "pcm_s16le"],
+    },
+    "h264_proxy": {
+        "height": 540,
+        "args": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "26", "-pix_fmt", "yuv420p",
+                 "-g", "25", "-c:a", "aac", "-b:a", "192k"],
+    },
+}
+
+# 代理文件所在的子目录
+PROXY_DIR_NAME = "Proxy"
+
 
 def find_ffmpeg_path():
     """查找ffmpeg路径"""
@@ -116,321 +167,691 @@ def detect_available_gpu_encoders(ffmpeg_path):
     return available
 
 
-def find_video_file(video_path):
+def detect_gpu_encoders(ffmpeg_path):
+    """检测并输出可用的GPU编码器
+    
+    Returns:
+        dict: 可用的GPU编码器 {"nvenc": bool, "amf": bool, "qsv": bool}
+    """
+    print("正在检测GPU加速支持...")
+    gpu_encoders = detect_available_gpu_encoders(ffmpeg_path)
+    if any(gpu_encoders.values()):
+        print("检测到GPU加速支持:")
+        if gpu_encoders.get("nvenc"):
+            print("  ✓ NVIDIA NVENC (推荐)")
+        if gpu_encoders.get("amf"):
+            print("  ✓ AMD AMF")
+        if gpu_encoders.get("qsv"):
+            print("  ✓ Intel QuickSync")
+    else:
+        print("  未检测到GPU加速支持，将使用CPU编码")
+    return gpu_encoders
+
+
+def find_video_file(video_path, resolver=None):
     """查找视频文件，处理路径中的特殊字符和编码问题
     
     Args:
         video_path: 视频文件路径（可能是用户输入的路径）
+        resolver: 批量处理时共享的 FileResolver（可选，避免重复扫描同一目录）
     
     Returns:
         Path对象，如果找到文件；否则返回None
     """
-    # 移除路径中的引号（如果用户用引号包裹路径）
-    clean_path = video_path.strip('"\'')
-    
-    # 尝试多种方法查找文件
-    methods = [
-        # 方法1: 直接使用路径
-        lambda: Path(clean_path) if Path(clean_path).exists() and Path(clean_path).is_file() else None,
-        # 方法2: 使用绝对路径
-        lambda: Path(clean_path).resolve() if Path(clean_path).resolve().exists() and Path(clean_path).resolve().is_file() else None,
-        # 方法3: 使用os.path规范化（对Windows路径更友好）
-        lambda: Path(os.path.normpath(clean_path)) if Path(os.path.normpath(clean_path)).exists() and Path(os.path.normpath(clean_path)).is_file() else None,
-    ]
-    
-    for method in methods:
-        try:
-            result = method()
-            if result:
-                return result
-        except Exception:
-            continue
+    if resolver is None:
+        resolver = FileResolver(VIDEO_EXTENSIONS, "视频文件")
+    return resolver.resolve(video_path)
+
+
+class VideoConversionError(Exception):
+    """视频转换失败（找不到文件、不支持的格式等）"""
+
+
+def parse_proxy_spec(spec):
+    """解析代理文件规格，格式为 "预设名[:高度]"，例如 "prores_proxy" 或 "h264_proxy:360"
     
-    # 如果路径指向的是目录，尝试在该目录中查找mp4文件
-    try:
-        test_path = Path(clean_path)
-        if test_path.exists() and test_path.is_dir():
-            # 查找目录中的所有mp4文件
-            mp4_files = list(test_path.glob("*.mp4"))
-            if len(mp4_files) == 1:
-                print(f"提示: 在目录中找到视频文件: {mp4_files[0]}")
-                return mp4_files[0]
-            elif len(mp4_files) > 1:
-                print(f"提示: 在目录中找到多个mp4文件，使用第一个: {mp4_files[0].name}")
-                for i, f in enumerate(mp4_files[:5], 1):  # 只显示前5个
-                    print(f"  {i}. {f.name}")
-                return mp4_files[0]
-    except Exception:
-        pass
+    Returns:
+        tuple: (标签, 预设, 最大高度)
     
-    # 如果路径是文件路径但不存在，尝试在父目录中查找
+    Raises:
+        VideoConversionError: 预设名或高度无效
+    """
+    name, _, height = spec.strip().lower().partition(":")
+    preset = PROXY_PRESETS.get(name)
+    if not preset:
+        raise VideoConversionError(
+            f"不支持的代理格式 '{name}'，支持的代理格式: {', '.join(PROXY_PRESETS)}"
+        )
     try:
-        parent_dir = Path(clean_path).parent
-        if parent_dir.exists() and parent_dir.is_dir():
-            # 查找目录中的所有mp4文件
-            mp4_files = list(parent_dir.glob("*.mp4"))
-            if len(mp4_files) == 1:
-                print(f"提示: 在父目录中找到视频文件: {mp4_files[0]}")
-                return mp4_files[0]
-            elif len(mp4_files) > 1:
-                # 尝试匹配文件名（不区分大小写）
-                input_name = Path(clean_path).stem.lower().replace(" ", "").replace("_", "").replace("-", "")
-                best_match = None
-                best_score = 0
-                
-                for mp4_file in mp4_files:
-                    file_name = mp4_file.stem.lower().replace(" ", "").replace("_", "").replace("-", "")
-                    # 计算匹配度
-                    if input_name in file_name or file_name in input_name:
-                        score = min(len(input_name), len(file_name)) / max(len(input_name), len(file_name), 1)
-                        if score > best_score:
-                            best_score = score
-                            best_match = mp4_file
-                
-                if best_match:
-                    print(f"提示: 找到匹配的视频文件: {best_match}")
-                    return best_match
-                else:
-                    # 如果没找到匹配的，返回第一个
-                    print(f"提示: 在父目录中找到多个mp4文件，使用第一个: {mp4_files[0]}")
-                    return mp4_files[0]
-    except Exception:
-        pass
-    
-    return None
+        height = int(height) if height else preset["height"]
+    except ValueError:
+        raise VideoConversionError(f"代理文件高度无效: {spec}")
+    if height < 16 or height % 2:
+        raise VideoConversionError(f"代理文件高度必须是不小于16的偶数: {spec}")
+    return f"{height}p_{name}", preset, height
 
 
-def convert_video_for_editing(video_path, ffmpeg_path=None, format_type="prores", use_gpu=True):
-    """将视频转换为编辑友好格式
+def proxy_output_path(output_file, label):
+    """代理文件路径：<输出目录>/Proxy/<标签>/<与主文件相同的文件名>
     
-    Args:
-        video_path: 视频文件路径
-        ffmpeg_path: ffmpeg路径（可选）
-        format_type: 输出格式类型
-            - "prores": ProRes 422（推荐，质量高，文件较大，CPU编码）
-            - "prores_lt": ProRes 422 LT（质量稍低，文件较小，CPU编码）
-            - "dnxhd": DNxHD 145（Avid格式，1080p，CPU编码）
-            - "dnxhr": DNxHR HQ（Avid格式，支持任意分辨率，CPU编码）
-            - "h264_high": 高质量H.264（CPU编码，较慢）
-            - "h264_gpu": 高质量H.264（GPU加速，快速，推荐）
-            - "h265_gpu": 高质量H.265/HEVC（GPU加速，快速，文件更小）
-        use_gpu: 是否尝试使用GPU加速（默认True）
+    与主文件同名（只是所在目录不同），Premiere 的"附加代理"和 DaVinci Resolve 的代理重新链接
+    都按文件名匹配主文件和代理文件。
     """
-    # 查找视频文件
-    video_file = find_video_file(video_path)
-    
-    if not video_file:
-        print(f"错误: 无法找到视频文件: {video_path}")
-        print("\n提示:")
-        print("  1. 请检查文件路径是否正确")
-        print("  2. 确保文件确实存在")
-        print("  3. 如果路径包含特殊字符，请使用引号包裹路径")
-        print("  4. 可以尝试使用相对路径或只提供目录路径（如果目录中只有一个mp4文件）")
-        sys.exit(1)
-    
-    print(f"找到视频文件: {video_file}")
-    
-    # 检查视频文件是否存在
-    if not video_file.exists():
-        print(f"错误: 视频文件不存在: {video_file}")
-        sys.exit(1)
-    
-    # 获取视频文件的绝对路径
-    video_abs_path = video_file.resolve()
-    
-    # 获取视频文件名（不含扩展名）
-    video_stem = video_file.stem
-    
-    # 查找ffmpeg
-    if not ffmpeg_path:
-        ffmpeg_path = find_ffmpeg_path()
-    
-    if not ffmpeg_path:
-        print("错误: 未找到ffmpeg，无法转换视频")
-        sys.exit(1)
+    output_file = Path(output_file)
+    return str((output_file.parent / PROXY_DIR_NAME / label / output_file.name).absolute())
+
+
+def conversion_outputs(output_file, proxies=None):
+    """转换命令会写入的全部文件（主文件在前）"""
+    outputs = [str(output_file)]
+    for spec in proxies or []:
+        label, _, _ = parse_proxy_spec(spec)
+        outputs.append(proxy_output_path(output_file, label))
+    return outputs
+
+
+def _add_proxy_outputs(cmd, output_file, proxies):
+    """把单输出的转换命令改为一次解码、split 后同时写入主文件和代理文件
     
-    is_windows = platform.system() == "Windows"
-    exe_ext = ".exe" if is_windows else ""
-    ffmpeg_exe = Path(ffmpeg_path) / f"ffmpeg{exe_ext}"
+    Args:
+        cmd: 到编码参数为止的命令（不含输出文件）
+        output_file: 主文件路径
+        proxies: 代理文件规格列表
     
-    # 如果路径是目录，检查其中的可执行文件
-    if not ffmpeg_exe.exists():
-        # 可能 ffmpeg_path 本身就是可执行文件的路径
-        if os.path.isfile(ffmpeg_path) and os.access(ffmpeg_path, os.X_OK):
-            ffmpeg_exe = Path(ffmpeg_path)
-        else:
-            print(f"错误: ffmpeg{exe_ext}不存在: {ffmpeg_exe}")
-            sys.exit(1)
+    Returns:
+        list: 新的命令列表
+    """
+    specs = [parse_proxy_spec(spec) for spec in proxies]
+    input_end = cmd.index("-i") + 2
+    head, master_args = cmd[:input_end], cmd[input_end:]
+    # 重封装时主文件直接复制视频流，只有代理文件需要解码后的画面
+    copy_master = master_args[master_args.index("-c:v") + 1] == "copy"
+    branches = "".join(f"[p{i}]" for i in range(len(specs)))
+    scales = ";".join(f"[p{i}]scale=-2:'min({height},ih)'[proxy{i}]"
+                      for i, (_, _, height) in enumerate(specs))
+    if copy_master:
+        graph = f"[0:v:0]split={len(specs)}{branches};{scales}"
+        master_video = "0:v:0"
+    else:
+        graph = f"[0:v:0]split={len(specs) + 1}[master]{branches};{scales}"
+        master_video = "[master]"
+
+    new_cmd = head + ["-filter_complex", graph, "-y"]
+    new_cmd += ["-map", master_video, "-map", "0:a:0?"] + master_args + [str(output_file)]
+    for i, (label, preset, _) in enumerate(specs):
+        new_cmd += ["-map", f"[proxy{i}]", "-map", "0:a:0?"] + preset["args"]
+        new_cmd.append(proxy_output_path(output_file, label))
+    return new_cmd
+
+
+@contextlib.contextmanager
+def staged_conversion(slot, cmd, outputs, config=None, expected_bytes=None):
+    """为命令中的每个输出文件分配临时路径，并在每个输出前添加按核心预算计算的线程参数
     
-    # 检测可用的GPU编码器
-    gpu_encoders = {}
-    if use_gpu:
-        print("正在检测GPU加速支持...")
-        gpu_encoders = detect_available_gpu_encoders(ffmpeg_path)
-        if any(gpu_encoders.values()):
-            print("检测到GPU加速支持:")
-            if gpu_encoders.get("nvenc"):
-                print("  ✓ NVIDIA NVENC (推荐)")
-            if gpu_encoders.get("amf"):
-                print("  ✓ AMD AMF")
-            if gpu_encoders.get("qsv"):
-                print("  ✓ Intel QuickSync")
-        else:
-            print("  未检测到GPU加速支持，将使用CPU编码")
+    全部输出在命令成功后才发布到最终位置，出错时全部清理。
+    expected_bytes 为每个输出的预计大小（用于检查临时工作区的空间预算），默认按输入文件大小估算。
     
-    # 根据格式类型构建ffmpeg命令
-    format_type = format_type.lower()
+    用法:
+        with staged_conversion(slot, cmd, outputs) as run_cmd:
+            subprocess.run(run_cmd, check=True)
+    """
+    with contextlib.ExitStack() as stack:
+        if expected_bytes is None:
+            expected_bytes = input_size(cmd)
+        staged = {out: stack.enter_context(staged_output(out, config, expected_bytes)) for out in outputs}
+        run_cmd = []
+        for arg in cmd:
+            if arg in staged:
+                run_cmd.extend(slot.ffmpeg_args())
+                run_cmd.append(staged[arg])
+            else:
+                run_cmd.append(arg)
+        yield slot.wrap_command(run_cmd)
+
+
+def probe_streams(ffprobe_exe, video_file):
+    """用ffprobe读取第一个视频流和音频流的编码格式
     
-    # 确定输出文件扩展名
-    # 使用无损音频时，MOV格式支持更好
-    if format_type in ["h264_high", "h264_gpu", "h265_gpu"]:
-        output_ext = "mov"  # 改为MOV以支持无损音频
-    else:
-        output_ext = "mov"
+    Returns:
+        dict: {"video": 视频编码或None, "audio": 音频编码或None}，读取失败时返回None
+    """
+    cmd = [ffprobe_exe, "-v", "error", "-show_entries", "stream=codec_type,codec_name",
+           "-of", "json", str(video_file)]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        streams = json.loads(result.stdout).get("streams") or []
+    except (subprocess.CalledProcessError, OSError, json.JSONDecodeError):
+        return None
+    info = {"video": None, "audio": None}
+    for stream in streams:
+        codec_type = stream.get("codec_type")
+        if codec_type in info and info[codec_type] is None:
+            info[codec_type] = stream.get("codec_name")
+    return info
+
+
+def probe_video_size(ffprobe_exe, video_file):
+    """用ffprobe读取第一个视频流的宽高
     
-    # 输出文件路径：与源文件同目录，文件名添加_editing后缀
-    output_file = video_file.parent / f"{video_stem}_editing.{output_ext}"
+    Returns:
+        tuple: (宽, 高)，读取失败时返回None
+    """
+    cmd = [ffprobe_exe, "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height",
+           "-of", "csv=p=0", str(video_file)]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        width, height = (int(v) for v in result.stdout.strip().split(",")[:2])
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return None
+    return width, height
+
+
+def probe_duration(ffprobe_exe, video_file):
+    """用ffprobe读取视频时长（秒），失败时返回None"""
+    cmd = [ffprobe_exe, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(video_file)]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        return float(result.stdout.strip())
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return None
+
+
+def plan_rewrap(ffmpeg_path, video_file):
+    """判断源文件是否已经适合编辑，可以不转码视频
     
-    # 构建基础命令
-    cmd = [str(ffmpeg_exe.absolute())]
+    Returns:
+        list: 重封装用的编码参数（复制视频，音频已是24位PCM时也直接复制，否则只转换音频）；
+            需要转码时返回None
+    """
+    ffprobe_exe = get_tool_exe(ffmpeg_path, "ffprobe")
+    if not ffprobe_exe:
+        return None
+    info = probe_streams(ffprobe_exe, video_file)
+    if not info or info["video"] not in EDITING_FRIENDLY_CODECS:
+        return None
+    if info["audio"] is None or info["audio"] == EDITING_AUDIO_CODEC:
+        print(f"源视频已是编辑友好格式（{info['video']}），直接重封装，不转码")
+        return ["-c:v", "copy", "-c:a", "copy"]
+    print(f"源视频已是编辑友好格式（{info['video']}），只将音频（{info['audio']}）转换为24位PCM")
+    return ["-c:v", "copy", "-c:a", EDITING_AUDIO_CODEC]
+
+
+def preset_encoder_args(format_type, gpu_encoders=None):
+    """输出格式类型对应的编码参数（视频编码器和24位PCM音频）
     
-    # 尝试使用硬件解码加速（如果可用且使用GPU编码）
-    if format_type in ["h264_gpu", "h265_gpu"] and use_gpu:
-        # 尝试使用硬件解码（nvdec, dxva2等）
-        # 这会自动选择可用的硬件解码器
-        cmd.extend(["-hwaccel", "auto"])
+    Args:
+        format_type: 输出格式类型（见 FORMAT_TYPES）
+        gpu_encoders: 可用的GPU编码器（h264_gpu/h265_gpu 没有可用的GPU编码器时回退到CPU编码）
     
-    cmd.extend(["-i", str(video_abs_path)])
+    Returns:
+        list: ffmpeg编码参数
     
+    Raises:
+        VideoConversionError: 格式类型不支持
+    """
+    gpu_encoders = gpu_encoders or {}
     if format_type == "prores":
         # ProRes 422（高质量，适合专业编辑，CPU编码）
-        cmd.extend([
+        return [
             "-c:v", "prores_ks",  # ProRes编码器
             "-profile:v", "3",    # ProRes 422
             "-c:a", "pcm_s24le",  # 24位PCM音频（高质量）
-        ])
+        ]
     elif format_type == "prores_lt":
         # ProRes 422 LT（质量稍低，文件较小，CPU编码）
-        cmd.extend([
+        return [
             "-c:v", "prores_ks",
             "-profile:v", "2",    # ProRes 422 LT
             "-c:a", "pcm_s24le",
-        ])
+        ]
     elif format_type == "dnxhd":
         # DNxHD 145（1080p，145 Mbps，CPU编码）
-        cmd.extend([
+        return [
             "-c:v", "dnxhd",
             "-b:v", "145M",       # 145 Mbps
             "-c:a", "pcm_s24le",
-        ])
+        ]
     elif format_type == "dnxhr":
         # DNxHR HQ（支持任意分辨率，CPU编码）
-        cmd.extend([
+        return [
             "-c:v", "dnxhr",
             "-b:v", "220M",       # HQ质量
             "-c:a", "pcm_s24le",
-        ])
+        ]
     elif format_type == "h264_high":
         # 快速H.264（CPU编码，视频质量低，音频无损）
-        cmd.extend([
+        return [
             "-c:v", "libx264",
             "-preset", "ultrafast",  # 最快预设
             "-crf", "28",            # 视频质量低（28是较低质量，但编码极快）
             "-c:a", "pcm_s24le",     # 24位PCM无损音频
-        ])
+        ]
     elif format_type == "h264_gpu":
         # 高质量H.264（GPU加速，快速，推荐）
         if gpu_encoders.get("nvenc"):
             # NVIDIA NVENC（最快，视频质量低，音频无损）
-            cmd.extend([
+            return [
                 "-c:v", "h264_nvenc",
                 "-preset", "p1",      # p1最快
                 "-cq", "28",          # 视频质量低（28是较低质量，但编码极快）
                 "-rc", "vbr",         # 可变比特率
                 "-b:v", "0",          # 使用CQ模式，不限制比特率
                 "-c:a", "pcm_s24le",  # 24位PCM无损音频
-            ])
+            ]
         elif gpu_encoders.get("amf"):
             # AMD AMF（最快，视频质量低，音频无损）
-            cmd.extend([
+            return [
                 "-c:v", "h264_amf",
                 "-quality", "speed",     # speed最快
                 "-rc", "vbr_peak",      # 可变比特率
                 "-qmin", "28",          # 视频质量低
                 "-qmax", "32",          # 最大质量（更低）
                 "-c:a", "pcm_s24le",    # 24位PCM无损音频
-            ])
+            ]
         elif gpu_encoders.get("qsv"):
             # Intel QuickSync（最快，视频质量低，音频无损）
-            cmd.extend([
+            return [
                 "-c:v", "h264_qsv",
                 "-preset", "veryfast",   # 最快预设
                 "-global_quality", "28", # 视频质量低
                 "-c:a", "pcm_s24le",     # 24位PCM无损音频
-            ])
+            ]
         else:
             # 如果没有GPU，回退到CPU编码（最快设置）
             print("警告: 未检测到GPU加速，使用CPU编码（最快设置）")
-            cmd.extend([
+            return [
                 "-c:v", "libx264",
                 "-preset", "ultrafast",  # 最快预设
                 "-crf", "28",            # 视频质量低
                 "-c:a", "pcm_s24le",     # 24位PCM无损音频
-            ])
+            ]
     elif format_type == "h265_gpu":
         # 高质量H.265/HEVC（GPU加速，快速，文件更小）
         if gpu_encoders.get("nvenc"):
             # NVIDIA NVENC HEVC（最快，视频质量低，音频无损）
-            cmd.extend([
+            return [
                 "-c:v", "hevc_nvenc",
                 "-preset", "p1",      # p1最快
                 "-cq", "28",          # 视频质量低（28是较低质量，但编码极快）
                 "-rc", "vbr",         # 可变比特率
                 "-b:v", "0",          # 使用CQ模式，不限制比特率
                 "-c:a", "pcm_s24le",  # 24位PCM无损音频
-            ])
+            ]
         elif gpu_encoders.get("amf"):
             # AMD AMF HEVC（最快，视频质量低，音频无损）
-            cmd.extend([
+            return [
                 "-c:v", "hevc_amf",
                 "-quality", "speed",     # speed最快
                 "-rc", "vbr_peak",
                 "-qmin", "28",          # 视频质量低
                 "-qmax", "32",          # 最大质量（更低）
                 "-c:a", "pcm_s24le",    # 24位PCM无损音频
-            ])
+            ]
         elif gpu_encoders.get("qsv"):
             # Intel QuickSync HEVC（最快，视频质量低，音频无损）
-            cmd.extend([
+            return [
                 "-c:v", "hevc_qsv",
                 "-preset", "veryfast",   # 最快预设
                 "-global_quality", "28", # 视频质量低
                 "-c:a", "pcm_s24le",     # 24位PCM无损音频
-            ])
+            ]
         else:
             # 如果没有GPU，回退到CPU编码（最快设置）
             print("警告: 未检测到GPU加速，使用CPU编码（最快设置）")
-            cmd.extend([
+            return [
                 "-c:v", "libx265",
                 "-preset", "ultrafast",  # 最快预设
                 "-crf", "28",            # 视频质量低
                 "-c:a", "pcm_s24le",     # 24位PCM无损音频
-            ])
+            ]
     else:
-        print(f"错误: 不支持的格式类型 '{format_type}'")
-        print("支持的格式: prores, prores_lt, dnxhd, dnxhr, h264_high, h264_gpu, h265_gpu")
-        sys.exit(1)
+        raise VideoConversionError(f"不支持的格式类型 '{format_type}'")
+
+
+def convert_video_for_editing(video_path, ffmpeg_path=None, format_type="prores", use_gpu=True,
+                              gpu_encoders=None, resolver=None, proxies=None, allow_rewrap=True, config=None):
+    """将视频转换为编辑友好格式
+    
+    Args:
+        video_path: 视频文件路径
+        ffmpeg_path: ffmpeg路径（可选）
+        format_type: 输出格式类型
+            - "prores": ProRes 422（推荐，质量高，文件较大，CPU编码）
+            - "prores_lt": ProRes 422 LT（质量稍低，文件较小，CPU编码）
+            - "dnxhd": DNxHD 145（Avid格式，1080p，CPU编码）
+            - "dnxhr": DNxHR HQ（Avid格式，支持任意分辨率，CPU编码）
+            - "h264_high": 高质量H.264（CPU编码，较慢）
+            - "h264_gpu": 高质量H.264（GPU加速，快速，推荐）
+            - "h265_gpu": 高质量H.265/HEVC（GPU加速，快速，文件更小）
+            - "auto": 在源视频的样本上测试本机的编码器和预设，选择达到画质下限的最快的一种
+              （结果按机器和分辨率缓存，见 encoder_benchmark）
+        use_gpu: 是否尝试使用GPU加速（默认True）
+        gpu_encoders: 已检测的GPU编码器（批量转换时只检测一次，None时自动检测）
+        resolver: 批量转换时共享的 FileResolver（可选）
+        proxies: 代理文件规格列表（如 ["prores_proxy", "h264_proxy:360"]），
+            与主文件在同一次解码中生成，输出路径见 conversion_outputs()
+        allow_rewrap: 源文件已是ProRes/DNxHD/DNxHR/CineForm时只重封装（默认True），
+            为False时总是转码
+        config: 配置字典（auto 格式使用，None时读取config.cfg）
+    
+    Returns:
+        tuple: (ffmpeg命令列表, 输出文件路径)
+    
+    Raises:
+        VideoConversionError: 找不到视频文件或ffmpeg、格式类型不支持
+    """
+    # 查找视频文件
+    video_file = find_video_file(video_path, resolver)
+    
+    if not video_file:
+        raise VideoConversionError(
+            f"无法找到视频文件: {video_path}\n"
+            "提示: 请检查文件路径是否正确；路径包含特殊字符时请使用引号包裹，也可以只提供视频所在的目录"
+        )
+    
+    print(f"找到视频文件: {video_file}")
+    
+    # 获取视频文件的绝对路径
+    video_abs_path = video_file.resolve()
+    
+    # 获取视频文件名（不含扩展名）
+    video_stem = video_file.stem
+    
+    # 查找ffmpeg
+    if not ffmpeg_path:
+        ffmpeg_path = find_ffmpeg_path()
+    
+    if not ffmpeg_path:
+        raise VideoConversionError("未找到ffmpeg，无法转换视频")
+    
+    is_windows = platform.system() == "Windows"
+    exe_ext = ".exe" if is_windows else ""
+    ffmpeg_exe = Path(ffmpeg_path) / f"ffmpeg{exe_ext}"
+    
+    # 如果路径是目录，检查其中的可执行文件
+    if not ffmpeg_exe.exists():
+        # 可能 ffmpeg_path 本身就是可执行文件的路径
+        if os.path.isfile(ffmpeg_path) and os.access(ffmpeg_path, os.X_OK):
+            ffmpeg_exe = Path(ffmpeg_path)
+        else:
+            raise VideoConversionError(f"ffmpeg{exe_ext}不存在: {ffmpeg_exe}")
+    
+    # 根据格式类型构建ffmpeg命令
+    format_type = format_type.lower()
+    if format_type not in FORMAT_TYPES:
+        raise VideoConversionError(
+            f"不支持的格式类型 '{format_type}'\n"
+            f"支持的格式: {', '.join(FORMAT_TYPES)}"
+        )
+    
+    # 源文件已经适合编辑时只重封装
+    rewrap_args = plan_rewrap(ffmpeg_path, video_abs_path) if allow_rewrap else None
+    if rewrap_args:
+        use_gpu = False
+    
+    # 检测可用的GPU编码器
+    if gpu_encoders is None:
+        gpu_encoders = detect_gpu_encoders(ffmpeg_path) if use_gpu else {}
+    elif not use_gpu:
+        gpu_encoders = {}
+    
+    # 确定输出文件扩展名
+    # 使用无损音频时，MOV格式支持更好
+    if format_type in ["h264_high", "h264_gpu", "h265_gpu"]:
+        output_ext = "mov"  # 改为MOV以支持无损音频
+    else:
+        output_ext = "mov"
+    
+    # 输出文件路径：与源文件同目录，文件名添加_editing后缀
+    output_file = video_file.parent / f"{video_stem}_editing.{output_ext}"
+    
+    # 构建基础命令
+    cmd = [str(ffmpeg_exe.absolute())]
+    
+    # 尝试使用硬件解码加速（如果可用且使用GPU编码）
+    if format_type in ["h264_gpu", "h265_gpu"] and use_gpu:
+        # 尝试使用硬件解码（nvdec, dxva2等）
+        # 这会自动选择可用的硬件解码器
+        cmd.extend(["-hwaccel", "auto"])
+    
+    cmd.extend(["-i", str(video_abs_path)])
+    
+    if rewrap_args:
+        cmd.extend(rewrap_args)
+    elif format_type == "auto":
+        # encoder_benchmark 依赖本模块，在需要时才导入
+        from encoder_benchmark import EncoderBenchmark
+        try:
+            entry, _ = EncoderBenchmark.from_config(config).select(video_abs_path, ffmpeg_path, gpu_encoders)
+        except RuntimeError as e:
+            raise VideoConversionError(f"自动选择编码器失败: {e}") from e
+        cmd.extend(entry["args"])
+    else:
+        cmd.extend(preset_encoder_args(format_type, gpu_encoders))
     
     # 添加输出文件参数
-    cmd.extend(["-y", str(output_file.absolute())])
+    if proxies:
+        cmd = _add_proxy_outputs(cmd, output_file.absolute(), proxies)
+    else:
+        cmd.extend(["-y", str(output_file.absolute())])
     
     return cmd, str(output_file.absolute())
 
 
+def encoder_resource_class(cmd):
+    """根据命令中的视频编码器确定资源类型
+    
+    硬件编码器受显卡编码会话数限制（gpu），ProRes/DNx/x264等软件编码器受CPU核心限制（cpu），
+    复制视频流的重封装主要是磁盘I/O（disk）。生成代理文件时仍需要解码和编码，按CPU任务处理。
+    """
+    if "-c:v" in cmd:
+        encoder = cmd[cmd.index("-c:v") + 1]
+        if encoder.endswith(HARDWARE_ENCODER_SUFFIXES):
+            return "gpu"
+        if encoder == "copy" and "-filter_complex" not in cmd:
+            return "disk"
+    return "cpu"
+
+
+def expand_batch_sources(patterns, resolver):
+    """展开批量转换的输入（文件、目录或通配符），去掉重复项并保持输入顺序
+    
+    Returns:
+        list: 源文件列表（不存在的路径原样保留，在转换时按单个文件报告错误）
+    """
+    sources = []
+    seen = set()
+    for pattern in patterns:
+        pattern = pattern.strip('"\'')
+        if any(c in pattern for c in "*?["):
+            matches = [Path(p) for p in sorted(glob.glob(pattern, recursive=True))
+                       if Path(p).suffix.lower() in VIDEO_EXTENSIONS]
+            if not matches:
+                print(f"警告: 没有匹配的视频文件: {pattern}")
+        elif os.path.isdir(pattern):
+            matches = resolver.candidates(pattern)
+            if not matches:
+                print(f"警告: 目录中没有视频文件: {pattern}")
+        else:
+            matches = [pattern]
+        for match in matches:
+            if Path(match).stem.endswith("_editing"):
+                continue
+            key = os.path.normcase(os.path.abspath(match))
+            if key not in seen:
+                seen.add(key)
+                sources.append(match)
+    return sources
+
+
+def _parse_duration(lines):
+    """从ffmpeg输出中解析输入时长（秒）"""
+    for line in lines:
+        match = re.search(r"Duration:\s*(\d+):(\d+):([\d.]+)", line)
+        if match:
+            hours, minutes, seconds = match.groups()
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    return None
+
+
+def _run_batch_job(governor, cmd, outputs, config):
+    """执行一个批量转换任务（在工作线程中运行）
+    
+    Returns:
+        dict: 任务统计信息
+    
+    Raises:
+        VideoConversionError: ffmpeg执行失败
+    """
+    resource_class = encoder_resource_class(cmd)
+    source_file = cmd[cmd.index("-i") + 1]
+    with governor.acquire(resource_class) as slot:
+        start = time.monotonic()
+        # 并行任务的进度输出会互相混杂，只保留日志用于报告错误和解析时长
+        quiet_cmd = cmd[:1] + ["-hide_banner", "-nostats"] + cmd[1:]
+        with staged_conversion(slot, quiet_cmd, outputs, config) as run_cmd:
+            result = run_process(run_cmd)
+            if result.returncode != 0:
+                detail = "；".join(line.strip() for line in result.tail[-3:])
+                raise VideoConversionError(f"ffmpeg 返回码 {result.returncode}: {detail}")
+        elapsed = time.monotonic() - start
+    stamp_outputs(outputs, cmd)
+    return {
+        "encoder": resource_class,
+        "seconds": elapsed,
+        "input_bytes": os.path.getsize(source_file),
+        "output_bytes": os.path.getsize(outputs[0]),
+        "media_seconds": _parse_duration(result.tail),
+    }
+
+
+def print_batch_report(results, wall_seconds):
+    """输出批量转换的汇总和吞吐量报告"""
+    succeeded = [r for r in results if r["status"] == "ok"]
+    skipped = [r for r in results if r["status"] == "skipped"]
+    failed = [r for r in results if r["status"] == "failed"]
+    print("\n" + "=" * 60)
+    print(f"批量转换完成: 成功 {len(succeeded)} 个，已是最新 {len(skipped)} 个，失败 {len(failed)} 个，"
+          f"总耗时 {wall_seconds:.1f} 秒")
+    if succeeded and wall_seconds > 0:
+        input_mb = sum(r["input_bytes"] for r in succeeded) / (1024 * 1024)
+        output_mb = sum(r["output_bytes"] for r in succeeded) / (1024 * 1024)
+        print(f"输入 {input_mb:.1f} MB，输出 {output_mb:.1f} MB，"
+              f"吞吐量 {input_mb / wall_seconds:.1f} MB/s，{len(succeeded) * 3600 / wall_seconds:.1f} 个文件/小时")
+        media_seconds = sum(r["media_seconds"] or 0 for r in succeeded)
+        if media_seconds:
+            print(f"媒体总时长 {media_seconds / 60:.1f} 分钟，相当于 {media_seconds / wall_seconds:.1f} 倍实时速度")
+        for encoder, name in (("cpu", "CPU 编码"), ("gpu", "GPU 编码"), ("disk", "重封装")):
+            jobs = [r for r in succeeded if r["encoder"] == encoder]
+            if jobs:
+                busy = sum(r["seconds"] for r in jobs)
+                print(f"  {name}: {len(jobs)} 个文件，累计耗时 {busy:.1f} 秒")
+    if failed:
+        print("\n失败的文件:")
+        for r in failed:
+            print(f"  - {r['source']}: {r['error']}")
+
+
+def convert_batch(sources, ffmpeg_path, format_type="h264_gpu", config=None, proxies=None, allow_rewrap=True,
+                  force=False):
+    """批量转换多个视频
+    
+    按编码器类型分别调度：软件编码任务的并发数受 maxCpuJobs 限制（每个任务按核心预算分配线程），
+    硬件编码任务的并发数受 maxGpuSessions（显卡编码会话数）限制。单个文件失败不影响其他文件。
+    
+    Args:
+        sources: 源文件、目录或通配符列表
+        ffmpeg_path: ffmpeg路径
+        format_type: 输出格式类型
+        config: 配置字典（None时读取config.cfg）
+        proxies: 代理文件规格列表（可选）
+        allow_rewrap: 是否允许对已适合编辑的源文件只重封装
+        force: 输出文件已是最新时也重新转换
+    
+    Returns:
+        list: 每个文件的结果字典（status 为 "ok"、"skipped" 或 "failed"）
+    """
+    governor = get_governor(config)
+    resolver = FileResolver(VIDEO_EXTENSIONS, "视频文件")
+    format_type = format_type.lower()
+    use_gpu = format_type in GPU_DETECT_FORMATS
+    gpu_encoders = detect_gpu_encoders(ffmpeg_path) if use_gpu else {}
+
+    results = []
+    jobs = []
+    scheduled = {}
+    for source in expand_batch_sources(sources, resolver):
+        result = {"source": str(source), "output": None, "status": "failed", "error": None}
+        results.append(result)
+        try:
+            cmd, output_file = convert_video_for_editing(
+                source, ffmpeg_path, format_type, use_gpu=use_gpu,
+                gpu_encoders=gpu_encoders, resolver=resolver, proxies=proxies,
+                allow_rewrap=allow_rewrap, config=config,
+            )
+        except VideoConversionError as e:
+            result["error"] = str(e).splitlines()[0]
+            continue
+        # 模糊匹配可能把不同的输入解析为同一个文件，避免两个任务写同一个输出
+        if output_file in scheduled:
+            result["error"] = f"与 {scheduled[output_file]} 解析为同一个视频文件，已跳过"
+            continue
+        scheduled[output_file] = source
+        result["output"] = output_file
+        outputs = conversion_outputs(output_file, proxies)
+        if not force and is_up_to_date(outputs, cmd):
+            result["status"] = "skipped"
+            print(f"[跳过] {Path(source).name}: 输出文件已是最新")
+            continue
+        jobs.append((result, cmd, outputs))
+
+    if not jobs:
+        print_batch_report(results, 0)
+        return results
+
+    print(f"\n共 {len(jobs)} 个转换任务，CPU并发上限 {governor.limits['cpu']}，"
+          f"GPU会话上限 {governor.limits['gpu']}")
+    wall_start = time.monotonic()
+    pools = {rc: ThreadPoolExecutor(max_workers=governor.limits[rc], thread_name_prefix=f"convert-{rc}")
+             for rc in ("cpu", "gpu", "disk")}
+    try:
+        futures = [(result, pools[encoder_resource_class(cmd)].submit(_run_batch_job, governor, cmd, outputs, config))
+                   for result, cmd, outputs in jobs]
+        for result, future in futures:
+            name = Path(result["source"]).name
+            try:
+                result.update(future.result())
+                result["status"] = "ok"
+                print(f"[完成] {name}（{result['seconds']:.1f} 秒）")
+            except (VideoConversionError, OSError) as e:
+                result["error"] = str(e)
+                print(f"[失败] {name}: {e}")
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+    print_batch_report(results, time.monotonic() - wall_start)
+    return results
+
+
 def main():
     """主函数"""
-    if len(sys.argv) < 2:
-        print("使用方法: python convert_video.py <视频文件路径> [格式类型]")
+    args = sys.argv[1:]
+    allow_rewrap = "--force-transcode" not in args
+    force = "--force" in args
+    args = [a for a in args if a not in ("--force-transcode", "--force")]
+    # 代理文件参数可以重复，也可以用逗号分隔多个
+    proxies = []
+    while "--proxy" in args:
+        index = args.index("--proxy")
+        if index + 1 >= len(args):
+            print("错误: --proxy 需要指定代理格式")
+            sys.exit(1)
+        proxies.extend(p for p in args[index + 1].split(",") if p)
+        del args[index:index + 2]
+    
+    if not args:
+        print("使用方法: python convert_video.py <视频文件路径> [格式类型] [--proxy 代理格式[:高度]]")
         print("\n格式类型选项（按速度排序）:")
         print("  h264_gpu    - 快速H.264（GPU加速，最快，推荐）⭐")
         print("  h265_gpu    - 快速H.265/HEVC（GPU加速，快速，文件更小）⭐")
@@ -439,6 +860,7 @@ def main():
         print("  prores_lt   - ProRes 422 LT（CPU编码，质量稍低，文件较小）")
         print("  dnxhd       - DNxHD 145（CPU编码，Avid格式，1080p）")
         print("  dnxhr       - DNxHR HQ（CPU编码，Avid格式，支持任意分辨率）")
+        print("  auto        - 自动选择（在样本上测试本机的编码器，选择达到画质下限的最快的一种）")
         print("\n注意:")
         print("  - 带⭐的格式使用GPU加速，速度最快")
         print("  - GPU加速需要NVIDIA/AMD/Intel显卡支持")
@@ -446,19 +868,50 @@ def main():
         print("  - 视频质量：CQ/CRF 28（较低质量，但编码极快）")
         print("  - 音频质量：PCM 24bit（完全无损，绝不降低质量）")
         print("  - 输出格式：MOV（支持无损音频）")
+        print("  - 源视频已是ProRes/DNxHD/DNxHR/CineForm时只重封装（不转码），--force-transcode 强制转码")
+        print("  - 输出文件已由相同的源文件、参数和ffmpeg版本生成时跳过转换，--force 强制重新转换")
         print("\n示例:")
         print("  python convert_video.py video.mp4")
         print("  python convert_video.py video.mp4 h264_gpu")
         print("  python convert_video.py download/video/video.mp4 h265_gpu")
         print("  python convert_video.py video.mp4 prores")
+        print("\n批量转换:")
+        print("  python convert_video.py --batch <视频文件/目录/通配符...> [--format 格式类型]")
+        print("  python convert_video.py --batch \"download/*/*.mp4\" --format prores")
+        print("\n代理文件（与主文件同一次解码生成，保存在 Proxy/<规格>/ 下，文件名与主文件相同）:")
+        print("  prores_proxy - ProRes 422 Proxy（默认540p）")
+        print("  h264_proxy   - 低码率H.264（默认540p）")
+        print("  python convert_video.py video.mp4 prores --proxy prores_proxy")
+        print("  python convert_video.py video.mp4 prores --proxy prores_proxy,h264_proxy:360")
         sys.exit(1)
     
-    video_path = sys.argv[1]
+    if args[0] == "--batch":
+        args = args[1:]
+        format_type = "h264_gpu"
+        if "--format" in args:
+            index = args.index("--format")
+            if index + 1 >= len(args):
+                print("错误: --format 需要指定格式类型")
+                sys.exit(1)
+            format_type = args[index + 1].lower()
+            del args[index:index + 2]
+        if not args:
+            print("错误: 请指定要转换的视频文件")
+            sys.exit(1)
+        ffmpeg_path = find_ffmpeg_path()
+        if not ffmpeg_path:
+            print("错误: 未找到ffmpeg，无法转换视频")
+            sys.exit(1)
+        results = convert_batch(args, ffmpeg_path, format_type, proxies=proxies, allow_rewrap=allow_rewrap,
+                                force=force)
+        sys.exit(0 if results and all(r["status"] != "failed" for r in results) else 1)
+    
+    video_path = args[0]
     
     # 解析格式类型参数（可选，默认为h264_gpu，如果支持GPU）
     format_type = "h264_gpu"  # 默认使用GPU加速格式
-    if len(sys.argv) >= 3:
-        format_type = sys.argv[2].lower()
+    if len(args) >= 2:
+        format_type = args[1].lower()
     
     # 查找ffmpeg路径
     print("正在查找ffmpeg...")
@@ -473,20 +926,36 @@ def main():
     print(f"正在转换视频: {video_path}")
     print(f"输出格式: {format_type}")
     
-    # 只有GPU格式才需要检测GPU
-    use_gpu = format_type in ["h264_gpu", "h265_gpu"]
-    cmd, output_file = convert_video_for_editing(video_path, ffmpeg_path, format_type, use_gpu=use_gpu)
+    # 只有GPU格式和自动选择才需要检测GPU
+    use_gpu = format_type in GPU_DETECT_FORMATS
+    try:
+        cmd, output_file = convert_video_for_editing(video_path, ffmpeg_path, format_type,
+                                                     use_gpu=use_gpu, proxies=proxies, allow_rewrap=allow_rewrap)
+        outputs = conversion_outputs(output_file, proxies)
+    except VideoConversionError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
     
     print(f"输出文件: {output_file}")
-    print(f"执行命令: {' '.join(cmd)}")
+    for proxy_file in outputs[1:]:
+        print(f"代理文件: {proxy_file}")
+    
+    if not force and is_up_to_date(outputs, cmd):
+        print("\n输出文件已由相同的源文件、参数和ffmpeg版本生成，跳过转换（--force 强制重新转换）")
+        return
     
-    if format_type in ["h264_gpu", "h265_gpu"]:
+    if encoder_resource_class(cmd) == "gpu":
         print("\n注意: 使用GPU加速，转换速度会很快...")
     else:
         print("\n注意: 使用CPU编码，转换过程可能需要较长时间，请耐心等待...")
     
     try:
-        result = subprocess.run(cmd, check=True, capture_output=False)
+        with get_governor().acquire(encoder_resource_class(cmd)) as slot, \
+                staged_conversion(slot, cmd, outputs) as run_cmd:
+            # 先写入临时文件，完成后原子发布到输出路径
+            print(f"执行命令: {' '.join(run_cmd)}")
+            result = subprocess.run(run_cmd, check=True, capture_output=False)
+        stamp_outputs(outputs, cmd)
         print(f"\n视频转换完成！输出文件: {output_file}")
         print(f"文件大小: {Path(output_file).stat().st_size / (1024*1024):.2f} MB")
     except subprocess.CalledProcessError as e:
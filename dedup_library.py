@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+媒体库去重脚本
+同一个视频经常以不同标题重复出现（重新上传、改名），导致相同的MP4/FLAC保存了多份。
+本脚本对库中的媒体文件计算内容哈希，对内容完全相同的文件使用 reflink（写时复制）
+或硬链接合并，并报告回收的空间。
+
+- 只对大小相同的文件计算哈希，大小唯一的文件直接跳过
+- 分块读取、多线程并行计算哈希
+- 哈希结果按 (inode, 大小, 修改时间) 缓存，重新扫描时只计算变化的文件
+- 库中文件按大小建立索引，内联去重时只查找索引，不扫描整个库
+
+支持 Windows 和 Linux 平台（reflink 仅在支持的文件系统上可用，如 Btrfs/XFS）
+"""
+
+import hashlib
+import json
+import os
+import platform
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from output_stamps import refresh_stamp
+from tool_utils import get_download_dir, get_state_dir, load_optional_config
+
+
+# 参与去重的媒体文件扩展名
+MEDIA_EXTENSIONS = {'.mp4', '.mkv', '.webm', '.mov', '.flac', '.wav', '.m4a'}
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+CACHE_FILE_NAME = "hash_cache.json"
+SIZE_INDEX_FILE_NAME = "size_index.json"
+
+# Linux FICLONE ioctl（_IOW(0x94, 9, int)）
+FICLONE = 0x40049409
+
+
+def hash_file(path):
+    """分块计算文件内容哈希（BLAKE2b，hashlib会释放GIL，可多线程并行）"""
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _file_key(st):
+    """文件身份标识，用于判断缓存是否有效"""
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+class HashCache:
+    """按 (inode, 大小, 修改时间) 缓存文件哈希"""
+
+    def __init__(self, cache_path):
+        self.cache_path = Path(cache_path)
+        self._lock = threading.Lock()
+        self._entries = {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._entries = {}
+
+    def get(self, path, st):
+        entry = self._entries.get(str(path))
+        if entry and entry.get("key") == _file_key(st):
+            return entry["hash"]
+        return None
+
+    def put(self, path, st, digest):
+        with self._lock:
+            self._entries[str(path)] = {"key": _file_key(st), "hash": digest}
+
+    def prune(self, existing_paths):
+        """删除已不存在的文件的缓存"""
+        existing = {str(p) for p in existing_paths}
+        self._entries = {p: e for p, e in self._entries.items() if p in existing}
+
+    def save(self):
+        # 监视目录和下载后的内联去重可能同时保存，临时文件名按进程和线程区分
+        tmp = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp, self.cache_path)
+
+
+class SizeIndex:
+    """按大小索引库中的媒体文件路径
+
+    第一次使用时扫描整个库建立索引，之后由内联去重逐个添加新文件、完整去重时重建；
+    查找时检查文件是否仍然存在且大小未变，失效的路径从索引中删除。
+    """
+
+    def __init__(self, index_path):
+        self.index_path = Path(index_path)
+        self._dirty = False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self._sizes = json.load(f)
+            self.exists = True
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._sizes = {}
+            self.exists = False
+
+    def rebuild(self, files):
+        """用完整扫描的结果 [(Path, stat)] 重建索引"""
+        self._sizes = {}
+        for path, st in files:
+            self._sizes.setdefault(str(st.st_size), []).append(str(path))
+        self.exists = True
+        self._dirty = True
+
+    def add(self, path, size):
+        paths = self._sizes.setdefault(str(size), [])
+        if str(path) not in paths:
+            paths.append(str(path))
+            self._dirty = True
+
+    def lookup(self, size):
+        """大小为 size 的文件
+
+        Returns:
+            list: [(Path, os.stat_result)]
+        """
+        found = []
+        valid = []
+        for name in self._sizes.get(str(size), []):
+            try:
+                st = os.stat(name)
+            except OSError:
+                continue
+            if st.st_size == size:
+                found.append((Path(name), st))
+                valid.append(name)
+        if len(valid) != len(self._sizes.get(str(size), [])):
+            if valid:
+                self._sizes[str(size)] = valid
+            else:
+                self._sizes.pop(str(size), None)
+            self._dirty = True
+        return found
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._sizes, f)
+        os.replace(tmp, self.index_path)
+        self._dirty = False
+
+
+def scan_media_files(root):
+    """扫描目录中的媒体文件
+
+    Returns:
+        list: [(Path, os.stat_result)]
+    """
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for name in filenames:
+            if name.startswith('.'):
+                continue
+            path = Path(dirpath) / name
+            if path.suffix.lower() not in MEDIA_EXTENSIONS:
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if st.st_size > 0:
+                files.append((path, st))
+    return files
+
+
+def compute_hashes(files, cache, workers=None):
+    """并行计算文件哈希（命中缓存的文件不再读取）
+
+    Args:
+        files: [(Path, stat)]
+        cache: HashCache
+        workers: 并行线程数
+
+    Returns:
+        dict: {Path: 哈希值}
+    """
+    results = {}
+    todo = []
+    for path, st in files:
+        digest = cache.get(path, st)
+        if digest:
+            results[path] = digest
+        else:
+            todo.append((path, st))
+
+    if todo:
+        total_mb = sum(st.st_size for _, st in todo) / (1024 * 1024)
+        print(f"需要计算哈希: {len(todo)} 个文件（{total_mb:.1f} MB），缓存命中: {len(results)} 个")
+
+    def _work(item):
+        path, st = item
+        digest = hash_file(path)
+        cache.put(path, st, digest)
+        return path, digest
+
+    with ThreadPoolExecutor(max_workers=workers or min(8, (os.cpu_count() or 1) + 2)) as pool:
+        for path, digest in pool.map(_work, todo):
+            results[path] = digest
+    return results
+
+
+def _reflink(src, dst):
+    """使用 FICLONE 创建 reflink（写时复制），不支持时抛出 OSError"""
+    if platform.system() != "Linux":
+        raise OSError("reflink 仅支持 Linux")
+    import fcntl
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def link_duplicate(original, duplicate, method="auto"):
+    """用 original 的内容替换 duplicate（reflink 或硬链接），原子替换
+
+    duplicate 的处理记录（output_stamps）随之更新，增量处理不会因为链接而重新生成它。
+
+    Args:
+        original: 保留的文件
+        duplicate: 要被替换的重复文件
+        method: "reflink"、"hardlink" 或 "auto"（优先reflink，失败时硬链接）
+
+    Returns:
+        str: 实际使用的方法，失败返回None
+    """
+    tmp = duplicate.parent / f".{duplicate.name}.dedup-{os.getpid()}"
+    methods = ["reflink", "hardlink"] if method == "auto" else [method]
+    try:
+        st = duplicate.stat()
+    except OSError:
+        return None
+    for m in methods:
+        try:
+            if m == "reflink":
+                _reflink(original, tmp)
+                # reflink 是独立文件，保留原来的修改时间
+                os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            else:
+                os.link(original, tmp)
+            os.replace(tmp, duplicate)
+        except OSError:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            continue
+        try:
+            refresh_stamp(duplicate, st)
+        except OSError as e:
+            print(f"警告: 无法更新处理记录 {duplicate.name}: {e}")
+        return m
+    return None
+
+
+def find_duplicate_groups(files, cache, workers=None):
+    """找出内容相同的文件组
+
+    Returns:
+        list: [[(Path, stat), ...]]，每组至少2个文件
+    """
+    # 先按大小分组，只有大小相同的文件才可能重复
+    by_size = {}
+    for path, st in files:
+        by_size.setdefault(st.st_size, []).append((path, st))
+    candidates = [item for group in by_size.values() if len(group) > 1 for item in group]
+    if not candidates:
+        return []
+
+    # 已经硬链接在一起的文件只需计算一次哈希
+    by_inode = {}
+    for path, st in candidates:
+        by_inode.setdefault((st.st_dev, st.st_ino), []).append((path, st))
+    hashes = compute_hashes([group[0] for group in by_inode.values()], cache, workers)
+
+    by_hash = {}
+    for group in by_inode.values():
+        digest = hashes[group[0][0]]
+        by_hash.setdefault((group[0][1].st_size, digest), []).extend(group)
+    # 只保留包含不同inode的组（全部已链接的组不需要处理）
+    return [group for group in by_hash.values()
+            if len({(st.st_dev, st.st_ino) for _, st in group}) > 1]
+
+
+def dedup_groups(groups, method="auto", dry_run=False):
+    """合并重复文件组
+
+    Returns:
+        int: 回收的字节数
+    """
+    reclaimed = 0
+    # 同一inode的多个路径只计算一次回收空间
+    reclaimed_inodes = set()
+    for group in groups:
+        # 保留最早的文件，其余文件链接到它
+        group = sorted(group, key=lambda item: (item[1].st_mtime_ns, str(item[0])))
+        original, original_st = group[0]
+        for path, st in group[1:]:
+            if (st.st_dev, st.st_ino) == (original_st.st_dev, original_st.st_ino):
+                # 已经是硬链接
+                continue
+            if st.st_dev != original_st.st_dev:
+                print(f"跳过（不在同一文件系统）: {path}")
+                continue
+            inode = (st.st_dev, st.st_ino)
+            if dry_run:
+                print(f"[预览] {path} -> {original}")
+            else:
+                used = link_duplicate(original, path, method)
+                if not used:
+                    print(f"合并失败: {path}")
+                    continue
+                print(f"已合并（{used}）: {path.name} -> {original}")
+            if inode not in reclaimed_inodes:
+                reclaimed_inodes.add(inode)
+                reclaimed += st.st_size
+    return reclaimed
+
+
+def dedup_library(root, config=None, dry_run=False):
+    """对整个库执行去重
+
+    Args:
+        root: 库根目录
+        config: 配置字典
+        dry_run: 只报告不修改
+
+    Returns:
+        int: 回收的字节数
+    """
+    config = config or {}
+    method = config.get("dedupLink", "auto")
+    cache = HashCache(get_state_dir(root) / CACHE_FILE_NAME)
+
+    print(f"正在扫描媒体文件: {root}")
+    files = scan_media_files(root)
+    print(f"找到 {len(files)} 个媒体文件")
+    index = SizeIndex(get_state_dir(root) / SIZE_INDEX_FILE_NAME)
+    index.rebuild(files)
+    index.save()
+
+    groups = find_duplicate_groups(files, cache)
+    cache.prune(path for path, _ in files)
+    cache.save()
+
+    if not groups:
+        print("没有发现重复文件")
+        return 0
+
+    print(f"发现 {len(groups)} 组重复文件")
+    reclaimed = dedup_groups(groups, method, dry_run)
+    print(f"\n{'可回收' if dry_run else '已回收'}空间: {reclaimed / (1024 ** 3):.2f} GB")
+    return reclaimed
+
+
+def dedup_file(path, root, config=None):
+    """内联去重：新产生的文件与库中已有文件比较，相同时链接到已有文件
+
+    从大小索引中查找与新文件大小相同的文件，只对它们计算哈希（有缓存时几乎没有额外开销）。
+    索引不存在时扫描一次整个库建立索引；不经过本工具加入库中的文件在下次完整去重后才会被索引。
+
+    Args:
+        path: 新文件路径
+        root: 库根目录
+        config: 配置字典
+
+    Returns:
+        int: 回收的字节数
+    """
+    config = config or {}
+    path = Path(path).absolute()
+    root = Path(root).absolute()
+    try:
+        st = path.stat()
+    except OSError:
+        return 0
+    index = SizeIndex(get_state_dir(root) / SIZE_INDEX_FILE_NAME)
+    if not index.exists:
+        index.rebuild(scan_media_files(root))
+    same_size = [(p, s) for p, s in index.lookup(st.st_size) if p != path]
+    index.add(path, st.st_size)
+    index.save()
+    if not same_size:
+        return 0
+    cache = HashCache(get_state_dir(root) / CACHE_FILE_NAME)
+    groups = find_duplicate_groups(same_size + [(path, st)], cache)
+    cache.save()
+    groups = [g for g in groups if any(p == path for p, _ in g)]
+    if not groups:
+        return 0
+    reclaimed = dedup_groups(groups, config.get("dedupLink", "auto"))
+    if reclaimed:
+        print(f"去重回收空间: {reclaimed / (1024 * 1024):.1f} MB")
+    return reclaimed
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    if args and args[0] in ("-h", "--help"):
+        print("使用方法: python dedup_library.py [库目录] [--dry-run]")
+        print("示例: python dedup_library.py")
+        print("示例: python dedup_library.py download --dry-run")
+        print("\n参数说明:")
+        print("  库目录     要去重的目录（默认使用配置中的 downloadDir）")
+        print("  --dry-run  只报告重复文件和可回收空间，不修改文件")
+        sys.exit(0)
+
+    dry_run = "--dry-run" in args
+    dirs = [a for a in args if not a.startswith("--")]
+
+    config = load_optional_config()
+    root = Path(dirs[0]).absolute() if dirs else get_download_dir(config)
+    if not root.is_dir():
+        print(f"错误: 目录不存在: {root}")
+        sys.exit(1)
+
+    dedup_library(root, config, dry_run=dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+下载并发自动调整
+代理线路的最佳下载参数随时段变化：有时多开分片连接才能跑满带宽，有时连接一多就被限速。
+本模块测量每个下载任务的实际吞吐量，用 AIMD（加性增、乘性减）控制器调整 yt-dlp 的分片并发数
+（--concurrent-fragments）和同时下载的任务数（network 资源槽位），并遵守配置的全局带宽上限。
+
+调整规则（每个下载任务完成后）:
+    - 下载失败，或总吞吐量比近期平均低 DROP_THRESHOLD 以上：分片并发数和同时下载数减半
+    - 总吞吐量已接近全局带宽上限：保持不变
+    - 单个任务比上一次下载快：分片并发数 +1；不再变快（分片已不是瓶颈）：同时下载数 +1
+
+状态保存在资源调度器的锁目录中（download_tuner.json），同一台机器上的所有下载进程共用。
+配置字段:
+    adaptiveDownload: 是否自动调整（默认false，不调整时使用 concurrentFragments 和 maxNetworkJobs）
+    bandwidthLimit: 全局带宽上限，如 "8M"（字节/秒，支持K/M/G），平分给开始下载时实际同时进行的下载
+    concurrentFragments: 分片并发数（不自动调整时使用，或作为自动调整的初始值）
+    maxConcurrentFragments: 自动调整时分片并发数的上限（默认16）
+    downloader: 外部下载器（如 "aria2c"），连接数同样按分片并发数设置
+"""
+
+import json
+import os
+import sys
+import time
+
+from resource_governor import get_governor
+from tool_utils import load_optional_config
+
+
+STATE_FILE = "download_tuner.json"
+DEFAULT_MAX_FRAGMENTS = 16
+# 总吞吐量低于近期平均的比例超过该值时视为拥塞/限速
+DROP_THRESHOLD = 0.25
+# 单个任务吞吐量比上一次提高超过该比例时，认为增加分片有效
+IMPROVE_THRESHOLD = 0.05
+# 总吞吐量达到带宽上限的该比例时不再增加并发
+CAP_HEADROOM = 0.9
+# 近期平均吞吐量的指数平滑系数
+EWMA_ALPHA = 0.3
+# 超过该时间没有新样本时丢弃近期平均（线路状况可能已经变化）
+STALE_SECONDS = 3600
+# 太小或太快的下载（如文件已存在被跳过）不作为样本
+MIN_SAMPLE_BYTES = 4 * 1024 * 1024
+MIN_SAMPLE_SECONDS = 3.0
+# 状态文件中保留的最近样本数
+HISTORY_SIZE = 20
+
+_RATE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_rate(value):
+    """解析带宽设置（与yt-dlp的 --limit-rate 相同，如 "500K"、"8M"），返回字节/秒，未设置时返回None"""
+    if value in (None, "", 0):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().upper().rstrip("B").rstrip("I")
+    unit = text[-1] if text and text[-1] in _RATE_UNITS else ""
+    try:
+        number = float(text[:-1] if unit else text)
+    except ValueError:
+        raise ValueError(f"无效的带宽设置: {value}")
+    return number * _RATE_UNITS[unit]
+
+
+def format_rate(rate):
+    """把字节/秒格式化为易读的形式"""
+    for unit in ("G", "M", "K"):
+        if rate >= _RATE_UNITS[unit]:
+            return f"{rate / _RATE_UNITS[unit]:.1f} {unit}B/s"
+    return f"{rate:.0f} B/s"
+
+
+class DownloadTuner:
+    """根据实测吞吐量调整下载并发参数
+
+    Args:
+        state_path: 状态文件路径
+        max_fragments: 分片并发数上限
+        max_parallel: 同时下载数上限（network 资源槽位数）
+        bandwidth_cap: 全局带宽上限（字节/秒，None表示不限制）
+        adaptive: 为False时使用固定参数，不记录样本
+        initial_fragments: 分片并发数的初始值/固定值
+        downloader: 外部下载器名称（可选）
+    """
+
+    def __init__(self, state_path, max_fragments=DEFAULT_MAX_FRAGMENTS, max_parallel=2, bandwidth_cap=None,
+                 adaptive=True, initial_fragments=1, downloader=None):
+        self.state_path = state_path
+        self.max_fragments = max(1, int(max_fragments))
+        self.max_parallel = max(1, int(max_parallel))
+        self.bandwidth_cap = bandwidth_cap
+        self.adaptive = adaptive
+        self.initial_fragments = min(self.max_fragments, max(1, int(initial_fragments)))
+        self.downloader = downloader
+
+    @classmethod
+    def from_config(cls, config=None):
+        """根据配置创建调整器（状态文件位于资源调度器的锁目录）"""
+        if config is None:
+            config = load_optional_config()
+        governor = get_governor(config)
+        return cls(
+            governor.lock_dir / STATE_FILE,
+            max_fragments=config.get("maxConcurrentFragments", DEFAULT_MAX_FRAGMENTS),
+            max_parallel=governor.limits["network"],
+            bandwidth_cap=parse_rate(config.get("bandwidthLimit")),
+            adaptive=config.get("adaptiveDownload", False),
+            initial_fragments=config.get("concurrentFragments", 1),
+            downloader=config.get("downloader"),
+        )
+
+    def _load(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = {}
+        state.setdefault("fragments", self.initial_fragments)
+        state.setdefault("parallel", 1)
+        state.setdefault("history", [])
+        # 上限可能在配置中被调低
+        state["fragments"] = min(max(1, state["fragments"]), self.max_fragments)
+        state["parallel"] = min(max(1, state["parallel"]), self.max_parallel)
+        return state
+
+    def _save(self, state):
+        # 多个进程同时更新时后写入的生效，偶尔丢失一个样本不影响调整
+        tmp = self.state_path.with_name(f"{self.state_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def current(self, active=None):
+        """当前的下载参数
+
+        Args:
+            active: 实际同时进行的下载数（包括本任务，开始下载时由 network 资源槽位的占用数得到）；
+                None时按允许的同时下载数估算
+
+        Returns:
+            dict: {"fragments": 分片并发数, "parallel": 允许的同时下载数, "active": 实际同时下载数,
+                   "rate_limit": 每个下载的限速（字节/秒或None）}
+        """
+        if self.adaptive:
+            state = self._load()
+            fragments, parallel = state["fragments"], state["parallel"]
+        else:
+            fragments, parallel = self.initial_fragments, self.max_parallel
+        active = max(1, int(active)) if active else parallel
+        rate_limit = self.bandwidth_cap / active if self.bandwidth_cap else None
+        return {"fragments": fragments, "parallel": parallel, "active": active, "rate_limit": rate_limit}
+
+    def ytdlp_args(self, settings):
+        """下载参数对应的yt-dlp命令行参数"""
+        args = ["--concurrent-fragments", str(settings["fragments"])]
+        if settings["rate_limit"]:
+            args.extend(["--limit-rate", str(int(settings["rate_limit"]))])
+        if self.downloader:
+            args.extend(["--downloader", self.downloader])
+            if self.downloader == "aria2c":
+                # aria2c 每个服务器的连接数上限为16
+                connections = min(16, settings["fragments"])
+                args.extend(["--downloader-args", f"aria2c:-x {connections} -s {connections} -k 1M"])
+        return args
+
+    def record(self, settings, nbytes, seconds):
+        """记录一次成功下载的吞吐量并调整参数
+
+        Args:
+            settings: 这次下载使用的参数（current() 的返回值）
+            nbytes: 下载的字节数
+            seconds: 下载耗时（不包括等待资源槽位的时间）
+
+        Returns:
+            str: 采取的调整（"increase-fragments"/"increase-parallel"/"decrease"/"hold"，
+                参数已被其他下载调整过时为"stale"），未记录时返回None
+        """
+        if not self.adaptive or nbytes < MIN_SAMPLE_BYTES or seconds < MIN_SAMPLE_SECONDS:
+            return None
+        throughput = nbytes / seconds
+        # 同时进行的下载大致平分线路，总吞吐量按这次下载开始时实际同时进行的下载数估算
+        aggregate = throughput * settings.get("active", settings["parallel"])
+
+        state = self._load()
+        if time.time() - state.get("updated_at", 0) > STALE_SECONDS:
+            state.pop("job_throughput", None)
+            state.pop("aggregate_throughput", None)
+        job_base = state.get("job_throughput")
+        aggregate_base = state.get("aggregate_throughput")
+        previous = state.get("last_throughput") if job_base is not None else None
+
+        if (settings["fragments"], settings["parallel"]) != (state["fragments"], state["parallel"]):
+            # 开始下载后参数已被其他下载调整过（如刚减半），这个样本不再代表当前参数，只记录不调整
+            self._append_history(state, settings, "stale", throughput)
+            self._save(state)
+            return "stale"
+        if aggregate_base and aggregate < aggregate_base * (1 - DROP_THRESHOLD):
+            action = self._decrease(state)
+        elif self.bandwidth_cap and aggregate >= self.bandwidth_cap * CAP_HEADROOM:
+            action = "hold"
+        elif (previous is None or throughput > previous * (1 + IMPROVE_THRESHOLD)) \
+                and state["fragments"] < self.max_fragments:
+            state["fragments"] += 1
+            action = "increase-fragments"
+        elif state["parallel"] < self.max_parallel:
+            state["parallel"] += 1
+            action = "increase-parallel"
+        else:
+            action = "hold"
+
+        if action == "decrease":
+            # 线路状况变化后重新建立近期平均
+            state["job_throughput"], state["aggregate_throughput"] = throughput, aggregate
+        else:
+            state["job_throughput"] = throughput if job_base is None \
+                else job_base + EWMA_ALPHA * (throughput - job_base)
+            state["aggregate_throughput"] = aggregate if aggregate_base is None \
+                else aggregate_base + EWMA_ALPHA * (aggregate - aggregate_base)
+        state["last_throughput"] = throughput
+        self._append_history(state, settings, action, throughput)
+        self._save(state)
+        return action
+
+    def record_failure(self, settings):
+        """记录一次失败的下载（限速、连接被重置等），分片并发数和同时下载数减半"""
+        if not self.adaptive:
+            return None
+        state = self._load()
+        action = self._decrease(state)
+        self._append_history(state, settings, "failure", None)
+        self._save(state)
+        return action
+
+    def _decrease(self, state):
+        state["fragments"] = max(1, state["fragments"] // 2)
+        state["parallel"] = max(1, state["parallel"] // 2)
+        return "decrease"
+
+    def _append_history(self, state, settings, action, throughput):
+        state["updated_at"] = time.time()
+        state["history"] = (state["history"] + [{
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "fragments": settings["fragments"],
+            "parallel": settings["parallel"],
+            "active": settings.get("active"),
+            "throughput": throughput,
+            "action": action,
+        }])[-HISTORY_SIZE:]
+
+    def reset(self):
+        """清除调整状态，从初始参数重新开始"""
+        if self.state_path.exists():
+            self.state_path.unlink()
+
+
+def main():
+    """主函数：显示当前的下载参数和最近的样本"""
+    args = sys.argv[1:]
+    if args and args[0] in ("-h", "--help"):
+        print("使用方法: python download_tuner.py [--reset]")
+        print("显示自动调整的下载参数和最近的吞吐量样本，--reset 清除调整状态")
+        sys.exit(0)
+
+    tuner = DownloadTuner.from_config()
+    if "--reset" in args:
+        tuner.reset()
+        print("已清除下载参数调整状态")
+        return
+
+    settings = tuner.current()
+    print(f"自动调整: {'开启' if tuner.adaptive else '关闭'}（状态文件: {tuner.state_path}）")
+    print(f"分片并发数: {settings['fragments']}（上限 {tuner.max_fragments}）")
+    print(f"同时下载数: {settings['parallel']}（上限 {tuner.max_parallel}）")
+    if tuner.bandwidth_cap:
+        print(f"全局带宽上限: {format_rate(tuner.bandwidth_cap)}，平分给实际同时进行的下载"
+              f"（同时 {settings['parallel']} 个时每个 {format_rate(settings['rate_limit'])}）")
+    if not tuner.adaptive:
+        return
+    state = tuner._load()
+    if state.get("aggregate_throughput"):
+        print(f"近期总吞吐量: {format_rate(state['aggregate_throughput'])}，"
+              f"单个任务: {format_rate(state['job_throughput'])}")
+    if state["history"]:
+        print("\n最近的样本:")
+        for sample in state["history"]:
+            rate = format_rate(sample["throughput"]) if sample["throughput"] else "-"
+            active = sample.get("active") or "-"
+            print(f"  {sample['at']}  分片 {sample['fragments']:>2}  同时 {active}/{sample['parallel']}  "
+                  f"{rate:>12}  {sample['action']}")
+
+
+if __name__ == "__main__":
+    main()
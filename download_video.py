@@ -6,6 +6,7 @@ YouTube视频下载脚本
 支持 Windows 和 Linux 平台
 """
 
+import atexit
 import json
 import os
 import sys
@@ -13,17 +14,50 @@ import subprocess
 import platform
 import shutil
 import time
+import threading
 import glob
+import hashlib
+import re
 from pathlib import Path
 
-# 导入图像转换函数
-try:
-    from convert_16_9_to_4_3 import convert_16_9_to_4_3
-except ImportError:
-    # 如果导入失败，定义占位函数
-    def convert_16_9_to_4_3(image_path):
+from async_runner import ProcessTimeout, log_path_for, run_process
+from audio_analysis import (STDERR_TAIL_LINES, build_analysis_filter, parse_analysis_output, print_analysis,
+                            write_analysis_sidecar)
+from chapter_split import chapters_from_info, split_chapters
+from dedup_library import dedup_file
+from download_tuner import DownloadTuner, format_rate
+from job_graph import JobGraph
+from proxy_pool import ProxyPool, leased_config
+from output_stamps import is_up_to_date, stamp_outputs
+from resource_governor import get_governor
+from scratch_staging import get_scratch_area, staged_output
+from tool_utils import cover_art_args, find_cover_4_3, get_state_dir, get_tool_exe
+from verify_library import verify_file
+
+def convert_16_9_to_4_3(image_path):
+    """将封面转换为4:3比例
+    
+    图像转换模块依赖Pillow，在真正需要转换封面时才导入，只下载音频或提取音频时不加载。
+    """
+    try:
+        from convert_16_9_to_4_3 import convert_16_9_to_4_3 as convert
+    except ImportError:
         print(f"警告: 无法导入图像转换模块，跳过封面转换")
         return None
+    return convert(image_path)
+
+
+def keyframe_cover(video_file, cover_path, ffmpeg_path, config):
+    """从视频关键帧中挑选封面并转换为4:3比例
+    
+    关键帧封面模块依赖NumPy和Pillow，只在配置了 coverSource: "keyframes" 时导入。
+    """
+    try:
+        from keyframe_cover import pick_keyframe_cover
+    except ImportError:
+        print(f"警告: 无法导入关键帧封面模块（需要NumPy和Pillow）")
+        return None
+    return pick_keyframe_cover(video_file, ffmpeg_path, cover_path=cover_path, config=config)
 
 
 def load_config(config_path="config.cfg"):
@@ -137,7 +171,8 @@ def find_ytdlp():
     return None
 
 
-def build_ytdlp_command(video_url, config, download_dir, ffmpeg_path=None, download_video=True):
+def build_ytdlp_command(video_url, config, download_dir, ffmpeg_path=None, download_video=True, temp_dir=None,
+                        info_json=None, write_thumbnail=True, stream_formats=None, tuning_args=None):
     """构建yt-dlp命令
     
     Args:
@@ -146,6 +181,11 @@ def build_ytdlp_command(video_url, config, download_dir, ffmpeg_path=None, downl
         download_dir: 下载目录
         ffmpeg_path: ffmpeg路径
         download_video: 是否下载视频（False时只下载音频）
+        temp_dir: 临时工作区目录（可选，.part分片和合并中间文件写在这里）
+        info_json: 预先获取的视频信息JSON文件（可选，使用时不再重新解析网页）
+        write_thumbnail: 是否同时下载封面（封面已单独提前下载时为False）
+        stream_formats: 分别下载的格式ID列表（可选，之后自行合并，yt-dlp不合并）
+        tuning_args: 分片并发数、限速等下载参数（可选，见 download_tuner）
     """
     ytdlp_cmd = find_ytdlp()
     
@@ -166,13 +206,29 @@ def build_ytdlp_command(video_url, config, download_dir, ffmpeg_path=None, downl
     # 设置输出目录和文件名格式
     # 格式: download/<视频名>/<视频名>.<扩展名>
     # yt-dlp会自动创建文件夹并清理文件名中的非法字符（保留中文等字符）
-    cmd.extend(["-o", os.path.join(download_dir, "%(title)s", "%(title)s.%(ext)s")])
+    # 配置了临时工作区时，中间文件写入临时目录，只有完成的文件才会移动到下载目录
+    cmd.extend(["-P", f"home:{download_dir}"])
+    if temp_dir:
+        cmd.extend(["-P", f"temp:{temp_dir}"])
+    if stream_formats:
+        # 与yt-dlp合并时的中间文件同名: <标题>.f<格式ID>.<扩展名>
+        cmd.extend(["-o", os.path.join("%(title)s", "%(title)s.f%(format_id)s.%(ext)s")])
+        cmd.extend(["-f", ",".join(stream_formats)])
+    else:
+        cmd.extend(["-o", os.path.join("%(title)s", "%(title)s.%(ext)s")])
     
-    if download_video:
-        # 下载视频封面图片（最佳质量）
-        cmd.append("--write-thumbnail")
-        # 将缩略图转换为JPG格式（更通用）
-        cmd.extend(["--convert-thumbnails", "jpg"])
+    if stream_formats:
+        # 封面已单独下载，合并由下载任务图的 video 阶段完成
+        pass
+    elif download_video:
+        if write_thumbnail:
+            # 下载视频封面图片（最佳质量）
+            cmd.append("--write-thumbnail")
+            # 将缩略图转换为JPG格式（更通用）
+            cmd.extend(["--convert-thumbnails", "jpg"])
+        
+        # 把章节写入视频文件，之后单独提取音频时也可以按章节分轨
+        cmd.append("--embed-chapters")
         
         # 如果isCombineVideo为True，下载最佳视频+音频并合并
         if config.get("isCombineVideo", False):
@@ -195,12 +251,96 @@ def build_ytdlp_command(video_url, config, download_dir, ffmpeg_path=None, downl
         # 只下载音频，不下载视频和封面
         pass
     
-    # 添加视频URL
-    cmd.append(video_url)
+    if tuning_args:
+        cmd.extend(tuning_args)
+    
+    # 添加视频URL（或预先获取的视频信息）
+    if info_json:
+        cmd.extend(["--load-info-json", str(info_json)])
+    else:
+        cmd.append(video_url)
     
     return cmd
 
 
+def fetch_video_info(video_url, config, download_dir, info_path):
+    """预先获取视频信息（不下载），保存为JSON文件
+    
+    之后的视频下载和封面下载都用 --load-info-json 读取这个文件，网页只解析一次。
+    
+    Args:
+        video_url: 视频URL
+        config: 配置字典
+        download_dir: 下载目录
+        info_path: 保存视频信息的JSON文件路径
+    
+    Returns:
+        dict: 视频信息，获取失败或URL是播放列表时返回None
+    """
+    ytdlp_cmd = find_ytdlp()
+    if not ytdlp_cmd:
+        return None
+    cmd = [ytdlp_cmd]
+    if config.get("proxy"):
+        cmd.extend(["--proxy", config["proxy"]])
+    # 使用与下载相同的输出模板，信息中的 _filename 即为最终的文件路径
+    cmd.extend(["-P", f"home:{download_dir}", "-o", os.path.join("%(title)s", "%(title)s.%(ext)s")])
+    # 与下载时相同的格式选择，信息中的 requested_formats 即为要下载的视频流和音频流
+    cmd.extend(["-f", "bestvideo+bestaudio/best" if config.get("isCombineVideo", False) else "best"])
+    cmd.extend(["--dump-single-json", "--no-warnings", video_url])
+    try:
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True, encoding="utf-8")
+        info = json.loads(result.stdout)
+    except (subprocess.CalledProcessError, json.JSONDecodeError, OSError) as e:
+        print(f"获取视频信息失败，封面将在视频下载完成后处理: {e}")
+        return None
+    if info.get("_type", "video") != "video" or not info.get("_filename"):
+        return None
+    with open(info_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False)
+    return info
+
+
+class CoverJob:
+    """下载封面并转换为4:3比例
+    
+    在下载任务图中与视频下载并行执行。封面只有几百KB，不占用全局的网络下载槽位，
+    否则在 maxNetworkJobs 为1时会排在视频后面。
+    """
+    
+    def __init__(self, video_filename, info_path, config, download_dir, ffmpeg_path=None):
+        self.cover_path = Path(video_filename).with_suffix(".jpg")
+        self.cmd = [find_ytdlp()]
+        if config.get("proxy"):
+            self.cmd.extend(["--proxy", config["proxy"]])
+        if ffmpeg_path:
+            self.cmd.extend(["--ffmpeg-location", ffmpeg_path])
+        self.cmd.extend(["-P", f"home:{download_dir}", "-o", os.path.join("%(title)s", "%(title)s.%(ext)s")])
+        self.cmd.extend(["--skip-download", "--write-thumbnail", "--convert-thumbnails", "jpg",
+                         "--no-warnings", "--quiet", "--load-info-json", str(info_path)])
+    
+    def run(self):
+        """下载并转换封面
+        
+        Returns:
+            str: 转换后的封面路径
+        
+        Raises:
+            RuntimeError: 下载或转换失败
+        """
+        try:
+            subprocess.run(self.cmd, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"下载封面时出错: {e}") from e
+        if not self.cover_path.exists():
+            raise RuntimeError("未找到下载的封面图片")
+        result = convert_16_9_to_4_3(self.cover_path)
+        if not result:
+            raise RuntimeError("封面转换失败")
+        print(f"封面转换成功: {Path(result).name}")
+        return str(result)
+
+
 def find_thumbnail_files(download_dir, video_url=None):
     """
     查找下载的封面图片文件
@@ -313,8 +453,20 @@ def convert_thumbnails_to_4_3(download_dir, video_url=None):
     return converted_count
 
 
-def extract_audio_from_video(video_path, config, ffmpeg_path=None):
-    """从已下载的视频文件中提取音频"""
+def extract_audio_from_video(video_path, config, ffmpeg_path=None, analyze=None, cover=None):
+    """从已下载的视频文件中提取音频
+    
+    Args:
+        video_path: 视频文件路径
+        config: 配置字典
+        ffmpeg_path: ffmpeg路径
+        analyze: 是否在同一次解码中进行响度/峰值分析（None时读取配置 analyzeAudio）
+        cover: 4:3封面图片（可选，在同一次编码中写入FLAC的PICTURE块；None时查找视频旁的 _4_3.jpg）
+    """
+    if analyze is None:
+        analyze = config.get("analyzeAudio", False)
+    # 波形概览在同一次解码中生成（NumPy只在需要时导入）
+    overview = config.get("waveformOverview", False)
     if not ffmpeg_path:
         print("错误: 需要 ffmpeg 才能从视频中提取音频")
         return False
@@ -333,11 +485,6 @@ def extract_audio_from_video(video_path, config, ffmpeg_path=None):
     # 构建输出音频文件路径
     audio_file = video_file.parent / f"{video_file.stem}.{audio_format}"
     
-    # 如果音频文件已存在，跳过提取
-    if audio_file.exists():
-        print(f"音频文件已存在，跳过提取: {audio_file.name}")
-        return True
-    
     # 构建 ffmpeg 命令提取音频
     is_windows = platform.system() == "Windows"
     exe_ext = ".exe" if is_windows else ""
@@ -357,8 +504,26 @@ def extract_audio_from_video(video_path, config, ffmpeg_path=None):
         print("错误: 未找到 ffmpeg 可执行文件")
         return False
     
+    # WAV不能保存封面图片
+    if cover is None:
+        cover = find_cover_4_3(video_file)
+    if audio_format != "flac":
+        cover = None
+    
     # 提取音频命令
-    cmd = [str(ffmpeg_exe), "-i", str(video_file), "-vn"]  # 不包含视频
+    cmd = [str(ffmpeg_exe), "-i", str(video_file)]
+    if cover:
+        cmd.extend(["-i", str(cover)])
+    if analyze:
+        # 同一次解码中分出一路音频做响度/峰值分析（只映射音频输出，不包含视频）
+        cmd.extend(build_analysis_filter())
+    elif cover:
+        cmd.extend(["-map", "0:a:0"])  # 只取音频，视频流由封面代替
+    else:
+        cmd.append("-vn")  # 不包含视频
+    if cover:
+        # 封面与音频在同一次编码中写入，不需要之后再重新封装
+        cmd.extend(cover_art_args(1))
     
     # Hi-Res无损音质要求：采样率不低于48kHz，位深度不低于24bit
     # 设置采样率至少为48kHz（满足Hi-Res最低要求）
@@ -374,16 +539,61 @@ def extract_audio_from_video(video_path, config, ffmpeg_path=None):
     
     cmd.extend(["-y", str(audio_file)])  # 覆盖输出文件
     
+    # 只有输出文件由相同的命令、输入和ffmpeg版本生成且没有被修改时才跳过
+    if is_up_to_date([audio_file], cmd):
+        print(f"音频文件已是最新，跳过提取: {audio_file.name}")
+        if overview:
+            from waveform_overview import generate_overview
+            try:
+                generate_overview(audio_file, ffmpeg_path)
+            except RuntimeError as e:
+                print(f"生成波形概览失败: {e}")
+        return True
+    
     print(f"正在从视频中提取音频: {video_file.name} -> {audio_file.name}")
+    peaks = None
+    if overview:
+        from waveform_overview import PeakAccumulator, overview_path
+        peaks = PeakAccumulator(overview_path(audio_file))
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        # 提取音频以读取大文件为主，占用磁盘资源槽位
+        with get_governor(config).acquire("disk") as slot, \
+                staged_output(audio_file, config, expected_bytes=video_file.stat().st_size) as staged:
+            run_cmd = slot.apply_to_ffmpeg(cmd[:-1] + [staged])
+            # 输出按行流式读取，内存中只保留末尾（分析汇总在最后输出）；超时或中断时结束ffmpeg并删除未完成的文件
+            run_kwargs = {"outputs": [staged], "timeout": config.get("processTimeoutSeconds"),
+                          "log_path": log_path_for(config, f"extract-{video_file.stem}"),
+                          "tail_lines": STDERR_TAIL_LINES}
+            if peaks:
+                # 同时把解码的PCM从stdout交给峰值计算
+                from waveform_overview import peaks_output_args, run_ffmpeg_with_peaks
+                result = run_ffmpeg_with_peaks(run_cmd + peaks_output_args(), peaks, **run_kwargs)
+            else:
+                result = run_process(run_cmd, **run_kwargs)
+            result.check(run_cmd)
+            stderr_tail = result.tail
+        stamp_outputs([audio_file], cmd)
         print(f"音频提取成功: {audio_file.name}")
+        if peaks:
+            from waveform_overview import save_overview_for
+            print(f"波形概览: {Path(save_overview_for(audio_file, peaks)).name}")
+        if analyze:
+            analysis = parse_analysis_output(stderr_tail)
+            print_analysis(analysis)
+            write_analysis_sidecar(audio_file, analysis, video_file)
         return True
     except subprocess.CalledProcessError as e:
         print(f"提取音频时出错: {e}")
         if e.stderr:
             print(f"错误信息: {e.stderr}")
         return False
+    except ProcessTimeout as e:
+        print(f"提取音频时出错: {e}")
+        return False
+    finally:
+        if peaks:
+            # 未完成的峰值文件（finish() 之后没有影响）
+            peaks.discard()
 
 
 def find_downloaded_video(download_dir, video_url):
@@ -416,7 +626,7 @@ def find_downloaded_video(download_dir, video_url):
     return None
 
 
-def download_audio(video_url, config, download_dir, ffmpeg_path=None):
+def download_audio(video_url, config, download_dir, ffmpeg_path=None, temp_dir=None):
     """下载音频文件（最高质量无损格式）"""
     ytdlp_cmd = find_ytdlp()
     
@@ -465,7 +675,11 @@ def download_audio(video_url, config, download_dir, ffmpeg_path=None):
     # 设置输出目录和文件名格式
     # 格式: download/<视频名>/<视频名>.<扩展名>
     # yt-dlp会自动创建文件夹并清理文件名中的非法字符（保留中文等字符）
-    cmd.extend(["-o", os.path.join(download_dir, "%(title)s", "%(title)s.%(ext)s")])
+    # 配置了临时工作区时，中间文件写入临时目录，只有完成的文件才会移动到下载目录
+    cmd.extend(["-P", f"home:{download_dir}"])
+    if temp_dir:
+        cmd.extend(["-P", f"temp:{temp_dir}"])
+    cmd.extend(["-o", os.path.join("%(title)s", "%(title)s.%(ext)s")])
     
     # 添加视频URL
     cmd.append(video_url)
@@ -473,6 +687,331 @@ def download_audio(video_url, config, download_dir, ffmpeg_path=None):
     return cmd
 
 
+def locate_video_file(info, download_dir, video_url):
+    """查找下载完成的视频文件
+    
+    有视频信息时按 _filename 查找（合并后扩展名可能变为 .mp4），否则按修改时间查找最近下载的视频。
+    """
+    if info:
+        expected = Path(info["filename"])
+        for ext in [".mp4", expected.suffix, ".mkv", ".webm"]:
+            candidate = expected.with_suffix(ext)
+            if candidate.exists():
+                return candidate
+    return find_downloaded_video(download_dir, video_url)
+
+
+def stream_paths(info):
+    """分别下载的视频流和音频流的文件路径（与 build_ytdlp_command 的 stream_formats 输出模板一致）"""
+    video_file = Path(info["filename"])
+    return [str(video_file.parent / f"{video_file.stem}.f{stream['format_id']}.{stream['ext']}")
+            for stream in info["streams"]]
+
+
+def write_ffmetadata_chapters(chapters, path):
+    """把章节写成ffmpeg的元数据文件（合并时用 -map_chapters 写入视频）"""
+    def escape(text):
+        return re.sub(r"([=;#\\\n])", r"\\\1", text)
+    
+    lines = [";FFMETADATA1"]
+    for chapter in chapters:
+        # ffmpeg 要求每个章节都有 END，未知时长的最后一个章节写一个足够大的值（MP4只保存开始时间）
+        end = chapter["end"] if chapter["end"] is not None else 10 ** 7
+        lines += ["[CHAPTER]", "TIMEBASE=1/1000", f"START={round(chapter['start'] * 1000)}",
+                  f"END={round(end * 1000)}", f"title={escape(chapter['title'])}"]
+    Path(path).write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def build_merge_command(ffmpeg_exe, video_stream, audio_stream, output_file, cover=None, chapters_file=None):
+    """构建合并视频流和音频流的ffmpeg命令，封面和章节在同一次合并中写入
+    
+    视频流直接复制；音频与原来yt-dlp合并时的后处理参数相同，转换为 48kHz/24bit ALAC。
+    封面作为 attached_pic 写入（MP4中为 covr），不需要之后再重新封装整个文件。
+    """
+    cmd = [ffmpeg_exe, "-hide_banner", "-i", str(video_stream), "-i", str(audio_stream)]
+    if cover:
+        cmd.extend(["-i", str(cover)])
+    if chapters_file:
+        cmd.extend(["-i", str(chapters_file)])
+    cmd.extend(["-map", "0:v:0", "-map", "1:a:0", "-c:v:0", "copy",
+                "-c:a", "alac", "-ar", "48000", "-sample_fmt", "s32p"])
+    if cover:
+        cmd.extend(cover_art_args(2, stream_index=1))
+    if chapters_file:
+        cmd.extend(["-map_chapters", "3" if cover else "2"])
+    cmd.extend(["-y", str(output_file)])
+    return cmd
+
+
+def build_download_graph(video_url, config, download_dir, ffmpeg_path, scratch_area, state_path, info_path,
+                         proxy_pool=None):
+    """把一次下载表示为任务依赖图
+    
+    info -> streams -> video -> audio -> chapters（按章节分轨）
+                                    -> verify
+         -> cover（与视频下载并行，video 和 audio 等待它结束后在同一次编码中写入封面；
+                  coverSource 为 keyframes 时在 streams 之后从下载的视频中挑选封面）
+         -> thumbnail（未获取到视频信息时，在视频下载后转换随视频下载的封面）
+    
+    获取到视频信息且有ffmpeg时，streams 分别下载视频流和音频流，由 video 阶段自行合并；
+    否则 streams 由yt-dlp下载并合并，video 阶段只查找下载的文件。
+    
+    配置了代理池时，每个联网阶段从代理池占用一个代理，streams 下载失败时立即换用下一个代理。
+    配置了临时工作区且空间预算足够时，yt-dlp的中间文件（.part分片等）写在临时工作区中。
+    
+    Returns:
+        JobGraph: 下载任务图
+    """
+    governor = get_governor(config)
+    tuner = DownloadTuner.from_config(config)
+    retries = int(config.get("jobRetries", 2))
+    inline_dedup = config.get("dedupMode") == "inline"
+    keyframe_mode = config.get("coverSource", "thumbnail") == "keyframes"
+    graph = JobGraph("download", state_path)
+    scratch = {}
+    scratch_lock = threading.Lock()
+    
+    def ytdlp_temp_dir(expected_bytes=None):
+        """yt-dlp的中间文件目录（第一次调用时按预计大小检查空间预算，之后整个任务共用），不使用临时工作区时返回None"""
+        if scratch_area is None:
+            return None
+        with scratch_lock:
+            if "dir" not in scratch:
+                scratch["dir"] = None
+                if scratch_area.has_room(expected_bytes):
+                    job = scratch_area.create_job()
+                    atexit.register(job.cleanup)
+                    scratch["dir"] = str(job.path)
+                    print(f"临时工作区: {scratch['dir']}")
+                else:
+                    print("警告: 临时工作区空间不足，yt-dlp的中间文件直接写入下载目录")
+            return scratch["dir"]
+    
+    def fetch_info(inputs):
+        print("正在获取视频信息...")
+        with leased_config(proxy_pool, config) as proxy_config:
+            info = fetch_video_info(video_url, proxy_config, download_dir, info_path)
+        if not info:
+            return None
+        print(f"视频标题: {info.get('title')}")
+        requested = info.get("requested_formats") or []
+        streams = [{"format_id": f["format_id"], "ext": f["ext"]} for f in requested]
+        # 预计下载大小（yt-dlp给出的文件大小或估计值，未知时为None）
+        sizes = [f.get("filesize") or f.get("filesize_approx") or 0 for f in requested or [info]]
+        return {"filename": info["_filename"], "title": info.get("title"), "uploader": info.get("uploader"),
+                "info_path": str(info_path), "streams": streams if len(streams) == 2 else None,
+                "filesize": sum(sizes) or None}
+    
+    def download(inputs):
+        info = inputs["info"]
+        separate = bool(info and info["streams"] and ffmpeg_path)
+        print(f"正在下载视频{'' if info else '和封面图片'}: {video_url}")
+        settings = tuner.current()
+        expected = info.get("filesize") if info else None
+        if expected and not separate:
+            # yt-dlp 在临时目录中合并，分片和合并后的文件同时存在
+            expected *= 2
+        temp_dir = ytdlp_temp_dir(expected)
+        
+        def fetch(proxy_config):
+            cmd = build_ytdlp_command(video_url, proxy_config, download_dir, ffmpeg_path, download_video=True,
+                                      temp_dir=temp_dir, info_json=info["info_path"] if info else None,
+                                      write_thumbnail=info is None,
+                                      stream_formats=[s["format_id"] for s in info["streams"]] if separate else None,
+                                      tuning_args=tuner.ytdlp_args(settings))
+            print(f"执行命令: {' '.join(cmd)}")
+            start = time.monotonic()
+            try:
+                # 进度原样输出到终端，内存中只保留最后若干行
+                run_process(slot.wrap_command(cmd), echo=True,
+                            log_path=log_path_for(config, "download")).check(cmd)
+            except subprocess.CalledProcessError:
+                tuner.record_failure(settings)
+                raise
+            return proxy_config.get("proxy"), time.monotonic() - start
+        
+        # 同时下载数由 download_tuner 根据实测吞吐量调整（不超过 maxNetworkJobs）
+        with governor.acquire("network", limit=settings["parallel"]) as slot:
+            # 带宽上限按实际同时进行的下载数（包括本任务）平分
+            settings = tuner.current(active=governor.busy_count("network"))
+            if proxy_pool:
+                # 换用其他代理时，yt-dlp 从已下载的分片继续
+                proxy, elapsed = proxy_pool.run_with_failover(lambda p: fetch(dict(config, proxy=p)))
+            else:
+                proxy, elapsed = fetch(config)
+        print("视频下载完成！")
+        if separate:
+            paths = stream_paths(info)
+            result = {"streams": paths}
+        else:
+            video_path = locate_video_file(info, download_dir, video_url)
+            paths = [str(video_path)] if video_path else []
+            result = {"video": paths[0] if paths else None}
+        downloaded_bytes = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+        if proxy_pool:
+            proxy_pool.report(proxy, downloaded_bytes, elapsed)
+        action = tuner.record(settings, downloaded_bytes, elapsed)
+        if action:
+            print(f"下载速度: {format_rate(downloaded_bytes / elapsed)}（分片并发 {settings['fragments']}，"
+                  f"同时下载 {settings['active']}/{settings['parallel']}，调整: {action}）")
+        return result
+    
+    def merge(inputs):
+        downloaded = inputs["streams"]
+        if "streams" in downloaded:
+            info = inputs["info"]
+            video_stream, audio_stream = downloaded["streams"]
+            for path in (video_stream, audio_stream):
+                if not os.path.exists(path):
+                    raise RuntimeError(f"未找到下载的视频流/音频流: {path}")
+            video_path = Path(info["filename"]).with_suffix(".mp4")
+            with open(info["info_path"], "r", encoding="utf-8") as f:
+                chapter_list = chapters_from_info(json.load(f))
+            chapters_file = None
+            if chapter_list:
+                chapters_file = Path(info["info_path"]).with_suffix(".ffmetadata")
+                write_ffmetadata_chapters(chapter_list, chapters_file)
+            cover_file = inputs["cover"]
+            ffmpeg_exe = get_tool_exe(ffmpeg_path, "ffmpeg")
+            cmd = build_merge_command(ffmpeg_exe, video_stream, audio_stream, video_path, cover_file, chapters_file)
+            print(f"正在合并视频{'并写入封面' if cover_file else ''}: {video_path.name}")
+            expected = os.path.getsize(video_stream) + os.path.getsize(audio_stream)
+            # 合并以复制视频流为主，占用磁盘资源槽位
+            with governor.acquire("disk") as slot, staged_output(video_path, config, expected_bytes=expected) as staged:
+                run_cmd = slot.apply_to_ffmpeg(cmd[:-1] + [staged])
+                result = run_process(run_cmd, outputs=[staged], timeout=config.get("processTimeoutSeconds"),
+                                     log_path=log_path_for(config, f"merge-{video_path.stem}"))
+                if result.returncode != 0:
+                    raise RuntimeError(f"合并失败（返回码 {result.returncode}）: {'；'.join(result.tail[-3:])}")
+            for path in (video_stream, audio_stream, chapters_file):
+                if path and os.path.exists(path):
+                    os.remove(path)
+            print(f"视频合并完成: {video_path.name}")
+        else:
+            video_path = Path(downloaded["video"]) if downloaded["video"] else None
+        # 内联去重：同一视频以不同标题重复下载时，链接到库中已有的相同文件
+        if video_path and inline_dedup:
+            dedup_file(video_path, download_dir, config)
+        return str(video_path) if video_path else None
+    
+    def cover(inputs):
+        info = inputs["info"]
+        if not info:
+            return None
+        if keyframe_mode:
+            downloaded = inputs["streams"]
+            video_file = downloaded["streams"][0] if "streams" in downloaded else downloaded["video"]
+            if video_file:
+                result = keyframe_cover(video_file, Path(info["filename"]).with_suffix(".jpg"), ffmpeg_path, config)
+                if result:
+                    return str(result)
+            print("从关键帧挑选封面失败，改为下载视频封面")
+        with leased_config(proxy_pool, config) as proxy_config:
+            return CoverJob(info["filename"], info["info_path"], proxy_config, download_dir, ffmpeg_path).run()
+    
+    def thumbnail(inputs):
+        if inputs["info"]:
+            return None
+        # 自动转换封面图片为4:3比例
+        print("\n正在转换封面图片为4:3比例...")
+        converted_count = convert_thumbnails_to_4_3(download_dir, video_url)
+        if converted_count > 0:
+            print(f"封面转换完成！成功转换 {converted_count} 个封面图片")
+        else:
+            print("未找到需要转换的封面图片")
+        return converted_count
+    
+    def audio(inputs):
+        audio_format = config.get("audioFormat", "flac").upper()
+        video_path = Path(inputs["video"]) if inputs["video"] else None
+        
+        # 优化：如果已下载了视频文件，尝试从视频中提取音频，避免重复下载
+        if video_path and ffmpeg_path:
+            print(f"\n检测到已下载的视频文件，尝试从视频中提取音频（格式: {audio_format}）...")
+            if extract_audio_from_video(video_path, config, ffmpeg_path, cover=inputs.get("cover")):
+                print(f"音频提取完成！（格式: {audio_format}）")
+                audio_path = video_path.parent / f"{video_path.stem}.{audio_format.lower()}"
+                if inline_dedup:
+                    dedup_file(audio_path, download_dir, config)
+                return str(audio_path)
+            print("从视频提取音频失败，将重新下载音频...")
+        else:
+            print(f"正在下载最高质量无损音频文件（格式: {audio_format}）...")
+        
+        if not ffmpeg_path:
+            print("警告: 未找到ffmpeg，无法转换为无损格式，将下载原始音频")
+        
+        def fetch_audio(proxy_config):
+            audio_cmd = download_audio(video_url, proxy_config, download_dir, ffmpeg_path, ytdlp_temp_dir())
+            print(f"执行命令: {' '.join(audio_cmd)}")
+            start = time.monotonic()
+            run_process(slot.wrap_command(audio_cmd), echo=True,
+                        log_path=log_path_for(config, "download-audio")).check(audio_cmd)
+            return proxy_config.get("proxy"), time.monotonic() - start
+        
+        # 与视频下载相同：配置了代理池时占用一个代理，失败时换用下一个代理
+        with governor.acquire("network") as slot:
+            if proxy_pool:
+                proxy, elapsed = proxy_pool.run_with_failover(lambda p: fetch_audio(dict(config, proxy=p)))
+            else:
+                proxy, elapsed = fetch_audio(config)
+        print(f"无损音频下载完成！（格式: {audio_format}）")
+        if proxy_pool:
+            # yt-dlp 的音频输出与视频在同一目录、同一文件名
+            audio_path = video_path.with_suffix(f".{audio_format.lower()}") if video_path else None
+            downloaded_bytes = audio_path.stat().st_size if audio_path and audio_path.exists() else 0
+            proxy_pool.report(proxy, downloaded_bytes, elapsed)
+        return None
+    
+    def chapters(inputs):
+        info = inputs["info"]
+        if not info or not inputs["audio"]:
+            return []
+        with open(info["info_path"], "r", encoding="utf-8") as f:
+            chapter_list = chapters_from_info(json.load(f))
+        if not chapter_list:
+            print("视频没有章节，不分轨")
+            return []
+        # 从已提取的音频分轨，不需要再读取视频文件
+        return split_chapters(inputs["audio"], chapter_list, ffmpeg_path, album=info["title"],
+                              artist=info["uploader"], config=config)
+    
+    def verify(inputs):
+        paths = [p for p in inputs.values() if p]
+        ffmpeg_exe = get_tool_exe(ffmpeg_path, "ffmpeg")
+        for path in paths:
+            result = verify_file(path, ffmpeg_exe)
+            if result["status"] == "skipped":
+                print(f"跳过校验（不支持的格式）: {Path(path).name}")
+                continue
+            if result["status"] != "ok":
+                raise RuntimeError(f"{Path(path).name}: {result.get('message', result['status'])}")
+            print(f"校验通过: {Path(path).name}")
+        return len(paths)
+    
+    def single_output(path):
+        return [path] if path else []
+    
+    graph.add("info", fetch_info, outputs=lambda info: [info["info_path"]] if info else [])
+    # 分别下载的流在合并后删除，不作为输出检查（合并完成后恢复时不需要它们）
+    graph.add("streams", download, deps=["info"], retries=retries)
+    graph.add("cover", cover, deps=["info", "streams"] if keyframe_mode else ["info"], outputs=single_output,
+              retries=1, required=False)
+    graph.add("video", merge, deps=["info", "streams"], after=["cover"], outputs=single_output)
+    graph.add("thumbnail", thumbnail, deps=["info", "video"], required=False)
+    verify_deps = ["video"]
+    if config.get("sperateAudio", False):
+        # 音频下载失败不影响主流程，只警告
+        graph.add("audio", audio, deps=["video"], after=["cover"], outputs=single_output, retries=retries,
+                  required=False)
+        verify_deps.append("audio")
+        if config.get("splitChapters", False):
+            graph.add("chapters", chapters, deps=["info", "audio"], outputs=lambda tracks: tracks, required=False)
+    if config.get("verifyAfterDownload", False):
+        graph.add("verify", verify, deps=verify_deps, required=False)
+    return graph
+
+
 def main():
     """主函数"""
     if len(sys.argv) < 2:
@@ -498,66 +1037,34 @@ def main():
     download_dir = ensure_download_dir(config)
     print(f"下载目录: {download_dir}")
     
-    # 构建并执行下载命令
-    print(f"正在下载视频和封面图片: {video_url}")
-    cmd = build_ytdlp_command(video_url, config, download_dir, ffmpeg_path, download_video=True)
-    
-    print(f"执行命令: {' '.join(cmd)}")
-    downloaded_video_path = None
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=False)
-        print("视频和封面图片下载完成！")
-        
-        # 查找刚下载的视频文件
-        downloaded_video_path = find_downloaded_video(download_dir, video_url)
-        
-        # 自动转换封面图片为4:3比例
-        print("\n正在转换封面图片为4:3比例...")
-        converted_count = convert_thumbnails_to_4_3(download_dir, video_url)
-        if converted_count > 0:
-            print(f"封面转换完成！成功转换 {converted_count} 个封面图片")
-        else:
-            print("未找到需要转换的封面图片")
-    except subprocess.CalledProcessError as e:
-        print(f"下载视频时出错: {e}")
+    # 任务状态按URL保存，中断后重新运行同一URL时跳过已完成的阶段
+    job_id = hashlib.sha1(video_url.encode("utf-8")).hexdigest()[:16]
+    jobs_dir = get_state_dir(download_dir) / "jobs"
+    state_path = jobs_dir / f"{job_id}.json"
+    info_path = jobs_dir / f"{job_id}.info.json"
+    if state_path.exists():
+        print(f"发现未完成的下载任务，将从中断处继续: {state_path}")
+    
+    proxy_pool = ProxyPool.from_config(config)
+    # 临时工作区（可选）：yt-dlp的中间文件写在这里，退出时清理
+    graph = build_download_graph(video_url, config, download_dir, ffmpeg_path, get_scratch_area(config), state_path,
+                                 info_path, proxy_pool)
+    ok = graph.run()
+    if proxy_pool and proxy_pool.job_stats:
+        print("\n代理使用情况:")
+        for line in proxy_pool.summary_lines():
+            print(f"  {line}")
+    if not ok:
+        print(f"下载任务未完成: {', '.join(f'{name}({error})' for name, error in graph.errors.items())}")
+        print("重新运行相同的命令即可从中断处继续")
         sys.exit(1)
     
-    # 如果需要分离音频
-    if config.get("sperateAudio", False):
-        audio_format = config.get("audioFormat", "flac").upper()
-        
-        # 优化：如果已下载了视频文件，尝试从视频中提取音频，避免重复下载
-        if downloaded_video_path and ffmpeg_path:
-            print(f"\n检测到已下载的视频文件，尝试从视频中提取音频（格式: {audio_format}）...")
-            success = extract_audio_from_video(downloaded_video_path, config, ffmpeg_path)
-            if success:
-                print(f"音频提取完成！（格式: {audio_format}）")
-            else:
-                print("从视频提取音频失败，将重新下载音频...")
-                # 如果提取失败，回退到下载方式
-                if not ffmpeg_path:
-                    print("警告: 未找到ffmpeg，无法转换为无损格式，将下载原始音频")
-                audio_cmd = download_audio(video_url, config, download_dir, ffmpeg_path)
-                print(f"执行命令: {' '.join(audio_cmd)}")
-                try:
-                    result = subprocess.run(audio_cmd, check=True, capture_output=False)
-                    print(f"无损音频下载完成！（格式: {audio_format}）")
-                except subprocess.CalledProcessError as e:
-                    print(f"下载音频时出错: {e}")
-                    # 音频下载失败不影响主流程，只警告
-        else:
-            # 如果没有找到视频文件或没有ffmpeg，使用原来的下载方式
-            print(f"正在下载最高质量无损音频文件（格式: {audio_format}）...")
-            if not ffmpeg_path:
-                print("警告: 未找到ffmpeg，无法转换为无损格式，将下载原始音频")
-            audio_cmd = download_audio(video_url, config, download_dir, ffmpeg_path)
-            print(f"执行命令: {' '.join(audio_cmd)}")
-            try:
-                result = subprocess.run(audio_cmd, check=True, capture_output=False)
-                print(f"无损音频下载完成！（格式: {audio_format}）")
-            except subprocess.CalledProcessError as e:
-                print(f"下载音频时出错: {e}")
-                # 音频下载失败不影响主流程，只警告
+    for name, error in graph.errors.items():
+        print(f"警告: 阶段 {name} 失败: {error}")
+    # 任务全部完成后不再需要状态文件
+    for path in (state_path, info_path):
+        if path.exists():
+            path.unlink()
 
 
 if __name__ == "__main__":
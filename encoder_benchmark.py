@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+编码器自动选择
+convert_video 的 auto 格式：从源视频中间截取一小段样本，用本机可用的每种编码器和预设实际编码一次并计时，
+用SSIM与样本比较画质，选择达到画质下限的最快的一种。GPU编码器不一定比CPU编码器快
+（例如核心很多的CPU上的x264，或者只有入门级核显的机器），默认的 h264_gpu 也不一定满足画质要求。
+
+结果按机器和源视频分辨率缓存（资源调度器锁目录中的 encoder_benchmark.json），
+同一台机器上相同分辨率的视频只测试一次；ffmpeg版本、画质下限或候选编码器变化后重新测试。
+
+配置字段:
+    autoQualityFloor: 画质下限（SSIM，默认0.97）
+    autoSampleSeconds: 样本时长（秒，默认5）
+"""
+
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from async_runner import run_process
+from convert_video import (
+    EDITING_AUDIO_CODEC, FORMAT_TYPES, GPU_FORMATS, detect_gpu_encoders, encoder_resource_class, find_ffmpeg_path,
+    preset_encoder_args, probe_duration, probe_video_size,
+)
+from output_stamps import tool_version
+from resource_governor import get_governor
+from tool_utils import get_tool_exe, load_optional_config
+
+
+CACHE_FILE = "encoder_benchmark.json"
+DEFAULT_QUALITY_FLOOR = 0.97
+DEFAULT_SAMPLE_SECONDS = 5
+
+# 格式类型之外的CPU编码候选：比 ultrafast 稍慢但画质更好的x264/x265预设
+EXTRA_CANDIDATES = {
+    "h264_superfast": ["-c:v", "libx264", "-preset", "superfast", "-crf", "23", "-c:a", EDITING_AUDIO_CODEC],
+    "h264_veryfast": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-c:a", EDITING_AUDIO_CODEC],
+    "h265_ultrafast": ["-c:v", "libx265", "-preset", "ultrafast", "-crf", "24", "-c:a", EDITING_AUDIO_CODEC],
+}
+
+
+def candidate_encoders(gpu_encoders):
+    """本机可测试的编码候选
+
+    没有可用GPU编码器时跳过 h264_gpu/h265_gpu（它们会回退为与CPU候选相同的编码参数）。
+
+    Returns:
+        dict: {候选名称: 编码参数}，编码参数相同的候选只保留一个
+    """
+    candidates = {}
+    for format_type in FORMAT_TYPES:
+        if format_type == "auto" or (format_type in GPU_FORMATS and not any(gpu_encoders.values())):
+            continue
+        candidates[format_type] = preset_encoder_args(format_type, gpu_encoders)
+    candidates.update(EXTRA_CANDIDATES)
+    unique = {}
+    for name, args in candidates.items():
+        if args not in unique.values():
+            unique[name] = args
+    return unique
+
+
+def _frame_count(lines):
+    for line in reversed(lines):
+        match = re.search(r"frame=\s*(\d+)", line)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def _ssim(ffmpeg_exe, encoded, reference):
+    """编码结果与样本的SSIM（All），失败时返回None"""
+    cmd = [ffmpeg_exe, "-hide_banner", "-nostats", "-i", str(encoded), "-i", str(reference),
+           "-lavfi", "[0:v][1:v]ssim", "-f", "null", "-"]
+    result = run_process(cmd)
+    if result.returncode != 0:
+        return None
+    for line in reversed(result.tail):
+        match = re.search(r"SSIM .*All:([\d.]+)", line)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class EncoderBenchmark:
+    """测试并缓存每台机器、每种分辨率的最佳编码参数
+
+    Args:
+        cache_path: 缓存文件路径
+        quality_floor: 画质下限（SSIM）
+        sample_seconds: 样本时长（秒）
+        config: 配置字典（资源调度使用）
+    """
+
+    def __init__(self, cache_path, quality_floor=DEFAULT_QUALITY_FLOOR, sample_seconds=DEFAULT_SAMPLE_SECONDS,
+                 config=None):
+        self.cache_path = Path(cache_path)
+        self.quality_floor = float(quality_floor)
+        self.sample_seconds = float(sample_seconds)
+        self.config = config
+
+    @classmethod
+    def from_config(cls, config=None):
+        """根据配置创建（缓存文件位于资源调度器的锁目录，与 download_tuner 相同）"""
+        if config is None:
+            config = load_optional_config()
+        return cls(
+            get_governor(config).lock_dir / CACHE_FILE,
+            quality_floor=config.get("autoQualityFloor", DEFAULT_QUALITY_FLOOR),
+            sample_seconds=config.get("autoSampleSeconds", DEFAULT_SAMPLE_SECONDS),
+            config=config,
+        )
+
+    def _load(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self, cache):
+        # 多个进程同时测试时后写入的生效
+        tmp = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.cache_path)
+
+    @staticmethod
+    def cache_key(size):
+        return f"{platform.node()} {size[0]}x{size[1]}"
+
+    def cached(self, size, ffmpeg_exe, candidates):
+        """缓存中仍然有效的结果（ffmpeg版本、画质下限和候选编码器都未变化），没有时返回None"""
+        entry = self._load().get(self.cache_key(size))
+        if not entry:
+            return None
+        if (entry.get("ffmpeg") != tool_version(ffmpeg_exe) or entry.get("floor") != self.quality_floor
+                or entry.get("candidates") != sorted(candidates)):
+            return None
+        return entry
+
+    def _cut_sample(self, ffmpeg_exe, ffprobe_exe, video_file, work_dir):
+        """从视频中间复制一段视频流作为样本（不重新编码）"""
+        duration = probe_duration(ffprobe_exe, video_file)
+        start = max(0.0, (duration or 0) / 2 - self.sample_seconds / 2)
+        sample = Path(work_dir) / "sample.mkv"
+        cmd = [ffmpeg_exe, "-hide_banner", "-v", "error", "-ss", f"{start:.3f}", "-i", str(video_file),
+               "-t", str(self.sample_seconds), "-map", "0:v:0", "-c:v", "copy", "-an", "-y", str(sample)]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0 or not sample.exists():
+            raise RuntimeError(f"截取样本失败: {result.stderr.strip()[-300:]}")
+        return sample
+
+    def _measure(self, ffmpeg_exe, sample, name, args, work_dir):
+        """用一种候选编码样本，返回 {"name", "args", "fps", "seconds", "ssim"} 或带 "error" 的结果"""
+        output = Path(work_dir) / f"{name}.mov"
+        # 不加 -nostats：帧数从最后的进度行中读取
+        cmd = [ffmpeg_exe, "-hide_banner", "-i", str(sample), *args, "-an"]
+        with get_governor(self.config).acquire(encoder_resource_class(cmd)) as slot:
+            run_cmd = slot.apply_to_ffmpeg(cmd + ["-y", str(output)])
+            start = time.monotonic()
+            process = run_process(run_cmd)
+            elapsed = time.monotonic() - start
+        result = {"name": name, "args": args}
+        if process.returncode != 0:
+            result["error"] = process.tail[-1].strip() if process.tail else f"返回码 {process.returncode}"
+            return result
+        frames = _frame_count(process.tail) or 0
+        result.update(fps=frames / elapsed if elapsed > 0 else 0.0, seconds=elapsed,
+                      ssim=_ssim(ffmpeg_exe, output, sample))
+        output.unlink()
+        return result
+
+    def run(self, ffmpeg_exe, ffprobe_exe, video_file, candidates):
+        """在样本上测试所有候选，返回按速度排序的结果列表"""
+        work_dir = tempfile.mkdtemp(prefix="imaudiotools-encbench-")
+        try:
+            sample = self._cut_sample(ffmpeg_exe, ffprobe_exe, video_file, work_dir)
+            results = []
+            for name, args in candidates.items():
+                print(f"  测试 {name}...")
+                results.append(self._measure(ffmpeg_exe, sample, name, args, work_dir))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return sorted(results, key=lambda r: -r.get("fps", -1))
+
+    def choose(self, results):
+        """达到画质下限的最快候选；都达不到时选画质最高的"""
+        measured = [r for r in results if "error" not in r and r.get("ssim") is not None]
+        if not measured:
+            return None
+        passing = [r for r in measured if r["ssim"] >= self.quality_floor]
+        if passing:
+            return max(passing, key=lambda r: r["fps"])
+        best = max(measured, key=lambda r: r["ssim"])
+        print(f"警告: 没有候选达到画质下限 SSIM {self.quality_floor}，选择画质最高的 {best['name']}")
+        return best
+
+    def select(self, video_file, ffmpeg_path=None, gpu_encoders=None, force=False):
+        """为视频选择编码参数（优先使用缓存）
+
+        Returns:
+            tuple: (缓存条目 {"choice": 候选名称, "args": 编码参数, "results": 测试结果, ...}, 是否来自缓存)
+
+        Raises:
+            RuntimeError: 无法读取视频或所有候选都失败
+        """
+        ffmpeg_exe = get_tool_exe(ffmpeg_path)
+        ffprobe_exe = get_tool_exe(ffmpeg_path, "ffprobe")
+        if not ffmpeg_exe or not ffprobe_exe:
+            raise RuntimeError("未找到ffmpeg/ffprobe，无法测试编码器")
+        size = probe_video_size(ffprobe_exe, video_file)
+        if not size:
+            raise RuntimeError(f"无法读取视频尺寸: {video_file}")
+        candidates = candidate_encoders(gpu_encoders or {})
+        entry = None if force else self.cached(size, ffmpeg_exe, candidates)
+        if entry:
+            print(f"自动选择编码器（{size[0]}x{size[1]}，缓存）: {entry['choice']}")
+            return entry, True
+
+        print(f"正在测试 {len(candidates)} 种编码参数（{size[0]}x{size[1]}，样本 {self.sample_seconds:g} 秒）...")
+        results = self.run(ffmpeg_exe, ffprobe_exe, video_file, candidates)
+        best = self.choose(results)
+        if not best:
+            raise RuntimeError("所有候选编码参数都失败: " + "；".join(f"{r['name']}: {r['error']}" for r in results))
+        entry = {
+            "choice": best["name"],
+            "args": best["args"],
+            "floor": self.quality_floor,
+            "ffmpeg": tool_version(ffmpeg_exe),
+            "candidates": sorted(candidates),
+            "measured_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }
+        cache = self._load()
+        cache[self.cache_key(size)] = entry
+        self._save(cache)
+        print_results(entry)
+        return entry, False
+
+    def clear(self):
+        """清除缓存的测试结果"""
+        if self.cache_path.exists():
+            self.cache_path.unlink()
+
+
+def print_results(entry):
+    """输出测试结果表"""
+    for r in entry["results"]:
+        if "error" in r:
+            print(f"  {r['name']:<16} 失败: {r['error']}")
+            continue
+        ssim = f"{r['ssim']:.4f}" if r["ssim"] is not None else "-"
+        marker = " <-" if r["name"] == entry["choice"] else ""
+        print(f"  {r['name']:<16} {r['fps']:>7.1f} 帧/秒  SSIM {ssim}{marker}")
+    print(f"选择: {entry['choice']}（画质下限 SSIM {entry['floor']}）")
+
+
+def main():
+    """主函数：测试视频分辨率下的编码器，或显示/清除缓存"""
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help"):
+        print("使用方法: python encoder_benchmark.py <视频文件路径> [--force]")
+        print("          python encoder_benchmark.py --list | --clear")
+        print("在视频样本上测试本机的编码器和预设，选择达到画质下限（autoQualityFloor）的最快的一种，")
+        print("结果按机器和分辨率缓存，convert_video 的 auto 格式使用同样的结果；--force 重新测试")
+        sys.exit(0 if args else 1)
+
+    config = load_optional_config()
+    benchmark = EncoderBenchmark.from_config(config)
+    if args[0] == "--clear":
+        benchmark.clear()
+        print("已清除编码器测试缓存")
+        return
+    if args[0] == "--list":
+        for key, entry in benchmark._load().items():
+            print(f"{key}  {entry['choice']}  （{entry['measured_at']}）")
+        return
+
+    ffmpeg_path = find_ffmpeg_path()
+    force = "--force" in args
+    try:
+        entry, from_cache = benchmark.select(args[0], ffmpeg_path, gpu_encoders=detect_gpu_encoders(ffmpeg_path),
+                                             force=force)
+    except RuntimeError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+    # 重新测试时 select 已经输出过测试结果
+    if from_cache and "results" in entry:
+        print_results(entry)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,15 @@ import platform
 import shutil
 from pathlib import Path
 
+from async_runner import run_process
+from audio_analysis import (STDERR_TAIL_LINES, build_analysis_filter, parse_analysis_output, print_analysis,
+                            write_analysis_sidecar)
+from chapter_split import probe_chapters, split_chapters
+from output_stamps import is_up_to_date, stamp_outputs
+from resource_governor import get_governor
+from scratch_staging import input_size, staged_output
+from tool_utils import cover_art_args, find_cover_4_3, get_tool_exe
+
 
 def find_ffmpeg_path():
     """查找ffmpeg路径"""
@@ -57,13 +66,15 @@ def ensure_download_dir():
     return str(download_dir.absolute())
 
 
-def extract_audio_from_video(video_path, ffmpeg_path=None, compression_level=12):
+def extract_audio_from_video(video_path, ffmpeg_path=None, compression_level=12, analyze=False, cover=None):
     """从视频文件中提取音频为FLAC格式
     
     Args:
         video_path: 视频文件路径
         ffmpeg_path: ffmpeg路径（可选）
         compression_level: FLAC压缩级别（0-12，默认12，12是最高压缩/最小文件）
+        analyze: 是否在同一次解码中进行响度/峰值分析
+        cover: 4:3封面图片（可选，写入FLAC的PICTURE块；None时查找视频旁的 _4_3.jpg）
     """
     video_file = Path(video_path)
     
@@ -118,10 +129,25 @@ def extract_audio_from_video(video_path, ffmpeg_path=None, compression_level=12)
     # -c:a flac: 使用flac编码器
     # -compression_level: FLAC压缩级别（0-12，12是最高压缩/最小文件，但处理时间最长）
     # -y: 如果输出文件已存在则覆盖
+    if cover is None:
+        cover = find_cover_4_3(video_file)
     cmd = [
         str(ffmpeg_exe.absolute()),
         "-i", str(video_abs_path),
-        "-vn",  # 不包含视频
+    ]
+    if cover:
+        cmd.extend(["-i", str(Path(cover).resolve())])
+    if analyze:
+        # 同一次解码中分出一路音频做响度/峰值分析（只映射音频输出，不包含视频）
+        cmd.extend(build_analysis_filter())
+    elif cover:
+        cmd.extend(["-map", "0:a:0"])  # 只取音频，视频流由封面代替
+    else:
+        cmd.append("-vn")  # 不包含视频
+    if cover:
+        # 封面与音频在同一次编码中写入，不需要之后再重新封装
+        cmd.extend(cover_art_args(1))
+    cmd += [
         "-c:a", "flac",  # 音频编码器为flac
         "-compression_level", str(compression_level),  # FLAC压缩级别（0-12）
         "-y",  # 覆盖已存在的输出文件
@@ -131,10 +157,32 @@ def extract_audio_from_video(video_path, ffmpeg_path=None, compression_level=12)
     return cmd, str(output_file.absolute())
 
 
+def split_by_chapters(video_path, audio_file, ffmpeg_path, force=False):
+    """按视频中嵌入的章节把提取的音频分轨（从FLAC读取，比重新读取视频快）"""
+    ffprobe_exe = get_tool_exe(ffmpeg_path, "ffprobe")
+    chapters = probe_chapters(ffprobe_exe, video_path) if ffprobe_exe else []
+    if not chapters:
+        print("视频中没有章节信息，不分轨")
+        return
+    try:
+        split_chapters(audio_file, chapters, ffmpeg_path, album=Path(video_path).stem, force=force)
+    except RuntimeError as e:
+        print(f"分轨时出错: {e}")
+        sys.exit(1)
+
+
 def main():
     """主函数"""
-    if len(sys.argv) < 2:
-        print("使用方法: python extract_audio.py <视频文件路径> [压缩级别]")
+    # --analyze: 在同一次解码中进行响度/峰值分析，结果保存为 .analysis.json
+    analyze = "--analyze" in sys.argv
+    # --force: 忽略处理记录，输出文件已是最新时也重新处理
+    force = "--force" in sys.argv
+    # --chapters: 提取后按视频中的章节分轨
+    split = "--chapters" in sys.argv
+    argv = [a for a in sys.argv if a not in ("--analyze", "--force", "--chapters")]
+    
+    if len(argv) < 2:
+        print("使用方法: python extract_audio.py <视频文件路径> [压缩级别] [--analyze] [--chapters] [--force]")
         print("示例: python extract_audio.py video.mp4")
         print("示例: python extract_audio.py download/video/video.mp4")
         print("示例: python extract_audio.py video.mp4 12")
@@ -142,20 +190,23 @@ def main():
         print("  0-12: FLAC压缩级别（默认12）")
         print("  0: 最快，文件最大")
         print("  12: 最慢，文件最小（推荐）")
+        print("\n  --analyze: 同时分析EBU R128响度、真峰值和削波，结果保存为 <文件名>.analysis.json")
+        print("  --chapters: 提取后按视频中的章节输出每个章节的FLAC音轨（保存在 tracks/ 目录）")
+        print("  --force: 输出文件已是最新（输入、参数和ffmpeg版本都没有变化）时也重新处理")
         sys.exit(1)
     
-    video_path = sys.argv[1]
+    video_path = argv[1]
     
     # 解析压缩级别参数（可选）
     compression_level = 12  # 默认最高压缩级别
-    if len(sys.argv) >= 3:
+    if len(argv) >= 3:
         try:
-            compression_level = int(sys.argv[2])
+            compression_level = int(argv[2])
             if compression_level < 0 or compression_level > 12:
                 print(f"警告: 压缩级别必须在0-12之间，使用默认值12")
                 compression_level = 12
         except ValueError:
-            print(f"警告: 无效的压缩级别 '{sys.argv[2]}'，使用默认值12")
+            print(f"警告: 无效的压缩级别 '{argv[2]}'，使用默认值12")
             compression_level = 12
     
     # 查找ffmpeg路径
@@ -170,17 +221,37 @@ def main():
     # 提取音频
     print(f"正在从视频文件提取音频: {video_path}")
     print(f"压缩级别: {compression_level} (0=最快/最大文件, 12=最慢/最小文件)")
-    cmd, output_file = extract_audio_from_video(video_path, ffmpeg_path, compression_level)
+    cmd, output_file = extract_audio_from_video(video_path, ffmpeg_path, compression_level, analyze=analyze)
     
     print(f"输出文件: {output_file}")
-    print(f"执行命令: {' '.join(cmd)}")
+    
+    if not force and is_up_to_date([output_file], cmd):
+        print("输出文件已由相同的输入、参数和ffmpeg版本生成，跳过（--force 强制重新提取）")
+        if split:
+            split_by_chapters(video_path, output_file, ffmpeg_path, force)
+        return
     
     try:
-        result = subprocess.run(cmd, check=True, capture_output=False)
+        with get_governor().acquire("disk") as slot, staged_output(output_file, expected_bytes=input_size(cmd)) as staged:
+            # 先写入临时文件，完成后原子发布到输出路径
+            run_cmd = slot.apply_to_ffmpeg(cmd[:-1] + [staged])
+            print(f"执行命令: {' '.join(run_cmd)}")
+            if analyze:
+                stderr_tail = run_process(run_cmd, echo=True, tail_lines=STDERR_TAIL_LINES).check(run_cmd).tail
+            else:
+                result = subprocess.run(run_cmd, check=True, capture_output=False)
+        stamp_outputs([output_file], cmd)
         print(f"音频提取完成！输出文件: {output_file}")
+        if analyze:
+            analysis = parse_analysis_output(stderr_tail)
+            print_analysis(analysis)
+            print(f"分析结果: {write_analysis_sidecar(output_file, analysis, video_path)}")
     except subprocess.CalledProcessError as e:
         print(f"提取音频时出错: {e}")
         sys.exit(1)
+    
+    if split:
+        split_by_chapters(video_path, output_file, ffmpeg_path, force)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+命令行路径参数解析
+用户输入的路径可能带引号、大小写或空格/下划线不一致，或者只给出了所在目录。
+FileResolver 对每个目录只用 os.scandir 列出一次，建立规范化文件名索引，
+再用相似度评分对候选文件确定性地排序。批量处理多个输入时复用同一个实例，
+同一目录不会被重复扫描。
+"""
+
+import difflib
+import os
+import re
+import stat
+import unicodedata
+from pathlib import Path
+
+
+# 低于该相似度的候选文件不会被自动选用
+MIN_SIMILARITY = 0.6
+
+_SEPARATORS = re.compile(r"[\s_\-.·・]+")
+
+
+def normalize_name(name):
+    """规范化文件名：统一全角/半角和大小写，去掉空格、下划线、连字符等分隔符"""
+    name = unicodedata.normalize("NFKC", name).casefold()
+    return _SEPARATORS.sub("", name)
+
+
+def similarity(a, b):
+    """两个规范化文件名的相似度（0~1）"""
+    if not a or not b:
+        return 0.0
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+class FileResolver:
+    """带目录缓存的文件查找器
+
+    Args:
+        extensions: 允许的扩展名（如 {".mp4"}），不区分大小写
+        label: 输出提示信息时使用的文件类型名称
+    """
+
+    def __init__(self, extensions, label="文件"):
+        self.extensions = {e.lower() for e in extensions}
+        self.label = label
+        self._listings = {}
+
+    def _listing(self, directory):
+        """列出目录中符合扩展名的文件（每个目录只扫描一次）
+
+        Returns:
+            dict: {规范化文件名(不含扩展名): [Path, ...]}，列表按文件名排序
+        """
+        key = os.path.normcase(os.path.abspath(directory))
+        index = self._listings.get(key)
+        if index is not None:
+            return index
+        index = {}
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if os.path.splitext(entry.name)[1].lower() not in self.extensions:
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    index.setdefault(normalize_name(Path(entry.name).stem), []).append(Path(entry.path))
+        except OSError:
+            pass
+        for paths in index.values():
+            paths.sort(key=lambda p: p.name)
+        self._listings[key] = index
+        return index
+
+    def candidates(self, directory):
+        """目录中所有符合扩展名的文件（按文件名排序）"""
+        return sorted((p for paths in self._listing(directory).values() for p in paths),
+                      key=lambda p: p.name)
+
+    def rank(self, directory, name):
+        """按与 name 的相似度对目录中的文件排序
+
+        Returns:
+            list: [(相似度, Path)]，相似度相同时按文件名排序，结果是确定的
+        """
+        target = normalize_name(Path(name).stem)
+        scored = []
+        for normalized, paths in self._listing(directory).items():
+            score = 1.0 if normalized == target else similarity(target, normalized)
+            scored.extend((score, p) for p in paths)
+        scored.sort(key=lambda item: (-item[0], item[1].name))
+        return scored
+
+    def _pick(self, directory, name, where):
+        ranked = self.rank(directory, name)
+        if not ranked:
+            return None
+        if len(ranked) == 1:
+            print(f"提示: 在{where}中找到{self.label}: {ranked[0][1]}")
+            return ranked[0][1]
+        best_score, best = ranked[0]
+        if best_score >= MIN_SIMILARITY:
+            if ranked[1][0] == best_score:
+                print(f"提示: 有多个{self.label}匹配度相同，按文件名选择: {best.name}")
+            else:
+                print(f"提示: 找到匹配的{self.label}: {best}（相似度 {best_score:.2f}）")
+            return best
+        print(f"提示: 在{where}中找到多个{self.label}，但没有与 '{Path(name).name}' 足够相似的:")
+        for i, (score, path) in enumerate(ranked[:5], 1):
+            print(f"  {i}. {path.name}（相似度 {score:.2f}）")
+        return None
+
+    def resolve(self, raw_path):
+        """查找用户输入的路径对应的文件
+
+        依次尝试：路径本身是文件；路径是目录时在目录中选择（多个文件时选与目录名最相似的，
+        与下载目录 <标题>/<标题>.mp4 的结构一致）；路径不存在时在父目录中按文件名相似度查找。
+
+        Args:
+            raw_path: 用户输入的路径（可能带引号）
+
+        Returns:
+            Path对象，如果找到文件；否则返回None
+        """
+        clean_path = str(raw_path).strip().strip('"\'')
+        if not clean_path:
+            return None
+        path = Path(os.path.normpath(clean_path))
+        try:
+            mode = path.stat().st_mode
+        except (OSError, ValueError):
+            mode = None
+
+        if mode is not None:
+            if stat.S_ISREG(mode):
+                return path
+            if stat.S_ISDIR(mode):
+                return self._pick(path, path.name, "目录")
+            return None
+
+        parent = path.parent
+        if parent.is_dir():
+            return self._pick(parent, path.name, "父目录")
+        return None
+
+    def invalidate(self, directory=None):
+        """丢弃目录缓存（目录内容发生变化后调用）"""
+        if directory is None:
+            self._listings.clear()
+        else:
+            self._listings.pop(os.path.normcase(os.path.abspath(directory)), None)
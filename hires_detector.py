@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+假Hi-Res检测脚本
+下载流程会把音频统一输出为 48kHz/24bit，但很多源其实是 44.1kHz/16bit 升频或有损音频转换来的。
+本脚本通过ffmpeg管道按固定大小的块读取PCM数据，用NumPy向量化计算平均频谱，
+估计有效带宽和有效位深度，判断文件是否为真正的高解析度音频。
+内存占用与文件长度无关，可以批量处理数小时的录音。
+"""
+
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from tool_utils import get_tool_exe
+
+
+AUDIO_EXTENSIONS = {'.flac', '.wav', '.m4a', '.mp4', '.mkv', '.webm', '.mov'}
+
+# FFT长度（48kHz时频率分辨率约5.9Hz）
+NFFT = 8192
+# 每次从管道读取的帧数（每声道）
+CHUNK_FRAMES = NFFT * 16
+# 低于该电平的FFT帧视为静音，不计入频谱（避免静音段拉低平均值）
+SILENCE_DB = -70.0
+# 有效带宽判定：频谱在 CUTOFF_WIDTH_HZ 两侧下降超过 CUTOFF_DROP_DB 视为截止（升频或有损编码的低通滤波），
+# 正常音乐的高频衰减远没有这么陡
+CUTOFF_WIDTH_HZ = 1500.0
+CUTOFF_DROP_DB = 30.0
+# 只在该频率以上查找截止（低频的电平差是音乐本身的频谱形状）
+MIN_CUTOFF_HZ = 4000.0
+# 截止频率取陡降前电平下降该值的位置
+BANDWIDTH_MARGIN_DB = 10.0
+# 44.1kHz/48kHz 来源能保留的最高频率（升频时重采样滤波器的过渡带会略超过22.05kHz）
+SOURCE_NYQUIST = 24000.0
+# 44.1kHz 来源的截止频率范围（Nyquist 22.05kHz，含重采样滤波器的过渡带）。
+# 下载流程统一输出 48kHz，44.1kHz 来源升频后就在这个范围内陡降，真正的 48kHz 录音频谱延伸到接近 24kHz
+CD_CUTOFF_MIN_HZ = 20500.0
+CD_CUTOFF_MAX_HZ = 22500.0
+
+
+def probe_audio(ffprobe_exe, path):
+    """用ffprobe读取音频流信息"""
+    cmd = [ffprobe_exe, "-v", "error", "-select_streams", "a:0",
+           "-show_entries", "stream=codec_name,sample_rate,channels,bits_per_raw_sample,sample_fmt",
+           "-of", "json", str(path)]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    streams = json.loads(result.stdout).get("streams") or []
+    if not streams:
+        raise ValueError("文件中没有音频流")
+    stream = streams[0]
+    return {
+        "codec": stream.get("codec_name"),
+        "sample_rate": int(stream.get("sample_rate") or 0),
+        "channels": int(stream.get("channels") or 0),
+        "bits_per_raw_sample": int(stream.get("bits_per_raw_sample") or 0),
+        "sample_fmt": stream.get("sample_fmt"),
+    }
+
+
+def _read_exact(stream, size):
+    """从管道读取指定字节数（EOF时可能不足）"""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b"".join(parts)
+
+
+class SpectrumAccumulator:
+    """流式累计平均功率谱和采样位使用情况（内存占用恒定）"""
+
+    def __init__(self, channels, nfft=NFFT):
+        self.channels = channels
+        self.nfft = nfft
+        self.window = np.hanning(nfft).astype(np.float32)
+        self.power_sum = np.zeros(nfft // 2 + 1, dtype=np.float64)
+        self.frames_used = 0
+        self.frames_total = 0
+        self.bit_or = np.int32(0)
+        self._leftover = np.zeros(0, dtype=np.float32)
+        self._silence_power = 10 ** (SILENCE_DB / 10)
+
+    def add(self, raw):
+        """处理一块 s32le 交错PCM数据"""
+        samples = np.frombuffer(raw, dtype="<i4")
+        samples = samples[:len(samples) - len(samples) % self.channels]
+        if not len(samples):
+            return
+        # 所有采样按位或：末尾始终为0的位说明这些低位没有被使用（位深度被补零）
+        self.bit_or |= np.bitwise_or.reduce(samples)
+
+        mono = samples.reshape(-1, self.channels).mean(axis=1, dtype=np.float64)
+        mono = (mono / 2.0 ** 31).astype(np.float32)
+        data = np.concatenate([self._leftover, mono])
+        count = len(data) // self.nfft
+        self._leftover = data[count * self.nfft:]
+        if not count:
+            return
+
+        frames = data[:count * self.nfft].reshape(count, self.nfft)
+        self.frames_total += count
+        # 跳过静音帧
+        loud = np.mean(frames * frames, axis=1) > self._silence_power
+        frames = frames[loud]
+        if not len(frames):
+            return
+        spectrum = np.fft.rfft(frames * self.window, axis=1)
+        self.power_sum += np.sum(spectrum.real ** 2 + spectrum.imag ** 2, axis=0)
+        self.frames_used += len(frames)
+
+    def effective_bits(self):
+        """估计有效位深度（s32容器中实际使用的高位数）"""
+        value = int(self.bit_or) & 0xFFFFFFFF
+        if value == 0:
+            return None
+        trailing_zeros = (value & -value).bit_length() - 1
+        return 32 - trailing_zeros
+
+    def spectrum_db(self):
+        if not self.frames_used:
+            return None
+        average = self.power_sum / self.frames_used
+        return 10 * np.log10(average + 1e-30)
+
+
+def estimate_bandwidth(spectrum_db, sample_rate):
+    """根据平均频谱估计有效带宽
+
+    在线性功率上用约500Hz宽的滑动平均平滑频谱，找出 MIN_CUTOFF_HZ 以上最高的陡降
+    （CUTOFF_WIDTH_HZ 两侧相差超过 CUTOFF_DROP_DB），返回陡降开始处电平下降
+    BANDWIDTH_MARGIN_DB 的频率；没有陡降时内容一直延伸到奈奎斯特频率。
+
+    不用频谱的百分位估计噪声底：44.1kHz升频到96kHz的文件有一半以上的频带是空的，
+    中位数本身就落在噪声底上；而正常录音的高频逐渐衰减，以频带顶端为噪声底时
+    "高于噪声底的最高频率"又会落在可听频段内。
+    """
+    bins = len(spectrum_db)
+    nyquist = float(sample_rate / 2)
+    bin_hz = nyquist / (bins - 1)
+    width = max(1, int(500 / bin_hz))
+    kernel = np.ones(width) / width
+    power = np.convolve(10 ** (spectrum_db / 10), kernel, mode="same")
+    # 去掉两端受卷积边缘影响的部分
+    valid = 10 * np.log10(power[:bins - width] + 1e-30)
+    span = max(1, int(CUTOFF_WIDTH_HZ / bin_hz))
+    if len(valid) <= 2 * span:
+        return nyquist
+    # drop[i] 为以 i + span 为中心、两侧各 span 的电平差
+    drop = valid[:-2 * span] - valid[2 * span:]
+    start = max(0, int(MIN_CUTOFF_HZ / bin_hz) - span)
+    steep = np.nonzero(drop[start:] >= CUTOFF_DROP_DB)[0] + start
+    if not len(steep):
+        return nyquist
+    # 最高的一段陡降：从它的起点开始，找电平仍在起点以下 BANDWIDTH_MARGIN_DB 以内的最高频率
+    last = int(steep[-1])
+    first = last
+    while first > start and drop[first - 1] >= CUTOFF_DROP_DB:
+        first -= 1
+    segment = valid[first:last + 2 * span + 1]
+    edge = first + int(np.nonzero(segment >= valid[first] - BANDWIDTH_MARGIN_DB)[0][-1])
+    return float(edge * bin_hz)
+
+
+def analyze_file(path, ffmpeg_path=None):
+    """分析单个文件
+
+    Returns:
+        dict: 分析结果
+    """
+    path = Path(path)
+    ffmpeg_exe = get_tool_exe(ffmpeg_path, "ffmpeg")
+    ffprobe_exe = get_tool_exe(ffmpeg_path, "ffprobe")
+    if not ffmpeg_exe or not ffprobe_exe:
+        return {"path": str(path), "error": "未找到ffmpeg/ffprobe"}
+
+    try:
+        info = probe_audio(ffprobe_exe, path)
+    except (subprocess.CalledProcessError, ValueError) as e:
+        return {"path": str(path), "error": f"无法读取音频信息: {e}"}
+
+    channels = info["channels"] or 2
+    # 保持原始采样率和声道，统一转为 s32le（16bit样本位于高16位）
+    cmd = [ffmpeg_exe, "-v", "error", "-nostdin", "-i", str(path),
+           "-map", "0:a:0", "-c:a", "pcm_s32le", "-f", "s32le", "-"]
+    accumulator = SpectrumAccumulator(channels)
+    chunk_bytes = CHUNK_FRAMES * channels * 4
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            raw = _read_exact(proc.stdout, chunk_bytes)
+            if not raw:
+                break
+            accumulator.add(raw)
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    if returncode != 0:
+        return {"path": str(path), "error": f"解码失败（返回码 {returncode}）"}
+
+    sample_rate = info["sample_rate"]
+    spectrum_db = accumulator.spectrum_db()
+    bandwidth = estimate_bandwidth(spectrum_db, sample_rate) if spectrum_db is not None else None
+    bits = accumulator.effective_bits()
+
+    reasons = []
+    if sample_rate < 48000:
+        reasons.append(f"采样率仅 {sample_rate} Hz")
+    if bits is not None and bits <= 16:
+        reasons.append(f"有效位深度仅 {bits} bit（低位补零）")
+    if bandwidth is not None:
+        if bandwidth < 20500:
+            reasons.append(f"有效带宽仅 {bandwidth / 1000:.1f} kHz（疑似有损压缩来源）")
+        elif sample_rate >= 48000 and CD_CUTOFF_MIN_HZ <= bandwidth <= CD_CUTOFF_MAX_HZ:
+            reasons.append(f"有效带宽仅 {bandwidth / 1000:.1f} kHz（疑似44.1kHz升频）")
+        elif sample_rate > SOURCE_NYQUIST * 2 and bandwidth <= SOURCE_NYQUIST * 1.02:
+            reasons.append(f"有效带宽仅 {bandwidth / 1000:.1f} kHz（疑似44.1kHz/48kHz升频）")
+    if bandwidth is None:
+        reasons.append("全部为静音，无法判断")
+
+    return {
+        "path": str(path),
+        "codec": info["codec"],
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "effective_bits": bits,
+        "bandwidth_hz": round(bandwidth) if bandwidth is not None else None,
+        "analyzed_seconds": round(accumulator.frames_total * NFFT / sample_rate, 1) if sample_rate else None,
+        "genuine_hires": not reasons,
+        "reasons": reasons,
+    }
+
+
+def collect_files(args):
+    """展开参数中的文件和目录"""
+    files = []
+    for arg in args:
+        path = Path(arg)
+        if path.is_dir():
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                files.extend(Path(dirpath) / f for f in sorted(filenames)
+                             if Path(f).suffix.lower() in AUDIO_EXTENSIONS and not f.startswith('.'))
+        elif path.exists():
+            files.append(path)
+        else:
+            print(f"警告: 文件不存在: {arg}", file=sys.stderr)
+    return files
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help"):
+        print("使用方法: python hires_detector.py <文件或目录...> [--json] [--workers N]")
+        print("示例: python hires_detector.py download/video/video.flac")
+        print("示例: python hires_detector.py download --json > hires_report.json")
+        print("\n参数说明:")
+        print("  --json       以JSON格式输出全部结果")
+        print("  --workers N  并行分析的进程数（默认为CPU核心数的一半）")
+        sys.exit(0 if args else 1)
+
+    as_json = "--json" in args
+    workers = max(1, (os.cpu_count() or 2) // 2)
+    if "--workers" in args:
+        index = args.index("--workers")
+        try:
+            workers = max(1, int(args[index + 1]))
+        except (IndexError, ValueError):
+            print("错误: --workers 需要一个整数")
+            sys.exit(1)
+        del args[index:index + 2]
+
+    files = collect_files([a for a in args if not a.startswith("--")])
+    if not files:
+        print("错误: 没有找到音频文件")
+        sys.exit(1)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(analyze_file, files):
+            results.append(result)
+            if as_json:
+                continue
+            name = Path(result["path"]).name
+            if "error" in result:
+                print(f"[错误] {name}: {result['error']}")
+            elif result["genuine_hires"]:
+                print(f"[Hi-Res] {name}: {result['sample_rate']} Hz / {result['effective_bits']} bit，"
+                      f"带宽 {result['bandwidth_hz'] / 1000:.1f} kHz")
+            else:
+                print(f"[可疑] {name}: {'；'.join(result['reasons'])}")
+
+    if as_json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        suspicious = sum(1 for r in results if "error" not in r and not r["genuine_hires"])
+        print(f"\n共分析 {len(results)} 个文件，其中 {suspicious} 个不是真正的Hi-Res")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+任务依赖图执行器
+一个下载任务实际上是一个小的依赖图：获取信息 -> 下载合并 -> 提取音频、转换封面（互相独立）-> 校验/分析。
+JobGraph 按声明的依赖关系调度各个阶段：没有依赖关系的阶段并行执行，失败的阶段按设置重试，
+每个阶段完成后把结果写入状态文件。中断后重新运行同一个任务时，已完成且输出文件仍然有效的阶段会被跳过，
+上游阶段重新执行时下游阶段也会重新执行。
+
+用法:
+    graph = JobGraph("download", state_path)
+    graph.add("video", download, outputs=lambda path: [path], retries=2)
+    graph.add("audio", extract, deps=["video"], required=False)
+    ok = graph.run()
+
+阶段函数接收一个字典 {依赖阶段名: 依赖阶段的结果}，返回值需要能保存为JSON（路径请转为字符串）。
+"""
+
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from async_runner import terminate_all
+
+
+# 阶段状态
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+
+class StageError(Exception):
+    """阶段执行失败（阶段函数可以抛出此异常给出简短的错误信息）"""
+
+
+def _output_key(path):
+    """输出文件的身份标识，用于恢复时判断输出是否仍然有效"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class Stage:
+    """依赖图中的一个阶段"""
+
+    def __init__(self, name, func, deps=(), outputs=None, retries=0, retry_delay=5.0, required=True, after=()):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.after = list(after)
+        self.outputs = outputs
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.required = required
+
+    def output_paths(self, result):
+        """阶段结果对应的输出文件列表"""
+        if self.outputs is None:
+            return []
+        paths = self.outputs(result) if callable(self.outputs) else self.outputs
+        return [str(p) for p in paths if p]
+
+
+class JobGraph:
+    """按依赖关系并行执行阶段的任务图
+
+    Args:
+        name: 任务名称（用于输出信息）
+        state_path: 状态文件路径（None时不保存状态，不支持恢复）
+        max_workers: 同时执行的阶段数上限
+    """
+
+    def __init__(self, name, state_path=None, max_workers=4):
+        self.name = name
+        self.state_path = Path(state_path) if state_path else None
+        self.max_workers = max_workers
+        self.stages = {}
+        self.status = {}
+        self.results = {}
+        self.errors = {}
+        self._interrupted = False
+        self._state = self._load_state()
+
+    def add(self, name, func, deps=(), outputs=None, retries=0, retry_delay=5.0, required=True, after=()):
+        """添加一个阶段
+
+        Args:
+            name: 阶段名称（图中唯一）
+            func: 阶段函数，参数为 {依赖阶段名: 结果}
+            deps: 依赖的阶段名称列表（必须已经添加）
+            outputs: 输出文件列表，或根据结果返回输出文件列表的函数（恢复时检查这些文件）
+            retries: 失败后的重试次数
+            retry_delay: 第一次重试前的等待时间（秒），之后每次加倍
+            required: 为False时该阶段失败不算整个任务失败（依赖它的阶段仍会被跳过）
+            after: 只要求先结束（成功或失败均可）的阶段列表，用于可选的输入：
+                成功时其结果同样传给阶段函数，失败或被跳过时传入None
+        """
+        if name in self.stages:
+            raise ValueError(f"阶段名称重复: {name}")
+        for dep in list(deps) + list(after):
+            if dep not in self.stages:
+                raise ValueError(f"阶段 {name} 依赖的阶段不存在: {dep}")
+        self.stages[name] = Stage(name, func, deps, outputs, retries, retry_delay, required, after)
+        self.status[name] = PENDING
+        return name
+
+    def _load_state(self):
+        if not self.state_path:
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("stages", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"job": self.name, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "stages": self._state}
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def _can_resume(self, stage, rerun):
+        """阶段是否已在之前的运行中完成，且输出文件没有变化"""
+        if any(dep in rerun for dep in stage.deps + stage.after):
+            return False
+        entry = self._state.get(stage.name)
+        if not entry or entry.get("status") != DONE:
+            return False
+        for path, key in entry.get("outputs", {}).items():
+            if _output_key(path) != key:
+                return False
+        return True
+
+    def _execute(self, stage, inputs):
+        """执行阶段（在工作线程中运行），失败时按设置重试"""
+        attempts = stage.retries + 1
+        for attempt in range(1, attempts + 1):
+            try:
+                return stage.func(inputs)
+            except (Exception, SystemExit) as e:
+                # 现有脚本的部分函数出错时调用 sys.exit，这里同样当作阶段失败处理
+                message = str(e) or type(e).__name__
+                if isinstance(e, SystemExit):
+                    message = f"退出码 {e.code}"
+                # 中断后子进程已被结束，不再重试
+                if attempt >= attempts or self._interrupted:
+                    raise StageError(message) from e
+                delay = stage.retry_delay * 2 ** (attempt - 1)
+                print(f"[{self.name}] 阶段 {stage.name} 失败（{message}），{delay:.0f} 秒后重试（{attempt}/{stage.retries}）")
+                time.sleep(delay)
+
+    def run(self):
+        """执行任务图
+
+        Returns:
+            bool: 所有必需阶段是否都已完成
+        """
+        rerun = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"job-{self.name}") as pool:
+            while True:
+                # 提交所有依赖已满足的阶段（阶段按添加顺序检查，依赖总是先于被依赖者添加）
+                for name, stage in self.stages.items():
+                    if self.status[name] != PENDING or name in running:
+                        continue
+                    dep_status = [self.status[dep] for dep in stage.deps]
+                    if any(s in (FAILED, BLOCKED) for s in dep_status):
+                        self.status[name] = BLOCKED
+                        print(f"[{self.name}] 跳过阶段 {name}（依赖的阶段未完成）")
+                        continue
+                    if not all(s == DONE for s in dep_status):
+                        continue
+                    if any(self.status[dep] == PENDING for dep in stage.after):
+                        continue
+                    if self._can_resume(stage, rerun):
+                        self.status[name] = DONE
+                        self.results[name] = self._state[name].get("result")
+                        print(f"[{self.name}] 阶段 {name} 已在之前完成，跳过")
+                        continue
+                    inputs = {dep: self.results.get(dep) for dep in stage.deps + stage.after}
+                    running[name] = pool.submit(self._execute, stage, inputs)
+                    rerun.add(name)
+
+                if not running:
+                    break
+
+                try:
+                    done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    # 阶段在工作线程中运行，独立进程组中的子进程收不到终端的中断信号。
+                    # 线程池退出时会等待正在运行的阶段，先结束子进程，并取消还没开始的阶段
+                    self._interrupted = True
+                    terminate_all()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+                for name in [n for n, f in running.items() if f in done]:
+                    future = running.pop(name)
+                    stage = self.stages[name]
+                    try:
+                        result = future.result()
+                    except StageError as e:
+                        self.status[name] = FAILED
+                        self.errors[name] = str(e)
+                        self._state.pop(name, None)
+                        print(f"[{self.name}] 阶段 {name} 失败: {e}")
+                    else:
+                        self.status[name] = DONE
+                        self.results[name] = result
+                        self._state[name] = {
+                            "status": DONE,
+                            "result": result,
+                            "outputs": {p: _output_key(p) for p in stage.output_paths(result)},
+                            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        }
+                    self._save_state()
+
+        return all(self.status[name] == DONE for name, stage in self.stages.items() if stage.required)
+
+    def summary(self):
+        """各阶段的最终状态
+
+        Returns:
+            dict: {阶段名: 状态}
+        """
+        return dict(self.status)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+关键帧封面
+YouTube封面有时分辨率很低，或者是与内容无关的“标题党”图片，本脚本从视频本身挑选封面：
+在视频时长内均匀选取若干个时间点，每个时间点用输入端定位（-ss，不精确定位）加 -skip_frame nokey
+只解码一个关键帧，缩小为灰度小图后用NumPy向量化计算清晰度（拉普拉斯方差）和曝光评分，
+再对得分最高的关键帧解码一次全分辨率画面，保存为视频旁的封面（<文件名>.jpg），
+最后用 convert_16_9_to_4_3() 生成4:3封面。
+
+每个候选只解码一帧，耗时与视频时长无关，数小时的4K视频也只需几秒。
+
+配置字段:
+    coverSource: "thumbnail"（默认，下载YouTube封面）或 "keyframes"（下载视频后从关键帧中挑选封面）
+    coverCandidates: 候选帧数量（默认12）
+"""
+
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from convert_16_9_to_4_3 import convert_16_9_to_4_3
+from convert_video import probe_duration
+from output_stamps import is_up_to_date, stamp_outputs
+from resource_governor import get_governor
+from scratch_staging import staged_output
+from tool_utils import get_tool_exe, load_optional_config
+
+
+DEFAULT_CANDIDATES = 12
+# 评分用的灰度小图尺寸（只比较候选帧之间的相对得分，不需要保持宽高比）
+SCORE_WIDTH = 320
+SCORE_HEIGHT = 180
+# 跳过开头和结尾的比例（片头、片尾卡片）
+EDGE_MARGIN = 0.05
+# 理想的平均亮度（0~1），偏离越多曝光得分越低
+TARGET_BRIGHTNESS = 0.45
+# 亮度标准差低于该值的帧（黑场、纯色转场）不作为封面
+MIN_CONTRAST = 0.04
+# 封面JPEG质量（ffmpeg -q:v，2为最高质量档）
+JPEG_QSCALE = 2
+
+
+def candidate_times(duration, count):
+    """在去掉首尾 EDGE_MARGIN 后的时长内均匀选取 count 个时间点（每段的中点）"""
+    start = duration * EDGE_MARGIN
+    span = duration * (1 - 2 * EDGE_MARGIN)
+    return [start + span * (i + 0.5) / count for i in range(count)]
+
+
+def keyframe_command(ffmpeg_exe, video_file, timestamp, loglevel="error"):
+    """解码 timestamp 处（之前最近的）一个关键帧的命令前半部分，后面接输出参数
+
+    -copyts 保留原始时间戳：否则定位到的关键帧时间戳为负数（早于 -ss），会被丢弃。
+    """
+    return [ffmpeg_exe, "-hide_banner", "-nostats", "-v", loglevel, "-copyts", "-noaccurate_seek",
+            "-skip_frame", "nokey", "-ss", f"{timestamp:.3f}", "-i", str(video_file), "-frames:v", "1"]
+
+
+def read_keyframe(ffmpeg_exe, video_file, timestamp, prefix=()):
+    """读取 timestamp 处的关键帧的灰度小图
+
+    Returns:
+        tuple: (关键帧的实际时间, uint8 数组，形状为 (SCORE_HEIGHT, SCORE_WIDTH))；读取失败时返回None
+    """
+    # showinfo 在 info 日志级别输出关键帧的实际时间（多个时间点可能定位到同一个关键帧）
+    cmd = list(prefix) + keyframe_command(ffmpeg_exe, video_file, timestamp, loglevel="info") + [
+        "-vf", f"showinfo,scale={SCORE_WIDTH}:{SCORE_HEIGHT}:flags=area,format=gray",
+        "-f", "rawvideo", "pipe:1"]
+    result = subprocess.run(cmd, capture_output=True)
+    frame_bytes = SCORE_WIDTH * SCORE_HEIGHT
+    if result.returncode != 0 or len(result.stdout) < frame_bytes:
+        return None
+    match = re.search(rb"pts_time:(-?[\d.]+)", result.stderr)
+    keyframe_time = float(match.group(1)) if match else timestamp
+    frame = np.frombuffer(result.stdout[:frame_bytes], dtype=np.uint8).reshape(SCORE_HEIGHT, SCORE_WIDTH)
+    return keyframe_time, frame
+
+
+def score_frames(frames):
+    """对候选帧评分（越高越适合做封面）
+
+    清晰度为拉普拉斯算子响应的方差（按候选帧中的最大值归一化），乘以曝光得分
+    （平均亮度偏离 TARGET_BRIGHTNESS 越多越低）；黑场和纯色画面得0分。
+
+    Args:
+        frames: uint8 数组，形状为 (候选数, 高, 宽)
+
+    Returns:
+        numpy.ndarray: 每个候选帧的得分
+    """
+    pixels = frames.astype(np.float32) / 255.0
+    laplacian = (4 * pixels[:, 1:-1, 1:-1] - pixels[:, :-2, 1:-1] - pixels[:, 2:, 1:-1]
+                 - pixels[:, 1:-1, :-2] - pixels[:, 1:-1, 2:])
+    sharpness = laplacian.var(axis=(1, 2))
+    brightness = pixels.mean(axis=(1, 2))
+    contrast = pixels.std(axis=(1, 2))
+    exposure = np.clip(1 - np.abs(brightness - TARGET_BRIGHTNESS) / TARGET_BRIGHTNESS, 0, 1)
+    scores = sharpness / max(float(sharpness.max()), 1e-12) * exposure
+    scores[contrast < MIN_CONTRAST] = 0
+    return scores
+
+
+def pick_keyframe_cover(video_path, ffmpeg_path=None, cover_path=None, count=None, config=None, force=False):
+    """从视频关键帧中挑选封面，并生成4:3封面
+
+    Args:
+        video_path: 视频文件路径
+        ffmpeg_path: ffmpeg路径（可选）
+        cover_path: 封面保存路径（默认为视频旁的 <文件名>.jpg）
+        count: 候选帧数量（默认为配置的 coverCandidates）
+        config: 配置字典（None时读取config.cfg）
+        force: 封面已是最新时也重新挑选
+
+    Returns:
+        str: 4:3封面路径，失败时返回None
+    """
+    if config is None:
+        config = load_optional_config()
+    video_path = Path(video_path)
+    cover_path = Path(cover_path) if cover_path else video_path.with_suffix(".jpg")
+    count = max(1, int(count or config.get("coverCandidates", DEFAULT_CANDIDATES)))
+    ffmpeg_exe = get_tool_exe(ffmpeg_path)
+    ffprobe_exe = get_tool_exe(ffmpeg_path, "ffprobe")
+    if not ffmpeg_exe or not ffprobe_exe:
+        print("错误: 未找到ffmpeg/ffprobe，无法从关键帧挑选封面")
+        return None
+
+    recipe = ["keyframe_cover", str(video_path.absolute()), f"candidates={count}", f"margin={EDGE_MARGIN}",
+              f"brightness={TARGET_BRIGHTNESS}", f"contrast={MIN_CONTRAST}", f"q={JPEG_QSCALE}"]
+    if not force and is_up_to_date([cover_path], recipe, inputs=[video_path]):
+        print(f"关键帧封面已是最新: {cover_path.name}")
+        return convert_16_9_to_4_3(cover_path)
+
+    duration = probe_duration(ffprobe_exe, video_path)
+    if not duration:
+        print(f"错误: 无法读取视频时长 - {video_path}")
+        return None
+    times = candidate_times(duration, count)
+
+    with get_governor(config).acquire("cpu") as slot:
+        prefix = slot.wrap_command([])
+        # 每个候选一个ffmpeg进程，只定位和解码一帧，并行运行
+        with ThreadPoolExecutor(max_workers=max(1, min(count, slot.threads))) as pool:
+            frames = list(pool.map(lambda t: read_keyframe(ffmpeg_exe, video_path, t, prefix), times))
+        # 多个时间点可能定位到同一个关键帧，按关键帧的实际时间去重
+        found = {}
+        for timestamp, item in zip(times, frames):
+            if item is not None:
+                found.setdefault(item[0], (timestamp, item[1]))
+        if not found:
+            print(f"错误: 未能从视频中读取关键帧 - {video_path.name}")
+            return None
+        keyframe_times = sorted(found)
+        scores = score_frames(np.stack([found[t][1] for t in keyframe_times]))
+        best = int(np.argmax(scores))
+        best_time = keyframe_times[best]
+        for index, (keyframe_time, score) in enumerate(zip(keyframe_times, scores)):
+            marker = " <-" if index == best else ""
+            print(f"  关键帧 {int(keyframe_time // 3600)}:{int(keyframe_time % 3600 // 60):02d}:"
+                  f"{keyframe_time % 60:04.1f}  得分 {score:.3f}{marker}")
+
+        with staged_output(cover_path, config) as staged:
+            # 用同一个定位时间重新解码，得到同一个关键帧的全分辨率画面
+            cmd = prefix + keyframe_command(ffmpeg_exe, video_path, found[best_time][0]) + [
+                "-q:v", str(JPEG_QSCALE), "-y", staged]
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"保存关键帧失败: {result.stderr.strip()[-300:]}")
+    stamp_outputs([cover_path], recipe, inputs=[video_path])
+    print(f"已从关键帧挑选封面: {cover_path.name}（{best_time:.1f} 秒处，共 {len(found)} 个候选）")
+    return convert_16_9_to_4_3(cover_path)
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    force = "--force" in args
+    args = [a for a in args if a != "--force"]
+    count = None
+    if "--count" in args:
+        index = args.index("--count")
+        if index + 1 >= len(args):
+            print("错误: --count 需要指定候选帧数量")
+            sys.exit(1)
+        count = int(args[index + 1])
+        del args[index:index + 2]
+    if not args:
+        print("使用方法: python keyframe_cover.py <视频文件路径> [--count 候选帧数量] [--force]")
+        print("从视频的关键帧中挑选最清晰、曝光合适的一帧作为封面（<文件名>.jpg），并生成4:3封面")
+        sys.exit(1)
+
+    config = load_optional_config()
+    result = pick_keyframe_cover(args[0], count=count, config=config, force=force)
+    sys.exit(0 if result else 1)
+
+
+if __name__ == "__main__":
+    main()
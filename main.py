@@ -1,5 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+imaudiotools 统一命令入口
+各个工具仍然是独立的脚本，这里只按子命令分发到对应模块的 main()。
+子命令模块在执行时才导入，Pillow、NumPy 等较重的依赖只在需要它们的子命令中加载，
+--startup-profile 可以查看每个子命令的导入耗时。
+
+用法:
+    imaudiotools <子命令> [参数...]
+    imaudiotools --startup-profile [子命令]
+"""
+
+import argparse
+import importlib
+import re
+import signal
+import subprocess
+import sys
+import time
+
+
+# 子命令: (模块名, 说明)
+COMMANDS = {
+    "download": ("download_video", "下载视频、封面和无损音频"),
+    "extract": ("extract_audio", "从视频中提取无损音频"),
+    "compress": ("compress_wav_to_flac", "将WAV压缩为FLAC"),
+    "convert-video": ("convert_video", "将视频转换为编辑友好格式"),
+    "encoders": ("encoder_benchmark", "实测本机编码器并缓存自动选择的结果"),
+    "cover": ("convert_16_9_to_4_3", "将16:9封面/视频转换为4:3"),
+    "keyframe-cover": ("keyframe_cover", "从视频关键帧中挑选封面"),
+    "watch": ("watch_folder", "监视文件夹并自动处理新文件"),
+    "dedup": ("dedup_library", "媒体库去重"),
+    "verify": ("verify_library", "媒体库完整性校验"),
+    "hires": ("hires_detector", "假Hi-Res检测"),
+    "stamp": ("output_stamps", "查看输出文件的处理记录"),
+    "chapters": ("chapter_split", "按章节分轨"),
+    "peaks": ("waveform_overview", "生成波形概览"),
+    "tuner": ("download_tuner", "查看自动调整的下载参数"),
+    "proxies": ("proxy_pool", "检查代理池中的代理"),
+    "queue": ("work_queue", "多台机器共用的任务队列"),
+}
+
+# 导入耗时报告中显示的模块数量
+PROFILE_TOP_MODULES = 12
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def _interrupt_on_sigterm(signum, frame):
+    """SIGTERM（如队列任务的租约丢失）与 Ctrl+C 同样处理
+
+    async_runner 启动的子进程在独立的进程组中，收不到发给本进程组的信号，先结束它们。
+    """
+    runner = sys.modules.get("async_runner")
+    if runner:
+        runner.terminate_all()
+    raise KeyboardInterrupt
+
+
+def run_command(command, args):
+    """导入子命令对应的模块并执行其 main()
+
+    各模块的 main() 直接读取 sys.argv，这里把参数改写成单独运行脚本时的形式。
+    """
+    module_name, _ = COMMANDS[command]
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, _interrupt_on_sigterm)
+    module = importlib.import_module(module_name)
+    sys.argv = [f"imaudiotools {command}"] + list(args)
+    return module.main()
+
+
+def profile_import(module_name):
+    """在新的解释器中用 -X importtime 导入模块，统计冷启动导入耗时
+
+    Returns:
+        tuple: (总耗时毫秒, [(累计耗时微秒, 模块名, 是否为顶层导入)]，按累计耗时从大到小排序)
+    """
+    code = f"import {module_name}"
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "导入失败")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            # 缩进表示导入层级，顶层导入的累计耗时已包含其中所有子模块
+            top_level = len(match.group(3)) <= 1
+            modules.append((int(match.group(2)), match.group(4), top_level))
+    modules.sort(reverse=True)
+    return wall_ms, modules
+
+
+def startup_profile(commands):
+    """输出各子命令的冷启动导入耗时"""
+    # 解释器启动时导入的模块（site、encodings等）不计入子命令
+    baseline_ms, baseline = profile_import("sys")
+    startup_modules = {name for _, name, _ in baseline}
+    print(f"解释器启动: {baseline_ms:.0f} ms")
+    for command in commands:
+        module_name, _ = COMMANDS[command]
+        try:
+            wall_ms, modules = profile_import(module_name)
+        except RuntimeError as e:
+            print(f"\n{command}（{module_name}）: 导入失败: {e}")
+            continue
+        modules = [m for m in modules if m[1] not in startup_modules]
+        imports_ms = sum(cumulative for cumulative, _, top_level in modules if top_level) / 1000
+        print(f"\n{command}（{module_name}）: 启动 {wall_ms:.0f} ms，其中导入 {imports_ms:.1f} ms")
+        # 耗时最多的依赖（累计耗时，包含各自的子模块）
+        dependencies = [m for m in modules if m[1] != module_name]
+        for cumulative, name, _ in dependencies[:PROFILE_TOP_MODULES]:
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="imaudiotools",
+        description="YouTube视频下载与音视频处理工具集",
+        epilog="子命令:\n" + "\n".join(f"  {name:<16}{desc}" for name, (_, desc) in COMMANDS.items())
+        + "\n\n各子命令的参数与对应脚本相同，例如: imaudiotools convert-video video.mp4 prores",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="显示子命令的冷启动导入耗时（不执行子命令）")
+    parser.add_argument("command", nargs="?", choices=list(COMMANDS), metavar="子命令")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="传给子命令的参数")
+    return parser
+
+
 def main():
-    print("Hello from imaudiotools!")
+    """主函数"""
+    parser = build_parser()
+    options = parser.parse_args()
+
+    if options.startup_profile:
+        startup_profile([options.command] if options.command else list(COMMANDS))
+        return
+
+    if not options.command:
+        parser.print_help()
+        sys.exit(1)
+
+    run_command(options.command, options.args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+输出文件戳记
+每个生成的文件都记录一份戳记：输入文件的身份（大小、修改时间）、生成它的完整命令和工具版本，
+以及输出文件自身的大小和修改时间。再次处理时只有戳记完全一致才跳过，
+参数变化、输入被替换、工具升级或输出被截断/修改都会重新生成（与 make 的增量构建相同）。
+
+戳记按路径保存为同目录下的隐藏文件 .<文件名>.stamp.json。不使用扩展属性（xattr）：
+扩展属性属于inode，去重后硬链接在一起的文件会共用同一份戳记，reflink 生成的新文件则没有戳记。
+
+用法:
+    if not is_up_to_date([output_file], cmd):
+        subprocess.run(cmd, check=True)
+        stamp_outputs([output_file], cmd)
+
+命令中 -i 后面的参数自动作为输入文件，命令中的可执行文件自动记录版本。
+"""
+
+import functools
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+STAMP_VERSION = 1
+
+
+def _sidecar_path(path):
+    path = Path(path)
+    return path.parent / f".{path.name}.stamp.json"
+
+
+def _file_identity(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version(exe):
+    """工具版本（ffmpeg/yt-dlp等可执行文件输出的第一行），结果按路径缓存"""
+    for flag in ("-version", "--version"):
+        try:
+            result = subprocess.run([exe, flag], capture_output=True, text=True, timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if result.returncode == 0 and result.stdout.strip():
+            return result.stdout.strip().splitlines()[0]
+    return None
+
+
+def command_inputs(cmd):
+    """命令中 -i 指定的输入文件"""
+    return [cmd[i + 1] for i, arg in enumerate(cmd[:-1]) if arg == "-i"]
+
+
+def build_recipe(cmd, inputs=None, tools=None):
+    """生成输出文件的“配方”：命令、输入身份和工具版本
+
+    Args:
+        cmd: 生成输出的命令（使用最终输出路径，不包含临时路径和线程参数）
+        inputs: 输入文件列表（None时从命令的 -i 参数中获取）
+        tools: 额外的工具版本 {名称: 版本}（None时记录命令中可执行文件的版本）
+
+    Returns:
+        dict: 配方
+    """
+    cmd = [str(arg) for arg in cmd]
+    if inputs is None:
+        inputs = command_inputs(cmd)
+    if tools is None:
+        tools = {}
+        if os.path.isfile(cmd[0]):
+            tools[Path(cmd[0]).stem] = tool_version(cmd[0])
+    return {
+        "command": cmd,
+        "inputs": {str(p): _file_identity(p) for p in inputs},
+        "tools": dict(tools),
+    }
+
+
+def read_stamp(path):
+    """读取文件的戳记
+
+    Returns:
+        dict: 戳记，没有戳记时返回None
+    """
+    try:
+        stamp = json.loads(_sidecar_path(path).read_bytes())
+    except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return stamp if isinstance(stamp, dict) and stamp.get("version") == STAMP_VERSION else None
+
+
+def _save_stamp(path, stamp):
+    sidecar = _sidecar_path(path)
+    tmp = sidecar.with_name(f"{sidecar.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(json.dumps(stamp, ensure_ascii=False).encode("utf-8"))
+    os.replace(tmp, sidecar)
+
+
+def write_stamp(path, recipe):
+    """为输出文件写入戳记（在输出文件发布到最终位置后调用）"""
+    _save_stamp(path, {
+        "version": STAMP_VERSION,
+        **recipe,
+        "output": _file_identity(path),
+        "stamped_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+
+
+def refresh_stamp(path, previous_st):
+    """文件被替换为内容相同的文件（去重时的硬链接或reflink）后，更新戳记中的输出身份
+
+    只有替换前戳记与文件一致时才更新，已经过期的戳记保持过期。
+
+    Args:
+        path: 被替换的文件
+        previous_st: 替换前的 os.stat_result
+
+    Returns:
+        bool: 是否更新了戳记
+    """
+    stamp = read_stamp(path)
+    if not stamp or stamp.get("output") != [previous_st.st_size, previous_st.st_mtime_ns]:
+        return False
+    stamp["output"] = _file_identity(path)
+    _save_stamp(path, stamp)
+    return True
+
+
+def stamp_matches(path, recipe):
+    """输出文件是否存在、未被修改，且由相同的配方生成"""
+    stamp = read_stamp(path)
+    if not stamp:
+        return False
+    if stamp.get("output") != _file_identity(path):
+        return False
+    return all(stamp.get(key) == value for key, value in recipe.items())
+
+
+def is_up_to_date(outputs, cmd, inputs=None, tools=None):
+    """所有输出文件是否都已由相同的命令、输入和工具生成
+
+    Args:
+        outputs: 输出文件列表
+        cmd: 生成输出的命令（同 build_recipe）
+        inputs: 输入文件列表（可选）
+        tools: 工具版本（可选）
+    """
+    recipe = build_recipe(cmd, inputs, tools)
+    return all(stamp_matches(output, recipe) for output in outputs)
+
+
+def stamp_outputs(outputs, cmd, inputs=None, tools=None):
+    """为一次处理生成的所有输出文件写入戳记（写入失败只警告）"""
+    recipe = build_recipe(cmd, inputs, tools)
+    for output in outputs:
+        try:
+            write_stamp(output, recipe)
+        except OSError as e:
+            print(f"警告: 无法写入处理记录 {Path(output).name}: {e}")
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help"):
+        print("使用方法: python output_stamps.py <文件...>")
+        print("显示文件的处理记录（输入、命令、工具版本），并检查输入和输出是否有变化")
+        sys.exit(0 if args else 1)
+
+    for arg in args:
+        stamp = read_stamp(arg)
+        print(f"{arg}:")
+        if not stamp:
+            print("  没有处理记录")
+            continue
+        print(f"  生成时间: {stamp.get('stamped_at')}")
+        print(f"  命令: {' '.join(stamp.get('command', []))}")
+        for name, version in stamp.get("tools", {}).items():
+            print(f"  {name}: {version}")
+        for path, identity in stamp.get("inputs", {}).items():
+            state = "未变化" if _file_identity(path) == identity else "已变化"
+            print(f"  输入: {path}（{state}）")
+        state = "未变化" if _file_identity(arg) == stamp.get("output") else "已变化"
+        print(f"  输出: {state}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+代理池
+配置多个代理（proxies）后，下载不再依赖单个代理：每个代理先做轻量的健康和延迟检查
+（连接代理端口，HTTP代理再通过它请求一次 proxyCheckUrl），同时进行的下载分散到占用最少、
+延迟最低的健康代理上，下载失败时立即换用下一个代理继续（yt-dlp 会从已下载的分片续传）。
+
+检查结果和每个代理的累计吞吐量保存在资源调度器的锁目录中（proxy_pool.json），
+同一台机器上的下载进程共用，检查结果在 proxyRecheckSeconds 内不重复检查。
+每个代理的占用通过锁目录中的租约文件（文件锁）统计，进程崩溃时自动释放。
+状态文件中只保存代理地址的哈希，不保存代理的用户名和密码。
+
+配置字段:
+    proxies: 代理列表，如 ["http://127.0.0.1:7890", "socks5://127.0.0.1:1080"]（只有 proxy 时作为只有一个代理的代理池）
+    proxyCheckUrl: 健康检查请求的地址（默认 https://www.youtube.com/generate_204）
+    proxyCheckTimeout: 健康检查的超时时间（秒，默认5）
+    proxyRecheckSeconds: 检查结果的有效时间（秒，默认300）
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from download_tuner import format_rate
+from resource_governor import get_governor, try_lock, unlock
+from tool_utils import load_optional_config
+
+
+STATE_FILE = "proxy_pool.json"
+DEFAULT_CHECK_URL = "https://www.youtube.com/generate_204"
+DEFAULT_CHECK_TIMEOUT = 5
+DEFAULT_RECHECK_SECONDS = 300
+# 每个代理的租约文件数上限（同时使用同一个代理的任务数）
+MAX_LEASES = 64
+
+_DEFAULT_PORTS = {"http": 80, "https": 443, "socks4": 1080, "socks4a": 1080, "socks5": 1080, "socks5h": 1080}
+
+
+def proxy_key(proxy):
+    """代理在状态文件和租约文件中的标识（不包含明文的用户名和密码）"""
+    return hashlib.sha1(proxy.encode("utf-8")).hexdigest()[:12]
+
+
+def display_name(proxy):
+    """去掉用户名和密码的代理地址，用于输出"""
+    parts = urlsplit(proxy)
+    host = parts.hostname or proxy
+    return f"{parts.scheme}://{host}:{parts.port}" if parts.port else f"{parts.scheme}://{host}"
+
+
+def configured_proxies(config):
+    """配置中的代理列表（proxies，或只有 proxy 时的单个代理）"""
+    proxies = config.get("proxies") or []
+    if isinstance(proxies, str):
+        proxies = [proxies]
+    if not proxies and config.get("proxy"):
+        proxies = [config["proxy"]]
+    return list(dict.fromkeys(proxies))
+
+
+def check_proxy(proxy, check_url=DEFAULT_CHECK_URL, timeout=DEFAULT_CHECK_TIMEOUT):
+    """检查代理是否可用
+
+    先连接代理端口；HTTP代理再通过它请求 check_url（收到任何HTTP响应都算可用），
+    SOCKS代理只检查端口（标准库不支持SOCKS）。
+
+    Returns:
+        float: 延迟（秒），不可用时返回None
+    """
+    parts = urlsplit(proxy)
+    scheme = (parts.scheme or "http").lower()
+    try:
+        port = parts.port or _DEFAULT_PORTS.get(scheme, 1080)
+    except ValueError:
+        return None
+    start = time.monotonic()
+    try:
+        with socket.create_connection((parts.hostname, port), timeout=timeout):
+            pass
+    except (OSError, TypeError):
+        return None
+    latency = time.monotonic() - start
+    if scheme not in ("http", "https"):
+        return latency
+
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": proxy, "https": proxy}))
+    request = urllib.request.Request(check_url, method="HEAD")
+    start = time.monotonic()
+    try:
+        opener.open(request, timeout=timeout).close()
+    except urllib.error.HTTPError:
+        # 目标网站返回了错误状态码，但代理本身是通的
+        pass
+    except (urllib.error.URLError, OSError):
+        return None
+    return time.monotonic() - start
+
+
+class ProxyLease:
+    """已占用的代理（支持 with 语句，退出时释放）"""
+
+    def __init__(self, proxy, fd):
+        self.proxy = proxy
+        self._fd = fd
+
+    def release(self):
+        if self._fd is not None:
+            unlock(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class ProxyPool:
+    """多个代理的健康检查、分配和故障切换
+
+    Args:
+        proxies: 代理地址列表
+        lock_dir: 状态文件和租约文件所在的目录
+        check_url: 健康检查请求的地址
+        check_timeout: 健康检查的超时时间（秒）
+        recheck_seconds: 检查结果的有效时间（秒）
+    """
+
+    def __init__(self, proxies, lock_dir, check_url=DEFAULT_CHECK_URL, check_timeout=DEFAULT_CHECK_TIMEOUT,
+                 recheck_seconds=DEFAULT_RECHECK_SECONDS):
+        self.proxies = list(proxies)
+        self.lock_dir = lock_dir
+        self.state_path = lock_dir / STATE_FILE
+        self.check_url = check_url
+        self.check_timeout = check_timeout
+        self.recheck_seconds = recheck_seconds
+        # 本次任务中每个代理的统计（用于任务结束时的汇总）
+        self.job_stats = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config=None):
+        """根据配置创建代理池，没有配置代理时返回None"""
+        if config is None:
+            config = load_optional_config()
+        proxies = configured_proxies(config)
+        if not proxies:
+            return None
+        return cls(
+            proxies,
+            get_governor(config).lock_dir,
+            check_url=config.get("proxyCheckUrl", DEFAULT_CHECK_URL),
+            check_timeout=config.get("proxyCheckTimeout", DEFAULT_CHECK_TIMEOUT),
+            recheck_seconds=config.get("proxyRecheckSeconds", DEFAULT_RECHECK_SECONDS),
+        )
+
+    def _load(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _update(self, proxy, **fields):
+        """更新状态文件中一个代理的记录（数值字段累加，其他字段覆盖）"""
+        with self._lock:
+            state = self._load()
+            entry = state.setdefault(proxy_key(proxy), {})
+            entry["name"] = display_name(proxy)
+            for name, value in fields.items():
+                if name in ("bytes", "seconds", "jobs", "failures"):
+                    entry[name] = entry.get(name, 0) + value
+                else:
+                    entry[name] = value
+            # 多个进程同时更新时后写入的生效，只影响统计数据
+            tmp = self.state_path.with_name(f"{self.state_path.name}.{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.state_path)
+
+    def check(self, proxy):
+        """检查一个代理并记录结果
+
+        Returns:
+            float: 延迟（秒），不可用时返回None
+        """
+        latency = check_proxy(proxy, self.check_url, self.check_timeout)
+        self._update(proxy, healthy=latency is not None, latency=latency, checked_at=time.time())
+        return latency
+
+    def check_all(self, force=False):
+        """并行检查检查结果已过期的代理（force 时检查所有代理）
+
+        Returns:
+            dict: {代理: 延迟或None}
+        """
+        state = self._load()
+        now = time.time()
+        stale = [p for p in self.proxies
+                 if force or now - state.get(proxy_key(p), {}).get("checked_at", 0) > self.recheck_seconds]
+        if stale:
+            with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+                list(pool.map(self.check, stale))
+            state = self._load()
+        latencies = {}
+        for proxy in self.proxies:
+            entry = state.get(proxy_key(proxy), {})
+            latencies[proxy] = entry.get("latency") if entry.get("healthy") else None
+        return latencies
+
+    def _lease_path(self, proxy, index):
+        return self.lock_dir / f"proxy-{proxy_key(proxy)}.{index}.lock"
+
+    def in_use(self, proxy):
+        """正在使用该代理的任务数（包括其他进程）"""
+        count = 0
+        for index in range(MAX_LEASES):
+            path = self._lease_path(proxy, index)
+            if not path.exists():
+                continue
+            fd = os.open(path, os.O_RDWR)
+            try:
+                if try_lock(fd):
+                    unlock(fd)
+                else:
+                    count += 1
+            finally:
+                os.close(fd)
+        return count
+
+    def candidates(self, exclude=()):
+        """按优先顺序排列的代理：健康的代理在前，占用少的在前，延迟低的在前
+
+        所有代理都检查失败时（例如检查地址被屏蔽）仍然返回全部代理，按最近失败次数排序。
+        """
+        latencies = self.check_all()
+        proxies = [p for p in self.proxies if p not in exclude]
+        healthy = [p for p in proxies if latencies[p] is not None]
+        if healthy:
+            return sorted(healthy, key=lambda p: (self.in_use(p), latencies[p]))
+        state = self._load()
+        return sorted(proxies, key=lambda p: state.get(proxy_key(p), {}).get("failures", 0))
+
+    def acquire(self, exclude=()):
+        """占用一个代理
+
+        Returns:
+            ProxyLease: 占用的代理，没有可用的代理时返回None
+        """
+        for proxy in self.candidates(exclude):
+            for index in range(MAX_LEASES):
+                fd = os.open(self._lease_path(proxy, index), os.O_RDWR | os.O_CREAT, 0o666)
+                if try_lock(fd):
+                    return ProxyLease(proxy, fd)
+                os.close(fd)
+        return None
+
+    def report(self, proxy, nbytes=0, seconds=0.0):
+        """记录一次使用该代理成功完成的任务"""
+        self._update(proxy, bytes=nbytes, seconds=seconds, jobs=1)
+        with self._lock:
+            stats = self.job_stats.setdefault(proxy, {"bytes": 0, "seconds": 0.0, "jobs": 0, "failures": 0})
+            stats["bytes"] += nbytes
+            stats["seconds"] += seconds
+            stats["jobs"] += 1
+
+    def report_failure(self, proxy):
+        """记录一次失败，并立即重新检查该代理（失败可能与代理无关，检查通过时仍保持可用）"""
+        self._update(proxy, failures=1)
+        with self._lock:
+            stats = self.job_stats.setdefault(proxy, {"bytes": 0, "seconds": 0.0, "jobs": 0, "failures": 0})
+            stats["failures"] += 1
+        self.check(proxy)
+
+    def run_with_failover(self, func):
+        """用代理池中的代理执行 func(proxy)，命令失败时换用下一个代理
+
+        Args:
+            func: 使用代理执行任务的函数，命令失败时抛出 subprocess.CalledProcessError
+
+        Returns:
+            func 的返回值
+
+        Raises:
+            subprocess.CalledProcessError: 所有代理都失败（最后一次的错误）
+            RuntimeError: 没有可用的代理
+        """
+        tried = []
+        error = None
+        while True:
+            lease = self.acquire(exclude=tried)
+            if lease is None:
+                if error:
+                    raise error
+                raise RuntimeError("没有可用的代理")
+            with lease:
+                try:
+                    return func(lease.proxy)
+                except subprocess.CalledProcessError as e:
+                    error = e
+                    tried.append(lease.proxy)
+                    self.report_failure(lease.proxy)
+                    if len(tried) < len(self.proxies):
+                        print(f"使用代理 {display_name(lease.proxy)} 失败，切换到下一个代理")
+
+    def summary_lines(self):
+        """本次任务中各代理的吞吐量统计"""
+        lines = []
+        for proxy, stats in self.job_stats.items():
+            rate = format_rate(stats["bytes"] / stats["seconds"]) if stats["seconds"] else "-"
+            lines.append(f"{display_name(proxy)}: {stats['jobs']} 个任务，{stats['bytes'] / 1024 ** 2:.1f} MB，"
+                         f"{rate}，失败 {stats['failures']} 次")
+        return lines
+
+
+@contextlib.contextmanager
+def leased_config(pool, config):
+    """从代理池占用一个代理，返回使用该代理的配置（没有代理池时直接返回原配置）"""
+    lease = pool.acquire() if pool else None
+    if lease is None:
+        yield config
+        return
+    with lease:
+        yield dict(config, proxy=lease.proxy)
+
+
+def main():
+    """主函数：检查所有代理并显示累计统计"""
+    args = sys.argv[1:]
+    if args and args[0] in ("-h", "--help"):
+        print("使用方法: python proxy_pool.py")
+        print("检查配置中的所有代理（proxies），显示延迟、占用和累计吞吐量")
+        sys.exit(0)
+
+    pool = ProxyPool.from_config()
+    if not pool:
+        print("没有配置代理（proxies 或 proxy）")
+        return
+    print(f"正在检查 {len(pool.proxies)} 个代理: {pool.check_url}")
+    latencies = pool.check_all(force=True)
+    state = pool._load()
+    for proxy in pool.proxies:
+        entry = state.get(proxy_key(proxy), {})
+        latency = latencies[proxy]
+        health = f"可用，延迟 {latency * 1000:.0f} ms" if latency is not None else "不可用"
+        rate = format_rate(entry["bytes"] / entry["seconds"]) if entry.get("seconds") else "-"
+        print(f"{display_name(proxy)}: {health}，使用中 {pool.in_use(proxy)}，"
+              f"累计 {entry.get('jobs', 0)} 个任务，{rate}，失败 {entry.get('failures', 0)} 次")
+    if not any(latency is not None for latency in latencies.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
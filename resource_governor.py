@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+全局资源调度器
+多个脚本同时运行时，限制每类资源的并发任务数，避免ffmpeg默认占满所有核心、
+下载因磁盘I/O被饿死。通过锁目录中的槽位文件（文件锁）在多个进程之间协调，
+进程崩溃时内核会自动释放锁，不会留下死锁。
+
+资源类型:
+    cpu     - CPU密集的编码任务（WAV压缩、视频转换）
+    disk    - 磁盘密集的任务（从视频中提取音频、重封装）
+    network - 网络下载任务（yt-dlp）
+    gpu     - 硬件编码任务（NVENC/AMF/QSV，受显卡的编码会话数限制）
+
+支持 Windows 和 Linux 平台
+"""
+
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from tool_utils import load_optional_config
+
+if platform.system() == "Windows":
+    import msvcrt
+else:
+    import fcntl
+
+
+RESOURCE_CLASSES = ("cpu", "disk", "network", "gpu")
+
+# 各资源类型的默认并发上限
+DEFAULT_LIMITS = {
+    "cpu": 1,
+    "disk": 1,
+    "network": 2,
+    "gpu": 2,
+}
+
+# 每个磁盘类任务（提取音频、重封装）使用的线程数，其余核心由CPU类任务平分
+DISK_JOB_THREADS = 2
+
+# 配置文件中对应的字段名
+CONFIG_KEYS = {
+    "cpu": "maxCpuJobs",
+    "disk": "maxDiskJobs",
+    "network": "maxNetworkJobs",
+    "gpu": "maxGpuSessions",
+}
+
+
+def try_lock(fd):
+    """尝试以非阻塞方式锁定文件，成功返回True"""
+    try:
+        if platform.system() == "Windows":
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def unlock(fd):
+    """释放 try_lock 获取的锁"""
+    try:
+        if platform.system() == "Windows":
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    except OSError:
+        pass
+
+
+class ResourceSlot:
+    """已获取的资源槽位，使用完毕后需要释放（支持 with 语句）"""
+
+    def __init__(self, governor, resource_class, index, fd):
+        self.governor = governor
+        self.resource_class = resource_class
+        self.index = index
+        self.threads = governor.threads_per_job(resource_class)
+        self._fd = fd
+
+    def ffmpeg_args(self):
+        """根据核心预算生成的ffmpeg线程参数"""
+        return ["-threads", str(self.threads), "-filter_threads", str(self.threads)]
+
+    def apply_to_ffmpeg(self, cmd):
+        """为ffmpeg命令添加线程参数和优先级前缀
+
+        线程参数插入到输出文件（命令最后一个参数）之前。
+
+        Args:
+            cmd: ffmpeg命令列表
+
+        Returns:
+            list: 新的命令列表
+        """
+        cmd = list(cmd[:-1]) + self.ffmpeg_args() + list(cmd[-1:])
+        return self.wrap_command(cmd)
+
+    def wrap_command(self, cmd):
+        """为命令添加 nice/ionice 前缀（如果配置了且系统支持）"""
+        return self.governor.priority_prefix() + list(cmd)
+
+    def release(self):
+        if self._fd is not None:
+            unlock(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class ResourceGovernor:
+    """按资源类型限制并发任务数的调度器"""
+
+    def __init__(self, lock_dir=None, limits=None, nice=None, ionice_class=None, cpu_count=None):
+        self.lock_dir = Path(lock_dir or Path(tempfile.gettempdir()) / "imaudiotools-locks")
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits:
+            self.limits.update({k: max(1, int(v)) for k, v in limits.items() if v})
+        self.nice = nice
+        self.ionice_class = ionice_class
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+
+    @classmethod
+    def from_config(cls, config=None):
+        """根据配置创建调度器
+
+        配置字段:
+            governorLockDir: 锁目录（多台机器共享时可放在共享存储上，默认系统临时目录）
+            maxCpuJobs / maxDiskJobs / maxNetworkJobs / maxGpuSessions: 各资源类型的并发上限
+            jobNice: 子进程的 nice 值（可选，仅Linux）
+            jobIoniceClass: 子进程的 ionice 类型，"idle" 或 "best-effort"（可选，仅Linux）
+        """
+        if config is None:
+            config = load_optional_config()
+        limits = {rc: config.get(key) for rc, key in CONFIG_KEYS.items()}
+        return cls(
+            lock_dir=config.get("governorLockDir"),
+            limits=limits,
+            nice=config.get("jobNice"),
+            ionice_class=config.get("jobIoniceClass"),
+        )
+
+    def threads_per_job(self, resource_class):
+        """每个任务可使用的线程数
+
+        CPU类任务和磁盘类任务可以同时运行：磁盘类（及其他类型）任务固定使用少量线程，
+        为同时允许的磁盘任务预留这部分核心后，剩余核心由CPU类任务按并发上限平分。
+        """
+        reserved = min(DISK_JOB_THREADS, self.cpu_count)
+        if resource_class != "cpu":
+            return reserved
+        spare = self.cpu_count - reserved * self.limits["disk"]
+        return max(1, spare // self.limits["cpu"])
+
+    def priority_prefix(self):
+        """生成 nice/ionice 命令前缀"""
+        if platform.system() == "Windows":
+            return []
+        prefix = []
+        if self.nice is not None and shutil.which("nice"):
+            prefix.extend(["nice", "-n", str(int(self.nice))])
+        if self.ionice_class and shutil.which("ionice"):
+            if self.ionice_class == "idle":
+                prefix.extend(["ionice", "-c", "3"])
+            elif self.ionice_class == "best-effort":
+                prefix.extend(["ionice", "-c", "2", "-n", "7"])
+        return prefix
+
+    def _slot_path(self, resource_class, index):
+        return self.lock_dir / f"{resource_class}.{index}.lock"
+
+    def try_acquire(self, resource_class, limit=None):
+        """尝试获取一个槽位，没有空闲槽位时返回None
+
+        limit 可以临时使用更少的槽位（如下载参数自动调整降低了同时下载数），不超过配置的上限。
+        """
+        if resource_class not in RESOURCE_CLASSES:
+            raise ValueError(f"未知的资源类型: {resource_class}")
+        limit = min(limit, self.limits[resource_class]) if limit else self.limits[resource_class]
+        for index in range(limit):
+            fd = os.open(self._slot_path(resource_class, index), os.O_RDWR | os.O_CREAT, 0o666)
+            if try_lock(fd):
+                # 记录持有者信息，便于查看状态
+                os.ftruncate(fd, 0)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, f"{platform.node()} {os.getpid()} {' '.join(sys.argv)}\n".encode("utf-8", "replace"))
+                return ResourceSlot(self, resource_class, index, fd)
+            os.close(fd)
+        return None
+
+    def acquire(self, resource_class, timeout=None, poll_interval=0.5, limit=None):
+        """获取一个槽位，没有空闲槽位时等待
+
+        Args:
+            resource_class: 资源类型（cpu/disk/network/gpu）
+            timeout: 最长等待时间（秒），None表示一直等待
+            poll_interval: 轮询间隔（秒）
+            limit: 只使用前 limit 个槽位（可选）
+
+        Returns:
+            ResourceSlot: 获取到的槽位
+        """
+        start = time.monotonic()
+        waiting_reported = False
+        while True:
+            slot = self.try_acquire(resource_class, limit)
+            if slot:
+                return slot
+            if not waiting_reported:
+                print(f"等待 {resource_class} 资源槽位（上限 {limit or self.limits[resource_class]}）...")
+                waiting_reported = True
+            if timeout is not None and time.monotonic() - start >= timeout:
+                raise TimeoutError(f"等待 {resource_class} 资源槽位超时")
+            time.sleep(poll_interval)
+
+    def status(self):
+        """查看各资源类型的槽位占用情况
+
+        Returns:
+            dict: {资源类型: [(槽位序号, 持有者信息或None)]}
+        """
+        return {resource_class: self._slot_holders(resource_class) for resource_class in RESOURCE_CLASSES}
+
+    def busy_count(self, resource_class):
+        """某类资源当前被占用的槽位数（包括本进程持有的槽位）"""
+        return sum(1 for _, holder in self._slot_holders(resource_class) if holder)
+
+    def _slot_holders(self, resource_class):
+        slots = []
+        for index in range(self.limits[resource_class]):
+            path = self._slot_path(resource_class, index)
+            holder = None
+            if path.exists():
+                fd = os.open(path, os.O_RDWR)
+                try:
+                    if try_lock(fd):
+                        unlock(fd)
+                    else:
+                        holder = path.read_text(encoding="utf-8", errors="replace").strip() or "?"
+                finally:
+                    os.close(fd)
+            slots.append((index, holder))
+        return slots
+
+
+_default_governor = None
+
+
+def get_governor(config=None):
+    """获取进程内共享的调度器实例"""
+    global _default_governor
+    if _default_governor is None:
+        _default_governor = ResourceGovernor.from_config(config)
+    return _default_governor
+
+
+def main():
+    """主函数：显示资源槽位占用情况"""
+    governor = get_governor()
+    print(f"锁目录: {governor.lock_dir}")
+    print(f"CPU核心数: {governor.cpu_count}，每个任务线程数: CPU任务 {governor.threads_per_job('cpu')}，"
+          f"其他任务 {governor.threads_per_job('disk')}")
+    for resource_class, slots in governor.status().items():
+        busy = sum(1 for _, holder in slots if holder)
+        print(f"\n{resource_class}: {busy}/{len(slots)} 占用")
+        for index, holder in slots:
+            print(f"  [{index}] {holder or '空闲'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+临时工作区与原子发布
+yt-dlp 的 .part 分片、合并中间文件和 ffmpeg 输出先写入快速的临时目录（tmpfs 或本地SSD），
+完成后再一次性发布到下载目录（同一文件系统时原子重命名，否则顺序复制到隐藏临时文件后重命名），
+读取下载目录的程序永远不会看到写了一半的文件。
+
+配置字段:
+    scratchDir:         临时工作区目录（未配置时直接在目标目录旁写隐藏临时文件再重命名）
+    scratchBudgetGB:    临时工作区的空间预算（GB，可选）
+    scratchOrphanHours: 超过该时间、且无法确认属主进程仍在运行的遗留任务目录会被清理（默认24小时）
+"""
+
+import contextlib
+import errno
+import os
+import platform
+import shutil
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from tool_utils import load_optional_config
+
+
+OWNER_FILE = ".owner"
+
+
+def _pid_alive(pid):
+    """检查本机进程是否仍在运行，无法判断时返回None"""
+    if pid <= 0:
+        return False
+    if platform.system() == "Windows":
+        # Windows 上无法用信号0检测，交给超时清理
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def publish_file(staged_path, final_path):
+    """将已完成的文件发布到最终位置
+
+    同一文件系统时直接原子重命名；跨文件系统时先顺序复制到目标目录中的隐藏临时文件，
+    再原子重命名为最终文件名。
+
+    Args:
+        staged_path: 临时文件路径
+        final_path: 最终文件路径
+
+    Returns:
+        str: 最终文件路径
+    """
+    staged_path = Path(staged_path)
+    final_path = Path(final_path)
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        os.replace(staged_path, final_path)
+        return str(final_path)
+    except OSError as e:
+        # 跨文件系统（Windows上为跨驱动器，winerror 17）不能直接重命名
+        if e.errno != errno.EXDEV and getattr(e, "winerror", None) != 17:
+            raise
+
+    publishing = final_path.parent / f".{final_path.name}.publishing-{os.getpid()}"
+    try:
+        # 大缓冲区顺序复制，避免在USB存储上产生大量小的随机写
+        with open(staged_path, "rb") as src, open(publishing, "wb") as dst:
+            shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+            dst.flush()
+            os.fsync(dst.fileno())
+        shutil.copystat(staged_path, publishing)
+        os.replace(publishing, final_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            publishing.unlink()
+        raise
+    staged_path.unlink()
+    return str(final_path)
+
+
+class ScratchJob:
+    """一次任务在临时工作区中的独立目录"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def staged_path(self, final_path):
+        """为最终文件生成在临时目录中的对应路径（保留扩展名，便于ffmpeg识别格式）"""
+        final_path = Path(final_path)
+        return self.path / final_path.name
+
+    def publish(self, staged_path, final_path):
+        return publish_file(staged_path, final_path)
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+
+
+class ScratchArea:
+    """临时工作区：管理空间预算和遗留目录清理"""
+
+    def __init__(self, root, budget_bytes=None, orphan_hours=24):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.budget_bytes = budget_bytes
+        self.orphan_seconds = orphan_hours * 3600
+
+    @classmethod
+    def from_config(cls, config=None):
+        """根据配置创建临时工作区，未配置 scratchDir 时返回None"""
+        if config is None:
+            config = load_optional_config()
+        scratch_dir = config.get("scratchDir")
+        if not scratch_dir:
+            return None
+        budget_gb = config.get("scratchBudgetGB")
+        budget_bytes = int(float(budget_gb) * 1024 ** 3) if budget_gb else None
+        try:
+            return cls(scratch_dir, budget_bytes, float(config.get("scratchOrphanHours", 24)))
+        except OSError as e:
+            print(f"警告: 临时工作区不可用 '{scratch_dir}': {e}")
+            return None
+
+    def cleanup_orphans(self):
+        """清理已崩溃进程遗留的任务目录
+
+        属主是本机进程时只看进程是否还在运行（运行数小时的下载或编码不会被清理）；
+        没有属主信息、属主在其他机器上或无法判断进程状态时，按超时时间判断。
+
+        Returns:
+            int: 清理的目录数量
+        """
+        removed = 0
+        host = platform.node()
+        now = time.time()
+        for entry in os.scandir(self.root):
+            if not entry.is_dir(follow_symlinks=False) or not entry.name.startswith("job-"):
+                continue
+            owner_file = Path(entry.path) / OWNER_FILE
+            alive = None
+            try:
+                owner_host, owner_pid = owner_file.read_text(encoding="utf-8").split()[:2]
+                if owner_host == host:
+                    alive = _pid_alive(int(owner_pid))
+            except (OSError, ValueError):
+                pass
+            if alive is None:
+                try:
+                    alive = now - entry.stat().st_mtime <= self.orphan_seconds
+                except OSError:
+                    continue
+            if not alive:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        if removed:
+            print(f"已清理 {removed} 个遗留的临时任务目录")
+        return removed
+
+    def used_bytes(self):
+        return _dir_size(self.root)
+
+    def has_room(self, expected_bytes):
+        """检查临时工作区是否能容纳预计大小的文件（大小未知时只检查预算是否已经用完）"""
+        expected_bytes = expected_bytes or 0
+        free = shutil.disk_usage(self.root).free
+        if expected_bytes > free:
+            return False
+        if self.budget_bytes is not None and self.used_bytes() + expected_bytes >= self.budget_bytes:
+            return False
+        return True
+
+    def create_job(self):
+        """创建一个新的任务目录"""
+        job_dir = self.root / f"job-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        job_dir.mkdir()
+        (job_dir / OWNER_FILE).write_text(f"{platform.node()} {os.getpid()} {' '.join(sys.argv)}\n", encoding="utf-8")
+        return ScratchJob(job_dir)
+
+
+_default_area = None
+_default_area_loaded = False
+
+
+def get_scratch_area(config=None):
+    """获取进程内共享的临时工作区（第一次获取时清理一次遗留目录），未配置时返回None"""
+    global _default_area, _default_area_loaded
+    if not _default_area_loaded:
+        _default_area = ScratchArea.from_config(config)
+        _default_area_loaded = True
+        if _default_area:
+            _default_area.cleanup_orphans()
+    return _default_area
+
+
+def input_size(cmd):
+    """估算命令的输出大小：所有 -i 输入文件的大小之和（无法读取时返回None）"""
+    total = 0
+    for i, arg in enumerate(cmd[:-1]):
+        if arg == "-i":
+            try:
+                total += os.path.getsize(cmd[i + 1])
+            except OSError:
+                pass
+    return total or None
+
+
+@contextlib.contextmanager
+def staged_output(final_path, config=None, expected_bytes=None):
+    """为ffmpeg等工具的输出文件提供临时路径，成功后原子发布到最终位置
+
+    配置了临时工作区且空间足够时写入临时工作区，否则写入目标目录中的隐藏临时文件。
+    出错时删除未完成的临时文件。
+
+    用法:
+        with staged_output(output_file, config) as staged:
+            subprocess.run([... , staged], check=True)
+
+    Args:
+        final_path: 最终输出文件路径
+        config: 配置字典（None时读取config.cfg）
+        expected_bytes: 预计输出大小（用于检查空间预算）
+    """
+    final_path = Path(final_path)
+    area = get_scratch_area(config)
+    job = None
+    if area and area.has_room(expected_bytes):
+        job = area.create_job()
+        staged = job.staged_path(final_path)
+    else:
+        if area:
+            print("警告: 临时工作区空间不足，直接写入目标目录")
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        staged = final_path.parent / f".{final_path.stem}.staging-{os.getpid()}{final_path.suffix}"
+
+    try:
+        yield str(staged)
+        publish_file(staged, final_path)
+    finally:
+        with contextlib.suppress(OSError):
+            if staged.exists():
+                staged.unlink()
+        if job:
+            job.cleanup()
+
+
+def main():
+    """主函数：显示临时工作区状态并清理遗留目录"""
+    area = ScratchArea.from_config()
+    if not area:
+        print("未配置临时工作区（config.cfg 中的 scratchDir）")
+        sys.exit(1)
+    area.cleanup_orphans()
+    used = area.used_bytes() / (1024 ** 3)
+    free = shutil.disk_usage(area.root).free / (1024 ** 3)
+    print(f"临时工作区: {area.root}")
+    print(f"已使用: {used:.2f} GB，剩余空间: {free:.2f} GB")
+    if area.budget_bytes:
+        print(f"空间预算: {area.budget_bytes / (1024 ** 3):.2f} GB")
+
+
+if __name__ == "__main__":
+    main()
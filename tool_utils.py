@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+公共工具函数
+供各个脚本共享的配置读取、ffmpeg查找等辅助函数
+支持 Windows 和 Linux 平台
+"""
+
+import json
+import os
+import platform
+import shutil
+from pathlib import Path
+
+
+def load_optional_config(config_path="config.cfg"):
+    """加载配置文件（可选）
+
+    与 download_video.load_config 不同，配置文件不存在或格式错误时不退出，
+    而是返回空字典，方便各个独立脚本按需读取配置。
+
+    Args:
+        config_path: 配置文件路径
+
+    Returns:
+        dict: 配置字典
+    """
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            content = f.read().rstrip()
+        # 移除末尾可能的逗号，修复JSON格式
+        if content.endswith(',}'):
+            content = content[:-2] + '}'
+        elif content.endswith(',\n}'):
+            content = content[:-3] + '\n}'
+        return json.loads(content)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as e:
+        print(f"警告: 配置文件格式不正确，忽略配置: {e}")
+        return {}
+
+
+def get_download_dir(config=None):
+    """获取下载目录（不存在时创建）
+
+    Args:
+        config: 配置字典，可包含 downloadDir 字段
+
+    Returns:
+        Path: 下载目录的绝对路径
+    """
+    if config and config.get("downloadDir"):
+        download_dir = Path(config["downloadDir"])
+        if not download_dir.is_absolute():
+            download_dir = Path.cwd() / download_dir
+        try:
+            download_dir.mkdir(parents=True, exist_ok=True)
+            if os.access(download_dir, os.W_OK):
+                return download_dir.absolute()
+        except OSError as e:
+            print(f"警告: 配置的下载目录无效 '{config['downloadDir']}': {e}")
+    download_dir = Path("download")
+    download_dir.mkdir(exist_ok=True)
+    return download_dir.absolute()
+
+
+def get_state_dir(root):
+    """获取工具状态目录（缓存、索引等），位于 <root>/.imaudiotools
+
+    Args:
+        root: 库根目录
+
+    Returns:
+        Path: 状态目录路径
+    """
+    state_dir = Path(root) / ".imaudiotools"
+    state_dir.mkdir(parents=True, exist_ok=True)
+    return state_dir
+
+
+def find_ffmpeg_path():
+    """查找ffmpeg路径"""
+    is_windows = platform.system() == "Windows"
+    exe_ext = ".exe" if is_windows else ""
+
+    # 首先检查系统 PATH 中是否有 ffmpeg
+    ffmpeg_cmd = shutil.which("ffmpeg")
+    ffprobe_cmd = shutil.which("ffprobe")
+    if ffmpeg_cmd and ffprobe_cmd:
+        return os.path.dirname(ffmpeg_cmd)
+
+    # 常见的ffmpeg路径位置
+    possible_paths = [
+        Path("ffmpeg/bin"),  # 当前目录下的ffmpeg/bin
+        Path("ffmpeg"),      # 当前目录下的ffmpeg
+        Path("bin"),         # 当前目录下的bin
+    ]
+    for path in possible_paths:
+        ffmpeg_exe = path / f"ffmpeg{exe_ext}"
+        ffprobe_exe = path / f"ffprobe{exe_ext}"
+        if ffmpeg_exe.exists() and ffprobe_exe.exists():
+            return str(path.absolute())
+
+    return None
+
+
+def get_tool_exe(ffmpeg_path, name="ffmpeg"):
+    """获取 ffmpeg/ffprobe 可执行文件路径
+
+    Args:
+        ffmpeg_path: ffmpeg所在目录（或可执行文件本身），None时自动查找
+        name: 工具名称，"ffmpeg" 或 "ffprobe"
+
+    Returns:
+        str: 可执行文件路径，找不到时返回None
+    """
+    is_windows = platform.system() == "Windows"
+    exe_ext = ".exe" if is_windows else ""
+
+    if not ffmpeg_path:
+        ffmpeg_path = find_ffmpeg_path()
+
+    if ffmpeg_path:
+        exe_path = Path(ffmpeg_path) / f"{name}{exe_ext}"
+        if exe_path.exists():
+            return str(exe_path.absolute())
+        # ffmpeg_path 本身可能是可执行文件的路径
+        if os.path.isfile(ffmpeg_path):
+            sibling = Path(ffmpeg_path).parent / f"{name}{exe_ext}"
+            if sibling.exists():
+                return str(sibling.absolute())
+
+    return shutil.which(name)
+
+
+def find_cover_4_3(media_file):
+    """查找媒体文件旁由 convert_16_9_to_4_3 生成的4:3封面（<文件名>_4_3.jpg）
+
+    Returns:
+        Path: 封面路径，不存在时返回None
+    """
+    media_file = Path(media_file)
+    cover = media_file.parent / f"{media_file.stem}_4_3.jpg"
+    return cover if cover.exists() else None
+
+
+def cover_art_args(input_index, stream_index=0):
+    """把第 input_index 个输入的图片作为封面写入输出的ffmpeg参数
+
+    图片直接复制（不重新编码），设置 attached_pic 后，FLAC 写入 PICTURE 块，MP4 写入 covr。
+
+    Args:
+        input_index: 封面图片在命令中的输入序号
+        stream_index: 封面在输出文件的视频流中的序号（MP4中视频本身占第0路时为1）
+    """
+    return ["-map", f"{input_index}:v:0", f"-c:v:{stream_index}", "copy",
+            f"-disposition:v:{stream_index}", "attached_pic",
+            f"-metadata:s:v:{stream_index}", "comment=Cover (front)"]
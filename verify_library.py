@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+媒体库完整性校验脚本
+- FLAC: 解码音频并与 STREAMINFO 中记录的MD5比对，发现损坏的文件
+- MP4/MOV: 检查容器的box结构（ftyp/moov/mdat是否齐全、是否被截断）
+- WAV: 检查RIFF块结构（fmt/data是否齐全、是否被截断），其他格式跳过
+- 可选：将 compress_wav_to_flac 的输出与同名源WAV逐采样比对，确认可以安全删除WAV
+
+使用进程池并行校验，校验结果按 (inode, 大小, 修改时间) 缓存，重新运行时只校验变化的文件，
+并输出JSON格式的报告。
+支持 Windows 和 Linux 平台
+"""
+
+import collections
+import hashlib
+import json
+import os
+import struct
+import subprocess
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from tool_utils import get_download_dir, get_state_dir, get_tool_exe, load_optional_config
+
+
+FLAC_EXTENSIONS = {'.flac'}
+MP4_EXTENSIONS = {'.mp4', '.mov', '.m4a'}
+WAV_EXTENSIONS = {'.wav'}
+CACHE_FILE_NAME = "verify_cache.json"
+# 解码出错时保留的ffmpeg错误信息行数
+ERROR_TAIL_LINES = 20
+
+# 解码输出的PCM格式（与FLAC的位深度对应，FLAC的MD5按该格式的小端字节计算）
+PCM_FORMATS = {
+    8: ("s8", "pcm_s8"),
+    16: ("s16le", "pcm_s16le"),
+    24: ("s24le", "pcm_s24le"),
+    32: ("s32le", "pcm_s32le"),
+}
+
+
+def read_flac_streaminfo(path):
+    """读取FLAC文件的STREAMINFO块
+
+    Returns:
+        dict: sample_rate、channels、bits_per_sample、total_samples、md5
+    """
+    with open(path, "rb") as f:
+        if f.read(4) != b"fLaC":
+            raise ValueError("不是有效的FLAC文件（缺少fLaC标记）")
+        header = f.read(4)
+        if len(header) < 4 or (header[0] & 0x7F) != 0:
+            raise ValueError("第一个元数据块不是STREAMINFO")
+        length = int.from_bytes(header[1:4], "big")
+        data = f.read(length)
+    if length < 34 or len(data) < 34:
+        raise ValueError("STREAMINFO块不完整")
+    # 字节10起：20位采样率、3位声道数-1、5位位深-1、36位总采样数
+    packed = int.from_bytes(data[10:18], "big")
+    return {
+        "sample_rate": packed >> 44,
+        "channels": ((packed >> 41) & 0x7) + 1,
+        "bits_per_sample": ((packed >> 36) & 0x1F) + 1,
+        "total_samples": packed & 0xFFFFFFFFF,
+        "md5": data[18:34].hex(),
+    }
+
+
+def decode_pcm_md5(ffmpeg_exe, path, bits_per_sample):
+    """用ffmpeg解码音频为PCM流并计算MD5（流式读取，内存占用恒定）
+
+    Returns:
+        tuple: (md5十六进制字符串, 字节数)
+    """
+    fmt, codec = PCM_FORMATS[bits_per_sample]
+    cmd = [ffmpeg_exe, "-v", "error", "-nostdin", "-i", str(path),
+           "-map", "0:a:0", "-c:a", codec, "-f", fmt, "-"]
+    md5 = hashlib.md5()
+    total = 0
+    errors = collections.deque(maxlen=ERROR_TAIL_LINES)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    # 损坏的文件可能输出大量错误信息，stderr 在后台线程中读取，避免管道写满后ffmpeg阻塞
+    def read_stderr():
+        for line in proc.stderr:
+            line = line.decode("utf-8", "replace").strip()
+            if line:
+                errors.append(line)
+
+    reader = threading.Thread(target=read_stderr, daemon=True)
+    reader.start()
+    try:
+        while True:
+            chunk = proc.stdout.read(4 * 1024 * 1024)
+            if not chunk:
+                break
+            md5.update(chunk)
+            total += len(chunk)
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+        reader.join()
+    message = "\n".join(errors)
+    if returncode != 0 or message:
+        raise RuntimeError(f"解码出错: {message or returncode}")
+    return md5.hexdigest(), total
+
+
+def verify_flac(path, ffmpeg_exe, compare_wav=False):
+    """校验FLAC文件"""
+    info = read_flac_streaminfo(path)
+    result = {"type": "flac", "status": "ok", "details": {
+        "sample_rate": info["sample_rate"],
+        "channels": info["channels"],
+        "bits_per_sample": info["bits_per_sample"],
+    }}
+    bps = info["bits_per_sample"]
+    if bps not in PCM_FORMATS:
+        result.update(status="warning", message=f"不支持的位深度: {bps}")
+        return result
+
+    decoded_md5, decoded_bytes = decode_pcm_md5(ffmpeg_exe, path, bps)
+    frame_bytes = info["channels"] * ((bps + 7) // 8)
+    decoded_samples = decoded_bytes // frame_bytes
+    if info["total_samples"] and decoded_samples != info["total_samples"]:
+        result.update(status="error",
+                      message=f"采样数不符: 头部 {info['total_samples']}，解码 {decoded_samples}（文件可能被截断）")
+        return result
+    if info["md5"] == "0" * 32:
+        result.update(status="warning", message="STREAMINFO中没有记录MD5，只校验了解码")
+    elif decoded_md5 != info["md5"]:
+        result.update(status="error", message="音频MD5与STREAMINFO不符（文件已损坏）")
+        return result
+
+    if compare_wav:
+        wav_path = path.with_suffix(".wav")
+        if wav_path.exists():
+            # 记录比对的是哪个WAV，缓存复用和删除前都要确认WAV没有被替换
+            wav_key = _file_key(wav_path.stat())
+            wav_md5, wav_bytes = decode_pcm_md5(ffmpeg_exe, wav_path, bps)
+            identical = wav_md5 == decoded_md5 and wav_bytes == decoded_bytes
+            if identical and _file_key(wav_path.stat()) != wav_key:
+                identical = False
+                result.update(status="error", message="比对期间源WAV被修改")
+            elif not identical:
+                result.update(status="error", message="与源WAV的音频数据不一致")
+            result["details"]["source_wav"] = str(wav_path)
+            result["details"]["source_wav_key"] = wav_key
+            result["details"]["wav_identical"] = identical
+    return result
+
+
+def _iter_boxes(f, start, end):
+    """遍历 [start, end) 范围内的MP4 box，返回 (类型, 起始偏移, 大小)"""
+    offset = start
+    while offset < end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError(f"偏移 {offset} 处的box头不完整（文件被截断）")
+        size, box_type = struct.unpack(">I4s", header)
+        if size == 1:
+            large = f.read(8)
+            if len(large) < 8:
+                raise ValueError(f"偏移 {offset} 处的box头不完整（文件被截断）")
+            size = struct.unpack(">Q", large)[0]
+        elif size == 0:
+            size = end - offset
+        if size < 8:
+            raise ValueError(f"偏移 {offset} 处的box大小无效: {size}")
+        try:
+            name = box_type.decode("ascii")
+        except UnicodeDecodeError:
+            raise ValueError(f"偏移 {offset} 处的box类型无效")
+        yield name, offset, size
+        offset += size
+
+
+def verify_mp4(path):
+    """检查MP4/MOV容器结构"""
+    file_size = path.stat().st_size
+    result = {"type": "mp4", "status": "ok", "details": {}}
+    boxes = []
+    with open(path, "rb") as f:
+        for name, offset, size in _iter_boxes(f, 0, file_size):
+            boxes.append(name)
+            if offset + size > file_size:
+                result.update(status="error",
+                              message=f"box '{name}' 超出文件末尾 {offset + size - file_size} 字节（文件被截断）")
+                result["details"]["boxes"] = boxes
+                return result
+            if name == "moov":
+                children = [child for child, _, _ in _iter_boxes(f, offset + 8, offset + size)]
+                result["details"]["moov"] = children
+                if "mvhd" not in children or "trak" not in children:
+                    result.update(status="error", message="moov中缺少mvhd或trak")
+    result["details"]["boxes"] = boxes
+    if result["status"] != "ok":
+        return result
+    if boxes and boxes[0] != "ftyp":
+        # QuickTime旧文件可能没有ftyp
+        result.update(status="warning", message=f"第一个box不是ftyp而是 '{boxes[0]}'")
+    if "moov" not in boxes:
+        result.update(status="error", message="缺少moov（文件未正常写完）")
+    elif "mdat" not in boxes and "moof" not in boxes:
+        result.update(status="error", message="缺少mdat（没有媒体数据）")
+    return result
+
+
+def verify_wav(path):
+    """检查WAV文件的RIFF块结构"""
+    file_size = path.stat().st_size
+    result = {"type": "wav", "status": "ok", "details": {}}
+    chunks = []
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[8:12] != b"WAVE" or header[:4] not in (b"RIFF", b"RF64"):
+            raise ValueError("不是有效的WAV文件（缺少RIFF/WAVE标记）")
+        riff_size = struct.unpack("<I", header[4:8])[0]
+        # RF64（超过4GB）和写入管道时的WAV中，头部大小不是实际大小
+        sizes_known = header[:4] == b"RIFF" and riff_size not in (0, 0xFFFFFFFF)
+        if sizes_known and riff_size + 8 > file_size:
+            result.update(status="error",
+                          message=f"RIFF头记录的大小超出文件末尾 {riff_size + 8 - file_size} 字节（文件被截断）")
+            return result
+        end = riff_size + 8 if sizes_known else file_size
+        offset = 12
+        while offset + 8 <= end:
+            f.seek(offset)
+            chunk_id, size = struct.unpack("<4sI", f.read(8))
+            name = chunk_id.decode("ascii", "replace")
+            chunks.append(name)
+            if name == "data" and not sizes_known:
+                break
+            if offset + 8 + size > end:
+                result.update(status="error", message=f"块 '{name}' 超出文件末尾（文件被截断）")
+                break
+            offset += 8 + size + (size & 1)
+    result["details"]["chunks"] = chunks
+    if result["status"] == "ok" and ("fmt " not in chunks or "data" not in chunks):
+        result.update(status="error", message="缺少fmt或data块")
+    return result
+
+
+def verify_file(path, ffmpeg_exe, compare_wav=False):
+    """校验单个文件（在进程池中运行），不支持的格式返回 skipped 状态"""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    try:
+        if suffix in FLAC_EXTENSIONS:
+            result = verify_flac(path, ffmpeg_exe, compare_wav)
+        elif suffix in MP4_EXTENSIONS:
+            result = verify_mp4(path)
+        elif suffix in WAV_EXTENSIONS:
+            result = verify_wav(path)
+        else:
+            result = {"type": suffix.lstrip("."), "status": "skipped", "message": "不支持校验该格式"}
+    except Exception as e:
+        result = {"type": path.suffix.lower().lstrip("."), "status": "error", "message": str(e)}
+    result["path"] = str(path)
+    return result
+
+
+def _file_key(st):
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+def _cached_result_valid(entry, path, st, compare_wav):
+    """缓存的校验结果是否仍然有效
+
+    开启WAV比对时，之前没比对过的结果不能复用；比对过的结果只有在同名WAV没有被替换时才能复用。
+    """
+    if not entry or entry.get("key") != _file_key(st):
+        return False
+    if not compare_wav or path.suffix.lower() not in FLAC_EXTENSIONS:
+        return True
+    try:
+        wav_st = path.with_suffix(".wav").stat()
+    except OSError:
+        return True
+    return entry["result"].get("details", {}).get("source_wav_key") == _file_key(wav_st)
+
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_cache(cache_path, cache):
+    tmp = Path(str(cache_path) + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp, cache_path)
+
+
+def scan_files(root):
+    """扫描需要校验的文件，返回 [(Path, stat)]"""
+    files = []
+    extensions = FLAC_EXTENSIONS | MP4_EXTENSIONS
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for name in filenames:
+            if name.startswith('.'):
+                continue
+            path = Path(dirpath) / name
+            if path.suffix.lower() in extensions:
+                try:
+                    files.append((path, path.stat()))
+                except OSError:
+                    continue
+    return files
+
+
+def verify_library(root, ffmpeg_path=None, compare_wav=False, recheck=False, workers=None):
+    """并行校验整个库
+
+    Args:
+        root: 库根目录
+        ffmpeg_path: ffmpeg路径
+        compare_wav: 是否与同名源WAV逐采样比对
+        recheck: 忽略缓存，重新校验所有文件
+        workers: 进程数
+
+    Returns:
+        dict: 校验报告
+    """
+    ffmpeg_exe = get_tool_exe(ffmpeg_path, "ffmpeg")
+    if not ffmpeg_exe:
+        print("警告: 未找到ffmpeg，FLAC文件将无法校验", file=sys.stderr)
+
+    cache_path = get_state_dir(root) / CACHE_FILE_NAME
+    cache = {} if recheck else load_cache(cache_path)
+
+    files = scan_files(root)
+    results = []
+    todo = []
+    for path, st in files:
+        entry = cache.get(str(path))
+        if _cached_result_valid(entry, path, st, compare_wav):
+            results.append(dict(entry["result"], cached=True))
+        else:
+            todo.append((path, st))
+
+    print(f"共 {len(files)} 个文件，需要校验 {len(todo)} 个，缓存命中 {len(results)} 个", file=sys.stderr)
+
+    new_cache = {}
+    for result in results:
+        new_cache[result["path"]] = cache[result["path"]]
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(path, st, pool.submit(verify_file, str(path), ffmpeg_exe, compare_wav))
+                       for path, st in todo]
+            for i, (path, st, future) in enumerate(futures, 1):
+                result = future.result()
+                results.append(result)
+                print(f"[{i}/{len(todo)}] {result['status']}: {path.name}", file=sys.stderr)
+                # 只缓存确定的结果；解码器缺失等环境问题下次重新校验
+                if ffmpeg_exe or path.suffix.lower() not in FLAC_EXTENSIONS:
+                    new_cache[str(path)] = {"key": _file_key(st), "result": result}
+
+    save_cache(cache_path, new_cache)
+
+    summary = {"ok": 0, "warning": 0, "error": 0, "skipped": 0}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    return {
+        "root": str(root),
+        "total": len(results),
+        "checked": len(todo),
+        "summary": summary,
+        "results": sorted(results, key=lambda r: r["path"]),
+    }
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    if args and args[0] in ("-h", "--help"):
+        print("使用方法: python verify_library.py [库目录] [--compare-wav] [--delete-verified-wav] [--recheck] [--report 文件]")
+        print("示例: python verify_library.py")
+        print("示例: python verify_library.py download --compare-wav --report report.json")
+        print("\n参数说明:")
+        print("  库目录                要校验的目录（默认使用配置中的 downloadDir）")
+        print("  --compare-wav         将FLAC与同名源WAV逐采样比对")
+        print("  --delete-verified-wav 比对完全一致后删除源WAV（需要同时指定 --compare-wav）")
+        print("  --recheck             忽略缓存，重新校验所有文件")
+        print("  --report 文件         将JSON报告写入文件（默认输出到标准输出）")
+        sys.exit(0)
+
+    compare_wav = "--compare-wav" in args
+    delete_wav = "--delete-verified-wav" in args
+    recheck = "--recheck" in args
+    report_path = None
+    if "--report" in args:
+        index = args.index("--report")
+        if index + 1 >= len(args):
+            print("错误: --report 需要指定文件路径")
+            sys.exit(1)
+        report_path = args[index + 1]
+        del args[index:index + 2]
+    dirs = [a for a in args if not a.startswith("--")]
+
+    if delete_wav and not compare_wav:
+        print("错误: --delete-verified-wav 需要同时指定 --compare-wav")
+        sys.exit(1)
+
+    config = load_optional_config()
+    root = Path(dirs[0]).absolute() if dirs else get_download_dir(config)
+    if not root.is_dir():
+        print(f"错误: 目录不存在: {root}")
+        sys.exit(1)
+
+    report = verify_library(root, compare_wav=compare_wav, recheck=recheck)
+
+    if delete_wav:
+        for result in report["results"]:
+            details = result.get("details", {})
+            if result["status"] == "ok" and details.get("wav_identical"):
+                wav_path = Path(details["source_wav"])
+                try:
+                    wav_key = _file_key(wav_path.stat())
+                except OSError:
+                    continue
+                # 只删除比对过的那个WAV（比对之后被替换的WAV保留）
+                if wav_key != details.get("source_wav_key"):
+                    print(f"源WAV在比对后已变化，未删除: {wav_path}", file=sys.stderr)
+                    continue
+                wav_path.unlink()
+                print(f"已删除校验一致的源WAV: {wav_path}", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"报告已保存: {report_path}", file=sys.stderr)
+    else:
+        print(text)
+
+    summary = report["summary"]
+    print(f"\n校验完成: 正常 {summary['ok']}，警告 {summary['warning']}，错误 {summary['error']}，"
+          f"跳过 {summary['skipped']}", file=sys.stderr)
+    sys.exit(1 if summary["error"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+监视文件夹自动处理脚本
+监视配置的目录，新的WAV、封面图片和视频文件完整写入后自动排队处理：
+- WAV  -> 压缩为FLAC（compress_wav_to_flac）
+- 封面 -> 转换为4:3比例（convert_16_9_to_4_3）
+- 视频 -> 提取无损音频（download_video.extract_audio_from_video）
+Linux 上使用 inotify（IN_CLOSE_WRITE / IN_MOVED_TO），其他平台或 inotify 不可用时回退到轮询
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import queue
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from output_stamps import is_up_to_date, stamp_outputs
+from resource_governor import get_governor
+from scratch_staging import input_size, staged_output
+from tool_utils import find_ffmpeg_path, get_download_dir, load_optional_config
+
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+WAV_EXTENSIONS = {'.wav'}
+COVER_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.webm', '.mov'}
+# 下载/转换过程中的临时文件后缀，不处理
+TEMP_SUFFIXES = {'.part', '.ytdl', '.temp', '.tmp'}
+
+
+def classify_file(path):
+    """判断文件需要的处理类型
+
+    Args:
+        path: 文件路径（Path对象）
+
+    Returns:
+        str: "wav"、"cover"、"video"，不需要处理时返回None
+    """
+    name = path.name
+    if name.startswith('.'):
+        return None
+    suffix = path.suffix.lower()
+    if suffix in TEMP_SUFFIXES or any(s.lower() in TEMP_SUFFIXES for s in path.suffixes):
+        return None
+    if suffix in WAV_EXTENSIONS:
+        return "wav"
+    if suffix in COVER_EXTENSIONS:
+        # 排除已经转换过的封面
+        if path.stem.endswith('_4_3'):
+            return None
+        return "cover"
+    if suffix in VIDEO_EXTENSIONS:
+        # 排除 convert_video 的输出和 convert_16_9_to_4_3 生成的4:3视频
+        if path.stem.endswith(('_editing', '_4_3')):
+            return None
+        return "video"
+    return None
+
+
+class InotifyWatcher:
+    """基于 Linux inotify 的目录监视器
+
+    只在启动时（以及新建子目录、事件队列溢出时）遍历目录建立监视，
+    之后完全依赖内核事件，不会在每次事件时重新扫描整个目录树。
+    """
+
+    def __init__(self, roots):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self._wd_to_dir = {}
+        self._roots = [Path(r) for r in roots]
+        self._buffer = b""
+
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        os.close(self._fd)
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(directory)), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify 监视数量达到上限（fs.inotify.max_user_watches）")
+            print(f"警告: 无法监视目录 {directory}: {os.strerror(err)}")
+            return
+        self._wd_to_dir[wd] = Path(directory)
+
+    def add_tree(self, root):
+        """为目录及其所有子目录添加监视，返回其中已存在的文件"""
+        existing = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            # 跳过隐藏目录（如 .imaudiotools 状态目录）
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            self._add_watch(dirpath)
+            existing.extend(Path(dirpath) / f for f in filenames)
+        return existing
+
+    def start(self):
+        """建立初始监视，返回启动时已存在的文件"""
+        existing = []
+        for root in self._roots:
+            existing.extend(self.add_tree(root))
+        return existing
+
+    def read_events(self):
+        """读取一批事件
+
+        Returns:
+            list: [(事件类型, Path)]，事件类型为 "ready"（文件写入完成）或 "rescan"
+        """
+        results = []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return results
+        data = self._buffer + data
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            end = offset + _EVENT_HEADER.size + name_len
+            if end > len(data):
+                break
+            raw_name = data[offset + _EVENT_HEADER.size:end].rstrip(b"\0")
+            offset = end
+
+            if mask & IN_Q_OVERFLOW:
+                # 内核事件队列溢出，只能重新扫描一次
+                results.append(("rescan", None))
+                continue
+            if mask & IN_IGNORED:
+                self._wd_to_dir.pop(wd, None)
+                continue
+            directory = self._wd_to_dir.get(wd)
+            if directory is None or not raw_name:
+                continue
+            path = directory / os.fsdecode(raw_name)
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not path.name.startswith('.'):
+                    # 新目录：只扫描这个新目录（监视建立前可能已经写入了文件）
+                    for existing in self.add_tree(path):
+                        results.append(("ready", existing))
+                continue
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                results.append(("ready", path))
+        self._buffer = data[offset:]
+        return results
+
+
+class PollingWatcher:
+    """轮询方式的目录监视器（inotify不可用时的回退方案）
+
+    每次轮询只对目录做 stat，目录修改时间变化时才重新列出该目录；
+    新文件需要连续两次轮询大小和修改时间不变才认为已写入完成。
+    """
+
+    def __init__(self, roots, interval=10):
+        self._roots = [Path(r) for r in roots]
+        self.interval = interval
+        self._dir_mtimes = {}
+        self._known_files = set()
+        self._pending = {}
+
+    def start(self):
+        existing = []
+        for root in self._roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                try:
+                    self._dir_mtimes[Path(dirpath)] = os.stat(dirpath).st_mtime_ns
+                except OSError:
+                    continue
+                for f in filenames:
+                    path = Path(dirpath) / f
+                    self._known_files.add(path)
+                    existing.append(path)
+        return existing
+
+    def poll(self):
+        """执行一次轮询，返回写入完成的文件列表"""
+        ready = []
+        for directory, old_mtime in list(self._dir_mtimes.items()):
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                # 目录已被删除
+                del self._dir_mtimes[directory]
+                continue
+            if mtime == old_mtime:
+                continue
+            self._dir_mtimes[directory] = mtime
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                path = Path(entry.path)
+                if entry.is_dir(follow_symlinks=False):
+                    if path not in self._dir_mtimes:
+                        # 新目录：下一轮会列出其内容
+                        self._dir_mtimes[path] = 0
+                elif path not in self._known_files and path not in self._pending:
+                    self._pending[path] = None
+
+        # 检查待定文件的大小是否已稳定
+        for path, last in list(self._pending.items()):
+            try:
+                st = path.stat()
+            except OSError:
+                del self._pending[path]
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current == last:
+                del self._pending[path]
+                self._known_files.add(path)
+                ready.append(path)
+            else:
+                self._pending[path] = current
+        return ready
+
+
+class Debouncer:
+    """事件防抖：同一文件在静默期内的多次事件只触发一次处理"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._deadlines = {}
+
+    def touch(self, path):
+        self._deadlines[path] = time.monotonic() + self.delay
+
+    def next_timeout(self, default):
+        if not self._deadlines:
+            return default
+        return max(0.0, min(min(self._deadlines.values()) - time.monotonic(), default))
+
+    def pop_due(self):
+        now = time.monotonic()
+        due = [p for p, d in self._deadlines.items() if d <= now]
+        for p in due:
+            del self._deadlines[p]
+        return due
+
+
+def is_size_stable(path, wait=1.0):
+    """检查文件大小在短时间内是否保持不变（防止仍在写入的文件被处理）"""
+    try:
+        first = path.stat()
+        time.sleep(wait)
+        second = path.stat()
+    except OSError:
+        return False
+    return (first.st_size, first.st_mtime_ns) == (second.st_size, second.st_mtime_ns) and second.st_size > 0
+
+
+def process_wav(path, config, ffmpeg_path):
+    """将新的WAV文件压缩为FLAC"""
+    from compress_wav_to_flac import compress_wav_to_flac
+    cmd, output_file = compress_wav_to_flac(str(path), ffmpeg_path, config.get("watchFlacCompressionLevel", 12))
+    if is_up_to_date([output_file], cmd):
+        print(f"FLAC文件已是最新，跳过: {Path(output_file).name}")
+        return True
+    with get_governor(config).acquire("cpu") as slot, staged_output(output_file, config, input_size(cmd)) as staged:
+        subprocess.run(slot.apply_to_ffmpeg(cmd[:-1] + [staged]), check=True)
+    stamp_outputs([output_file], cmd)
+    print(f"压缩完成: {output_file}")
+    return True
+
+
+def process_cover(path, config, ffmpeg_path):
+    """将新的封面图片转换为4:3比例"""
+    # 输出已是最新时 convert_16_9_to_4_3 会直接跳过
+    from convert_16_9_to_4_3 import convert_16_9_to_4_3
+    return convert_16_9_to_4_3(path) is not None
+
+
+def process_video(path, config, ffmpeg_path):
+    """从新的视频文件中提取音频"""
+    if config.get("watchVideoAction", "extract") != "extract":
+        return True
+    from download_video import extract_audio_from_video
+    return extract_audio_from_video(path, config, ffmpeg_path)
+
+
+PROCESSORS = {
+    "wav": process_wav,
+    "cover": process_cover,
+    "video": process_video,
+}
+
+
+def worker_loop(job_queue, config, ffmpeg_path):
+    """处理队列中的任务（单独线程，避免阻塞事件读取）"""
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        kind, path = job
+        print(f"\n[{kind}] 开始处理: {path}")
+        try:
+            ok = PROCESSORS[kind](path, config, ffmpeg_path)
+            print(f"[{kind}] {'处理完成' if ok else '处理失败'}: {path.name}")
+        except SystemExit:
+            # 原有脚本函数出错时会调用 sys.exit，这里不能让监视进程退出
+            print(f"[{kind}] 处理失败: {path.name}")
+        except Exception as e:
+            print(f"[{kind}] 处理时出错 {path.name}: {e}")
+        finally:
+            job_queue.task_done()
+
+
+def watch(roots, config, ffmpeg_path=None, use_polling=False, process_existing=False):
+    """监视目录并自动处理新文件
+
+    Args:
+        roots: 要监视的目录列表
+        config: 配置字典
+        ffmpeg_path: ffmpeg路径
+        use_polling: 强制使用轮询模式
+        process_existing: 启动时是否处理已存在的文件
+    """
+    debounce_seconds = float(config.get("watchDebounceSeconds", 5))
+    poll_interval = float(config.get("watchPollInterval", 10))
+
+    watcher = None
+    if not use_polling and sys.platform.startswith("linux"):
+        try:
+            watcher = InotifyWatcher(roots)
+            existing = watcher.start()
+            print("使用 inotify 监视目录")
+        except OSError as e:
+            print(f"警告: inotify 不可用（{e}），回退到轮询模式")
+            if watcher is not None:
+                watcher.close()
+            watcher = None
+    if watcher is None:
+        watcher = PollingWatcher(roots, poll_interval)
+        existing = watcher.start()
+        print(f"使用轮询模式监视目录（间隔 {poll_interval:.0f} 秒）")
+
+    for root in roots:
+        print(f"  监视: {root}")
+
+    debouncer = Debouncer(debounce_seconds)
+    if process_existing:
+        for path in existing:
+            if classify_file(path):
+                debouncer.touch(path)
+
+    job_queue = queue.Queue()
+    worker = threading.Thread(target=worker_loop, args=(job_queue, config, ffmpeg_path), daemon=True)
+    worker.start()
+    # 记录已入队的文件（路径、大小、修改时间），避免重复处理
+    queued = set()
+
+    try:
+        while True:
+            if isinstance(watcher, InotifyWatcher):
+                readable, _, _ = select.select([watcher], [], [], debouncer.next_timeout(60.0))
+                if readable:
+                    for event, path in watcher.read_events():
+                        if event == "rescan":
+                            print("警告: inotify 事件队列溢出，重新扫描目录")
+                            for root in roots:
+                                for p in watcher.add_tree(root):
+                                    if classify_file(p):
+                                        debouncer.touch(p)
+                        elif classify_file(path):
+                            debouncer.touch(path)
+            else:
+                time.sleep(debouncer.next_timeout(watcher.interval))
+                for path in watcher.poll():
+                    if classify_file(path):
+                        debouncer.touch(path)
+
+            for path in debouncer.pop_due():
+                if not path.exists():
+                    continue
+                if not is_size_stable(path):
+                    # 仍在写入，稍后再检查
+                    debouncer.touch(path)
+                    continue
+                st = path.stat()
+                key = (str(path), st.st_size, st.st_mtime_ns)
+                if key in queued:
+                    continue
+                queued.add(key)
+                kind = classify_file(path)
+                print(f"检测到新文件 [{kind}]: {path}")
+                job_queue.put((kind, path))
+    except KeyboardInterrupt:
+        print("\n正在停止监视...")
+    finally:
+        if isinstance(watcher, InotifyWatcher):
+            watcher.close()
+        job_queue.put(None)
+        worker.join()
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    if args and args[0] in ("-h", "--help"):
+        print("使用方法: python watch_folder.py [目录...] [--poll] [--existing]")
+        print("示例: python watch_folder.py")
+        print("示例: python watch_folder.py download --poll")
+        print("\n参数说明:")
+        print("  目录        要监视的目录（默认使用配置中的 watchDirs 或 downloadDir）")
+        print("  --poll      强制使用轮询模式（不使用 inotify）")
+        print("  --existing  启动时处理目录中已存在的文件")
+        sys.exit(0)
+
+    use_polling = "--poll" in args
+    process_existing = "--existing" in args
+    dirs = [a for a in args if not a.startswith("--")]
+
+    config = load_optional_config()
+    if not dirs:
+        dirs = config.get("watchDirs") or [str(get_download_dir(config))]
+
+    roots = []
+    for d in dirs:
+        path = Path(d).absolute()
+        if not path.is_dir():
+            print(f"警告: 目录不存在，跳过: {d}")
+            continue
+        roots.append(path)
+    if not roots:
+        print("错误: 没有可监视的目录")
+        sys.exit(1)
+
+    ffmpeg_path = find_ffmpeg_path()
+    if not ffmpeg_path:
+        print("警告: 未找到ffmpeg，WAV压缩和音频提取将无法进行")
+
+    watch(roots, config, ffmpeg_path, use_polling=use_polling, process_existing=process_existing)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+波形概览（峰值）缓存
+媒体库浏览器显示波形时不再每次解码完整的FLAC：本脚本一次流式解码，用NumPy向量化计算
+多个缩放级别的最小/最大峰值，保存为音频旁的 <文件名>.peaks 文件。每个完整的峰值块到达时
+立即逐级归约到较粗的级别，最细级别直接写入峰值文件、较粗的级别写入临时文件，
+内存占用恒定，与文件时长无关，可以处理数小时的录音。
+
+峰值文件格式（小端序）:
+    8字节魔数 b"IMPEAKS1"
+    4字节无符号整数：头部JSON长度（固定预留 HEADER_BYTES，JSON后用空格补齐）
+    头部JSON: {"sample_rate", "channels", "sample_format": "int16",
+               "levels": [{"samples_per_peak", "peaks", "offset"}]}
+    各缩放级别的数据：int16 数组，形状为 (peaks, channels, 2)，最后一维为 [最小值, 最大值]，
+    offset 为相对于数据区起始位置的字节偏移
+
+峰值文件带有处理记录（见 output_stamps），音频文件变化后自动重新生成。
+提取音频时配置 waveformOverview: true 会在同一次解码中生成，不需要额外解码。
+"""
+
+import contextlib
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from async_runner import run_process
+from output_stamps import is_up_to_date, stamp_outputs
+from tool_utils import get_tool_exe
+
+
+MAGIC = b"IMPEAKS1"
+# 头部JSON预留的字节数（最细级别边解码边写入，峰值数量要到结束时才知道）
+HEADER_BYTES = 4096
+# 各缩放级别每个峰值对应的采样数（每级是上一级的4倍）
+ZOOM_LEVELS = (256, 1024, 4096, 16384, 65536)
+# 概览统一为双声道、48kHz（单声道复制为两个声道）
+OVERVIEW_CHANNELS = 2
+OVERVIEW_SAMPLE_RATE = 48000
+# 每次从管道读取的字节数
+READ_CHUNK_BYTES = 1024 * 1024
+# 处理记录中的“命令”（参数变化时重新生成）
+OVERVIEW_RECIPE = ["waveform_overview", "levels=" + ",".join(map(str, ZOOM_LEVELS)),
+                   f"channels={OVERVIEW_CHANNELS}", f"rate={OVERVIEW_SAMPLE_RATE}", "format=int16"]
+
+AUDIO_EXTENSIONS = {'.flac', '.wav'}
+
+
+def overview_path(audio_file):
+    audio_file = Path(audio_file)
+    return audio_file.parent / f"{audio_file.stem}.peaks"
+
+
+def peaks_output_args():
+    """添加到ffmpeg命令末尾的第二个输出：把同一次解码的音频以 s16le 输出到标准输出"""
+    return ["-map", "0:a:0", "-ac", str(OVERVIEW_CHANNELS), "-ar", str(OVERVIEW_SAMPLE_RATE),
+            "-c:a", "pcm_s16le", "-f", "s16le", "pipe:1"]
+
+
+class _Level:
+    """一个缩放级别：峰值写入文件，并把不足一组的峰值留给下一批"""
+
+    def __init__(self, samples_per_peak, factor, channels, file):
+        self.samples_per_peak = samples_per_peak
+        self.factor = factor
+        self.file = file
+        self.peaks = 0
+        self._pending = np.zeros((0, channels, 2), dtype=np.int16)
+
+    def write(self, peaks):
+        if len(peaks):
+            self.file.write(peaks.astype("<i2").tobytes())
+            self.peaks += len(peaks)
+
+    def group(self, finer, final=False):
+        """把较细级别的峰值归约为本级别的峰值（final 为True时末尾不足一组的也归约为一个峰值）"""
+        finer = np.concatenate([self._pending, finer]) if len(self._pending) else finer
+        count = len(finer) // self.factor
+        self._pending = finer[count * self.factor:]
+        grouped = finer[:count * self.factor].reshape(count, self.factor, *finer.shape[1:])
+        peaks = np.stack([grouped[..., 0].min(axis=1), grouped[..., 1].max(axis=1)], axis=-1)
+        if final and len(self._pending):
+            tail = self._pending
+            peaks = np.concatenate([peaks, np.stack([tail[..., 0].min(axis=0), tail[..., 1].max(axis=0)],
+                                                    axis=-1)[np.newaxis]])
+            self._pending = self._pending[:0]
+        return peaks
+
+
+class PeakAccumulator:
+    """流式计算各缩放级别的最小/最大峰值并写入峰值文件（内存占用恒定）
+
+    最细级别的每个完整块立即逐级归约到较粗的级别；最细级别直接写入峰值文件的临时文件，
+    较粗的级别写入各自的临时文件，finish() 时依次追加到峰值文件并写入头部。
+
+    Args:
+        path: 峰值文件路径
+        channels: 声道数
+    """
+
+    def __init__(self, path, channels=OVERVIEW_CHANNELS):
+        self.path = Path(path)
+        self.channels = channels
+        self.samples_per_peak = ZOOM_LEVELS[0]
+        self._tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        self._file = open(self._tmp, "wb")
+        self._file.write(b"\0" * (len(MAGIC) + 4 + HEADER_BYTES))
+        self._levels = [_Level(ZOOM_LEVELS[0], 1, channels, self._file)]
+        for finer, size in zip(ZOOM_LEVELS, ZOOM_LEVELS[1:]):
+            self._levels.append(_Level(size, size // finer, channels, tempfile.TemporaryFile()))
+        self._leftover = np.zeros((0, channels), dtype=np.int16)
+        self._pending = b""
+
+    def add(self, raw):
+        """处理一块 s16le 交错PCM数据"""
+        raw = self._pending + raw
+        frame_bytes = 2 * self.channels
+        usable = len(raw) - len(raw) % frame_bytes
+        self._pending = raw[usable:]
+        if not usable:
+            return
+        frames = np.frombuffer(raw[:usable], dtype="<i2").reshape(-1, self.channels)
+        if len(self._leftover):
+            frames = np.concatenate([self._leftover, frames])
+        count = len(frames) // self.samples_per_peak
+        self._leftover = frames[count * self.samples_per_peak:].copy()
+        if count:
+            blocks = frames[:count * self.samples_per_peak].reshape(count, self.samples_per_peak, self.channels)
+            self._cascade(np.stack([blocks.min(axis=1), blocks.max(axis=1)], axis=-1))
+
+    def _cascade(self, peaks, final=False):
+        self._levels[0].write(peaks)
+        for level in self._levels[1:]:
+            peaks = level.group(peaks, final)
+            level.write(peaks)
+
+    def finish(self, sample_rate=OVERVIEW_SAMPLE_RATE):
+        """结束输入，写入头部和较粗的级别，原子替换为峰值文件
+
+        Returns:
+            str: 峰值文件路径
+        """
+        tail = self._leftover
+        if len(tail):
+            peaks = np.stack([tail.min(axis=0), tail.max(axis=0)], axis=-1)[np.newaxis]
+        else:
+            peaks = np.zeros((0, self.channels, 2), dtype=np.int16)
+        self._cascade(peaks, final=True)
+
+        header = {"sample_rate": sample_rate, "channels": self.channels, "sample_format": "int16", "levels": []}
+        offset = 0
+        for level in self._levels:
+            header["levels"].append({"samples_per_peak": level.samples_per_peak, "peaks": level.peaks,
+                                     "offset": offset})
+            offset += level.peaks * self.channels * 2 * 2
+            if level.file is not self._file:
+                level.file.seek(0)
+                shutil.copyfileobj(level.file, self._file, READ_CHUNK_BYTES)
+                level.file.close()
+        header_bytes = json.dumps(header).encode("utf-8")
+        if len(header_bytes) > HEADER_BYTES:
+            raise ValueError("峰值文件头部超出预留大小")
+        self._file.seek(0)
+        self._file.write(MAGIC + struct.pack("<I", HEADER_BYTES) + header_bytes.ljust(HEADER_BYTES))
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        return str(self.path)
+
+    def discard(self):
+        """放弃未完成的峰值文件（finish() 之后调用没有影响）"""
+        for level in self._levels:
+            level.file.close()
+        with contextlib.suppress(OSError):
+            self._tmp.unlink()
+
+
+def read_overview(path, samples_per_peak=None):
+    """读取峰值文件中的一个缩放级别（只读取该级别的数据）
+
+    Args:
+        path: 峰值文件路径
+        samples_per_peak: 需要的缩放级别（选择不小于该值的最细级别，None时选择最细级别）
+
+    Returns:
+        tuple: (头部信息dict, int16数组 (peaks, channels, 2))
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"不是峰值文件: {path}")
+        (header_len,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_len))
+        data_start = len(MAGIC) + 4 + header_len
+        levels = header["levels"]
+        candidates = [lv for lv in levels if samples_per_peak is None or lv["samples_per_peak"] >= samples_per_peak]
+        level = candidates[0] if candidates else levels[-1]
+        f.seek(data_start + level["offset"])
+        count = level["peaks"] * header["channels"] * 2
+        data = np.fromfile(f, dtype="<i2", count=count).reshape(level["peaks"], header["channels"], 2)
+    return header, data
+
+
+def run_ffmpeg_with_peaks(cmd, accumulator, tail_lines=400, **kwargs):
+    """运行带 peaks_output_args() 输出的ffmpeg命令，边解码边计算峰值
+
+    通过 async_runner.run_process 运行（其余参数如 outputs、timeout、log_path 同 run_process）：
+    stdout 的PCM交给 accumulator，stderr 只保留最后若干行。
+
+    Returns:
+        ProcessResult: 运行结果（tail 只包含stderr）
+
+    Raises:
+        ProcessTimeout: 超时
+    """
+    return run_process(cmd, on_stdout=accumulator.add, tail_lines=tail_lines, **kwargs)
+
+
+def save_overview_for(audio_file, accumulator):
+    """完成提取音频时计算的峰值文件（音频旁的 overview_path()），并记录对应的音频文件"""
+    path = accumulator.finish()
+    stamp_outputs([path], OVERVIEW_RECIPE, inputs=[audio_file], tools={})
+    return path
+
+
+def overview_up_to_date(audio_file):
+    return is_up_to_date([overview_path(audio_file)], OVERVIEW_RECIPE, inputs=[audio_file], tools={})
+
+
+def generate_overview(audio_file, ffmpeg_path=None, force=False):
+    """为音频文件生成峰值文件（已是最新时跳过）
+
+    Returns:
+        str: 峰值文件路径
+
+    Raises:
+        RuntimeError: 找不到ffmpeg或解码失败
+    """
+    audio_file = Path(audio_file)
+    if not force and overview_up_to_date(audio_file):
+        return str(overview_path(audio_file))
+    ffmpeg_exe = get_tool_exe(ffmpeg_path, "ffmpeg")
+    if not ffmpeg_exe:
+        raise RuntimeError("未找到ffmpeg")
+    cmd = [ffmpeg_exe, "-v", "error", "-nostdin", "-i", str(audio_file)] + peaks_output_args()
+    accumulator = PeakAccumulator(overview_path(audio_file))
+    try:
+        result = run_ffmpeg_with_peaks(cmd, accumulator)
+        if result.returncode != 0:
+            raise RuntimeError(f"解码失败（返回码 {result.returncode}）: {'；'.join(result.tail[-3:])}")
+        return save_overview_for(audio_file, accumulator)
+    finally:
+        accumulator.discard()
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help"):
+        print("使用方法: python waveform_overview.py <音频文件或目录...> [--force]")
+        print("示例: python waveform_overview.py download")
+        print("为FLAC/WAV文件生成波形概览（<文件名>.peaks），已是最新的文件会跳过")
+        sys.exit(0 if args else 1)
+
+    force = "--force" in args
+    files = []
+    for arg in (a for a in args if not a.startswith("--")):
+        path = Path(arg)
+        if path.is_dir():
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                files.extend(Path(dirpath) / f for f in sorted(filenames)
+                             if Path(f).suffix.lower() in AUDIO_EXTENSIONS and not f.startswith('.'))
+        elif path.exists():
+            files.append(path)
+        else:
+            print(f"警告: 文件不存在: {arg}", file=sys.stderr)
+
+    generated = skipped = failed = 0
+    for audio_file in files:
+        if not force and overview_up_to_date(audio_file):
+            skipped += 1
+            continue
+        try:
+            generate_overview(audio_file, force=True)
+            generated += 1
+            print(f"[生成] {audio_file}")
+        except RuntimeError as e:
+            failed += 1
+            print(f"[错误] {audio_file}: {e}")
+    print(f"\n生成 {generated} 个，已是最新 {skipped} 个，失败 {failed} 个")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,530 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+共享目录任务队列
+多台机器都能访问存放 downloadDir 的NAS时，把任务（下载URL、压缩WAV、转换视频等）放入共享目录中的队列，
+每台机器运行若干个工作进程领取执行。
+
+队列目录结构（默认 <下载目录>/.imaudiotools/queue，可用 queueDir 指定）:
+    jobs/<任务ID>.json      待执行的任务：子命令和参数（下载目录中的文件保存为相对路径，各机器按自己的挂载点解析）
+    leases/<任务ID>.lease   租约：工作进程用 O_CREAT|O_EXCL 原子创建，内容包括工作进程、心跳时间和过期时间
+    results/<任务ID>.json   执行结果（状态、返回码、执行的机器、耗时），results/<任务ID>.log 为完整输出
+
+工作进程执行任务期间每隔 queueLeaseSeconds/4 更新一次心跳。机器崩溃或断网后租约过期，
+其他工作进程把过期的租约原子重命名（并确认移走的正是这个过期租约）后重新领取，任务不会丢失；同一个任务的租约过期超过
+queueMaxAttempts 次时记为失败，避免反复让工作进程崩溃的任务无限重试。
+过期时间按各机器的时钟判断，多台机器的时钟需要同步（NTP）。
+
+用法:
+    python work_queue.py submit download <视频URL>
+    python work_queue.py submit compress <WAV文件路径>
+    python work_queue.py worker [--workers 2] [--drain]
+    python work_queue.py status
+    python work_queue.py retry
+"""
+
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from tool_utils import get_download_dir, get_state_dir, load_optional_config
+
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_POLL_SECONDS = 10
+DEFAULT_MAX_ATTEMPTS = 3
+# 可以放入队列的子命令（与 main.py 的子命令相同）
+QUEUE_COMMANDS = ("download", "extract", "compress", "convert-video", "cover", "chapters", "peaks", "hires")
+# 结果中保留的输出行数
+RESULT_TAIL_LINES = 20
+
+
+def _write_json_atomic(path, data):
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _put_back(moved, path):
+    """把误移走的租约放回原处（原处已有更新的租约时不覆盖）"""
+    with contextlib.suppress(FileExistsError):
+        os.link(moved, path)
+    moved.unlink(missing_ok=True)
+
+
+def _terminate_tree(proc):
+    """结束任务进程及其所有子进程
+
+    任务进程在独立的进程组中运行，结束整个进程组；async_runner 启动的ffmpeg/yt-dlp
+    又在各自的进程组中，由 main.py 收到 SIGTERM 后调用 terminate_all() 结束。
+    """
+    if platform.system() == "Windows":
+        # taskkill /T 结束整个进程树
+        subprocess.run(["taskkill", "/T", "/F", "/PID", str(proc.pid)], capture_output=True)
+        return
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(proc.pid, signal.SIGTERM)
+
+
+class LeaseLost(Exception):
+    """租约已过期并被其他工作进程领取"""
+
+
+class WorkQueue:
+    """共享目录中的任务队列
+
+    Args:
+        queue_dir: 队列目录（位于各机器都能访问的共享存储上）
+        root: 任务中相对路径的根目录（下载目录）
+        lease_seconds: 租约的有效时间（秒）
+        max_attempts: 同一个任务的最大领取次数（租约过期后重新领取也计入）
+    """
+
+    def __init__(self, queue_dir, root, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.queue_dir = Path(queue_dir)
+        self.root = Path(root)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.jobs_dir = self.queue_dir / "jobs"
+        self.leases_dir = self.queue_dir / "leases"
+        self.results_dir = self.queue_dir / "results"
+        for directory in (self.jobs_dir, self.leases_dir, self.results_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config=None):
+        """根据配置创建队列
+
+        配置字段:
+            queueDir: 队列目录（默认 <下载目录>/.imaudiotools/queue）
+            queueLeaseSeconds: 租约有效时间（秒，默认120）
+            queueMaxAttempts: 同一个任务的最大领取次数（默认3）
+        """
+        if config is None:
+            config = load_optional_config()
+        root = get_download_dir(config)
+        queue_dir = config.get("queueDir") or get_state_dir(root) / "queue"
+        return cls(queue_dir, root,
+                   lease_seconds=config.get("queueLeaseSeconds", DEFAULT_LEASE_SECONDS),
+                   max_attempts=config.get("queueMaxAttempts", DEFAULT_MAX_ATTEMPTS))
+
+    # 提交
+
+    def _encode_arg(self, arg):
+        """下载目录中的文件保存为相对路径，其他参数原样保存"""
+        path = Path(arg)
+        if path.exists():
+            try:
+                return {"path": path.resolve().relative_to(self.root.resolve()).as_posix()}
+            except ValueError:
+                pass
+        return arg
+
+    def _decode_arg(self, arg):
+        return str(self.root / arg["path"]) if isinstance(arg, dict) else arg
+
+    def describe(self, job):
+        """任务的简短描述（子命令和参数）"""
+        return " ".join([job["command"]] + [self._decode_arg(arg) for arg in job["args"]])
+
+    def submit(self, command, args):
+        """提交一个任务
+
+        Args:
+            command: 子命令（见 QUEUE_COMMANDS）
+            args: 子命令的参数
+
+        Returns:
+            str: 任务ID
+        """
+        if command not in QUEUE_COMMANDS:
+            raise ValueError(f"不支持放入队列的子命令: {command}")
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        _write_json_atomic(self.jobs_dir / f"{job_id}.json", {
+            "id": job_id,
+            "command": command,
+            "args": [self._encode_arg(arg) for arg in args],
+            "submitted_at": time.time(),
+            "submitted_by": platform.node(),
+        })
+        return job_id
+
+    # 租约
+
+    def _lease_path(self, job_id):
+        return self.leases_dir / f"{job_id}.lease"
+
+    def _new_lease(self, worker, attempt):
+        now = time.time()
+        return {"worker": worker, "host": platform.node(), "pid": os.getpid(), "token": uuid.uuid4().hex,
+                "attempt": attempt, "claimed_at": now, "heartbeat": now, "expires": now + self.lease_seconds}
+
+    def _create_lease(self, job_id, lease):
+        """原子创建租约文件，已存在时返回False"""
+        try:
+            fd = os.open(self._lease_path(job_id), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(lease, f)
+        return True
+
+    def _take_over_expired(self, job_id):
+        """过期的租约重命名后由当前进程重新领取
+
+        多个进程可能同时读到同一个过期租约，其中一个进程重命名并创建新租约后，另一个进程的重命名
+        可能移走的是这个新租约。因此重命名后比较移走的租约的 token，与判断为过期的租约不同时放回原处。
+
+        Returns:
+            int: 过期租约的领取次数，租约未过期或已被其他进程处理时返回None
+        """
+        path = self._lease_path(job_id)
+        lease = _read_json(path)
+        # 正在创建中的租约文件内容可能为空，等待下一次检查
+        if lease is None or time.time() < lease.get("expires", 0):
+            return None
+        stale = path.with_name(f"{path.name}.expired-{uuid.uuid4().hex[:8]}")
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return None
+        expired = _read_json(stale)
+        if not expired or expired.get("token") != lease.get("token"):
+            # 移走的是其他进程刚领取的租约，放回原处
+            _put_back(stale, path)
+            return None
+        stale.unlink(missing_ok=True)
+        print(f"[队列] 任务 {job_id} 的租约已过期（{expired.get('host')} {expired.get('worker')}），重新领取")
+        return expired.get("attempt", 1)
+
+    def _held_by_heartbeat(self, job_id):
+        """租约是否正在更新心跳（heartbeat 把租约暂时移走时，租约文件不存在但任务仍被持有）
+
+        工作进程在更新心跳时崩溃会留下移走的租约，过期后删除。
+        """
+        for held in self.leases_dir.glob(f"{job_id}.lease.beat-*"):
+            lease = _read_json(held)
+            if lease and time.time() < lease.get("expires", 0):
+                return True
+            held.unlink(missing_ok=True)
+        return False
+
+    def heartbeat(self, job_id, lease):
+        """更新租约的心跳和过期时间
+
+        Raises:
+            LeaseLost: 租约已被其他工作进程领取
+        """
+        path = self._lease_path(job_id)
+        current = _read_json(path)
+        if not current or current.get("token") != lease["token"]:
+            raise LeaseLost(job_id)
+        # 读取和写入之间租约可能已过期并被其他进程领取，不能直接覆盖：
+        # 先把租约重命名移走，确认移走的是自己的租约后，再用不覆盖已有文件的 os.link 放入新的租约
+        held = path.with_name(f"{path.name}.beat-{uuid.uuid4().hex[:8]}")
+        try:
+            os.rename(path, held)
+        except FileNotFoundError:
+            raise LeaseLost(job_id) from None
+        moved = _read_json(held)
+        if not moved or moved.get("token") != lease["token"]:
+            _put_back(held, path)
+            raise LeaseLost(job_id)
+        lease["heartbeat"] = time.time()
+        lease["expires"] = lease["heartbeat"] + self.lease_seconds
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(lease, f)
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            # 租约被移走的瞬间其他进程领取了任务
+            raise LeaseLost(job_id) from None
+        finally:
+            tmp.unlink(missing_ok=True)
+            held.unlink(missing_ok=True)
+
+    def claim(self, worker):
+        """领取最早提交的一个可执行任务
+
+        Returns:
+            tuple: (任务, 租约)，没有可领取的任务时返回 (None, None)
+        """
+        for job_path in sorted(self.jobs_dir.glob("*.json")):
+            job_id = job_path.stem
+            if (self.results_dir / f"{job_id}.json").exists():
+                continue
+            attempt = 1
+            if self._lease_path(job_id).exists():
+                previous = self._take_over_expired(job_id)
+                if previous is None:
+                    continue
+                attempt = previous + 1
+            elif self._held_by_heartbeat(job_id):
+                continue
+            lease = self._new_lease(worker, attempt)
+            if not self._create_lease(job_id, lease):
+                continue
+            job = _read_json(job_path)
+            if job is None:
+                # 任务已被其他进程完成并删除
+                self._lease_path(job_id).unlink(missing_ok=True)
+                continue
+            if attempt > self.max_attempts:
+                self.record(job, lease, "failed", None, [f"租约已过期 {attempt - 1} 次，不再重试"], 0.0)
+                continue
+            return job, lease
+        return None, None
+
+    # 结果
+
+    def record(self, job, lease, status, returncode, tail, duration):
+        """记录任务结果，删除任务和租约"""
+        _write_json_atomic(self.results_dir / f"{job['id']}.json", {
+            "id": job["id"],
+            "command": job["command"],
+            "args": job["args"],
+            "status": status,
+            "returncode": returncode,
+            "host": lease["host"],
+            "worker": lease["worker"],
+            "attempt": lease["attempt"],
+            "started_at": lease["claimed_at"],
+            "finished_at": time.time(),
+            "duration": duration,
+            "output_tail": tail,
+        })
+        (self.jobs_dir / f"{job['id']}.json").unlink(missing_ok=True)
+        self._lease_path(job["id"]).unlink(missing_ok=True)
+
+    def status(self):
+        """队列状态
+
+        Returns:
+            dict: {"pending": [任务], "running": [(任务, 租约)], "results": [结果]}
+        """
+        pending, running = [], []
+        for job_path in sorted(self.jobs_dir.glob("*.json")):
+            job = _read_json(job_path)
+            if not job:
+                continue
+            lease = _read_json(self._lease_path(job["id"]))
+            if lease:
+                running.append((job, lease))
+            else:
+                pending.append(job)
+        results = [r for r in (_read_json(p) for p in sorted(self.results_dir.glob("*.json"))) if r]
+        return {"pending": pending, "running": running, "results": results}
+
+    def retry_failed(self):
+        """把失败的任务重新放回队列
+
+        Returns:
+            int: 重新放回的任务数
+        """
+        count = 0
+        for result_path in sorted(self.results_dir.glob("*.json")):
+            result = _read_json(result_path)
+            if not result or result.get("status") != "failed":
+                continue
+            _write_json_atomic(self.jobs_dir / result_path.name, {
+                "id": result["id"],
+                "command": result["command"],
+                "args": result["args"],
+                "submitted_at": time.time(),
+                "submitted_by": platform.node(),
+            })
+            result_path.unlink()
+            (self.results_dir / f"{result['id']}.log").unlink(missing_ok=True)
+            count += 1
+        return count
+
+    # 执行
+
+    def run_job(self, job, lease):
+        """执行任务（子命令在新的进程中运行），执行期间在后台线程中更新心跳
+
+        Returns:
+            str: "done"、"failed"，租约丢失时为 "lost"（不记录结果，由领取它的工作进程负责）
+        """
+        command = [sys.executable, str(Path(__file__).with_name("main.py")), job["command"]]
+        command += [self._decode_arg(arg) for arg in job["args"]]
+        log_path = self.results_dir / f"{job['id']}.log"
+        stop = threading.Event()
+        lost = threading.Event()
+        start = time.monotonic()
+
+        with open(log_path, "w", encoding="utf-8", errors="replace") as log:
+            log.write(f"# {lease['host']} {lease['worker']} 第{lease['attempt']}次: {' '.join(command)}\n")
+            log.flush()
+            env = dict(os.environ, PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8")
+            group = ({"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP} if platform.system() == "Windows"
+                     else {"start_new_session": True})
+            proc = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env, **group)
+
+            def keep_alive():
+                while not stop.wait(self.lease_seconds / 4):
+                    try:
+                        self.heartbeat(job["id"], lease)
+                    except LeaseLost:
+                        lost.set()
+                        _terminate_tree(proc)
+                        return
+                    except OSError as e:
+                        # 共享存储暂时不可用时继续尝试，租约过期前恢复即可
+                        print(f"[队列] 更新心跳失败: {e}")
+
+            beat = threading.Thread(target=keep_alive, daemon=True)
+            beat.start()
+            try:
+                returncode = proc.wait()
+            except KeyboardInterrupt:
+                # 任务在独立的进程组中，收不到终端的 Ctrl+C
+                _terminate_tree(proc)
+                raise
+            finally:
+                stop.set()
+                beat.join()
+
+        if lost.is_set():
+            print(f"[队列] 任务 {job['id']} 的租约已被其他工作进程领取，停止执行")
+            return "lost"
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            tail = [line.rstrip() for line in f.readlines()[-RESULT_TAIL_LINES:]]
+        status = "done" if returncode == 0 else "failed"
+        self.record(job, lease, status, returncode, tail, time.monotonic() - start)
+        return status
+
+
+def worker_loop(queue, worker, poll_seconds=DEFAULT_POLL_SECONDS, drain=False):
+    """工作进程主循环：领取并执行任务
+
+    Args:
+        queue: WorkQueue
+        worker: 工作进程名称
+        poll_seconds: 没有任务时的等待时间（秒）
+        drain: 为True时队列中没有可领取的任务后退出
+    """
+    print(f"[{worker}] 开始处理队列: {queue.queue_dir}")
+    while True:
+        job, lease = queue.claim(worker)
+        if job is None:
+            if drain and not queue.status()["running"]:
+                break
+            time.sleep(poll_seconds)
+            continue
+        print(f"[{worker}] 执行任务 {job['id']}: {queue.describe(job)}")
+        status = queue.run_job(job, lease)
+        print(f"[{worker}] 任务 {job['id']}: {status}")
+    print(f"[{worker}] 队列已处理完")
+
+
+def _worker_process(index, poll_seconds, drain):
+    queue = WorkQueue.from_config()
+    worker = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    try:
+        worker_loop(queue, worker, poll_seconds, drain)
+    except KeyboardInterrupt:
+        # 未完成的任务在租约过期后由其他工作进程重新领取
+        print(f"[{worker}] 已停止")
+
+
+def main():
+    """主函数"""
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help"):
+        print("使用方法: python work_queue.py <submit|worker|status|retry> [参数...]")
+        print("  submit <子命令> <参数...>       放入队列，子命令: " + "、".join(QUEUE_COMMANDS))
+        print("  worker [--workers N] [--drain]  启动N个工作进程（默认1），--drain 处理完队列后退出")
+        print("  status                          查看等待中、执行中的任务和最近的结果")
+        print("  retry                           把失败的任务重新放回队列")
+        print("示例: python work_queue.py submit download https://www.youtube.com/watch?v=VIDEO_ID")
+        sys.exit(0 if args else 1)
+
+    config = load_optional_config()
+    queue = WorkQueue.from_config(config)
+    action = args[0]
+
+    if action == "submit":
+        if len(args) < 3:
+            print("错误: submit 需要子命令和参数")
+            sys.exit(1)
+        try:
+            job_id = queue.submit(args[1], args[2:])
+        except ValueError as e:
+            print(f"错误: {e}")
+            sys.exit(1)
+        print(f"已放入队列: {job_id}")
+
+    elif action == "worker":
+        workers = 1
+        if "--workers" in args:
+            index = args.index("--workers")
+            try:
+                workers = max(1, int(args[index + 1]))
+            except (IndexError, ValueError):
+                print("错误: --workers 需要一个整数")
+                sys.exit(1)
+        drain = "--drain" in args
+        poll_seconds = config.get("queuePollSeconds", DEFAULT_POLL_SECONDS)
+        if workers == 1:
+            _worker_process(0, poll_seconds, drain)
+            return
+        processes = [multiprocessing.Process(target=_worker_process, args=(i, poll_seconds, drain))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # 子进程同样收到中断信号，等待它们退出
+            for process in processes:
+                process.join()
+
+    elif action == "status":
+        state = queue.status()
+        print(f"队列目录: {queue.queue_dir}")
+        print(f"等待中: {len(state['pending'])}")
+        for job in state["pending"]:
+            print(f"  {job['id']}  {queue.describe(job)}")
+        print(f"执行中: {len(state['running'])}")
+        for job, lease in state["running"]:
+            age = time.time() - lease["heartbeat"]
+            expired = "，已过期" if time.time() > lease["expires"] else ""
+            print(f"  {job['id']}  {queue.describe(job)}  {lease['host']} {lease['worker']}（{age:.0f} 秒前心跳{expired}）")
+        done = sum(1 for r in state["results"] if r["status"] == "done")
+        print(f"已完成: {done}，失败: {len(state['results']) - done}")
+        for result in state["results"][-10:]:
+            print(f"  {result['id']}  {result['status']:<6}  {queue.describe(result)}  "
+                  f"{result['host']}  {result['duration']:.0f} 秒")
+
+    elif action == "retry":
+        print(f"已重新放回队列: {queue.retry_failed()} 个任务")
+
+    else:
+        print(f"错误: 未知的操作: {action}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()